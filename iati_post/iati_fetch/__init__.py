@@ -0,0 +1 @@
+default_app_config = "iati_fetch.apps.IatiFetchConfig"
@@ -9,3 +9,4 @@ admin.site.register(models.Organisation)
 admin.site.register(models.Request)
 admin.site.register(models.RequestCacheRecord)
 admin.site.register(models.Activity)
+admin.site.register(models.Job)
@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from psycopg2.extras import register_default_jsonb
+
+from iati_fetch import codec
 
 
 class IatiFetchConfig(AppConfig):
     name = "iati_fetch"
+
+    def ready(self):
+        # jsonb values (our JSONFields) are decoded by the same codec as they
+        # are encoded with
+        register_default_jsonb(globally=True, loads=codec.loads)
@@ -0,0 +1,41 @@
+"""
+JSON encoding and decoding, with orjson when it is installed
+
+Everything we cache, fetch from the registry and store as jsonb passes
+through here, so that one fast codec is used throughout.
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _dumps_stdlib(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+if orjson is not None:
+    NAME = "orjson"
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+    def dumps(value: Any) -> str:
+        """
+        Compact JSON text; values which orjson does not support (very large
+        integers, non-string keys) are encoded by the standard library
+        """
+        try:
+            return orjson.dumps(value).decode("utf-8")
+        except orjson.JSONEncodeError:
+            return _dumps_stdlib(value)
+
+
+else:  # pragma: no cover
+    NAME = "json"
+    loads = json.loads
+    dumps = _dumps_stdlib
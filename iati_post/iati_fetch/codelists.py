@@ -0,0 +1,97 @@
+"""
+A process-wide, in-memory lookup of IATI codelists
+
+Codelists change rarely but are read for every sector, country and
+transaction type we decode. They are loaded once per process with a single
+query; a version stamp in the shared cache tells every process to reload
+after a codelist refresh.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, NamedTuple, Union
+
+from django.apps import apps
+from django.core.cache import cache
+
+from iati_fetch.elements import narrative_text
+
+logger = logging.getLogger(__name__)
+
+CODELIST_VERSION_KEY = "iati_fetch.codelists.version"
+
+
+class Code(NamedTuple):
+    name: str
+    withdrawn: bool
+
+
+def codelist_registry_changed() -> None:
+    """
+    Tell every process that its codelists are out of date
+    """
+    cache.set(CODELIST_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+class CodelistRegistry:
+    """
+    `code -> Code(name, withdrawn)` maps for every codelist
+
+    Args:
+        check_interval: Seconds between checks of the shared version stamp
+    """
+
+    def __init__(self, check_interval: float = 60):
+        self.check_interval = check_interval
+        self._codelists: Union[None, Dict[str, Dict[str, Code]]] = None
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Code]]:
+        CodelistItem = apps.get_model("iati_fetch", "CodelistItem")
+        codelists: Dict[str, Dict[str, Code]] = {}
+        items = CodelistItem.objects.values_list(
+            "codelist__name", "code", "element", "withdrawn"
+        )
+        for codelist, code, element, withdrawn in items.order_by("pk").iterator():
+            codelists.setdefault(codelist, {})[code] = Code(
+                name=narrative_text(element.get("name")) or "", withdrawn=withdrawn
+            )
+        logger.debug("Loaded %s codelists", len(codelists))
+        return codelists
+
+    def _current(self) -> Dict[str, Dict[str, Code]]:
+        now = time.monotonic()
+        if self._codelists is not None and now - self._checked < self.check_interval:
+            return self._codelists
+        with self._lock:
+            version = cache.get(CODELIST_VERSION_KEY)
+            if self._codelists is None or version != self._version:
+                self._codelists = self._load()
+                self._version = version
+            self._checked = now
+            return self._codelists
+
+    def invalidate(self) -> None:
+        """
+        Reload on next use, in this process only
+        """
+        with self._lock:
+            self._codelists = None
+
+    def get(self, codelist: str) -> Dict[str, Code]:
+        return self._current().get(codelist, {})
+
+    def name(self, codelist: str, code: str, default: str = "") -> str:
+        found = self.get(codelist).get(code)
+        return found.name if found else default
+
+    def withdrawn(self, codelist: str, code: str) -> bool:
+        found = self.get(codelist).get(code)
+        return found.withdrawn if found else False
+
+
+registry = CodelistRegistry()
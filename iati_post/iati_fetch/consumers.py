@@ -1,37 +1,93 @@
+import asyncio
 import json
 import logging
-
-from channels.consumer import AsyncConsumer, SyncConsumer
-from channels.generic.websocket import AsyncWebsocketConsumer
-
-from . import requesters
+from typing import Any, Dict, List, Union
 
 from aiohttp import ClientSession
+from channels.consumer import AsyncConsumer
+from channels.db import database_sync_to_async
+from channels.generic.websocket import (
+    AsyncJsonWebsocketConsumer,
+    AsyncWebsocketConsumer,
+)
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import codec, coordinator, jobs, parsers, requesters, tasks
+from .models import Activity, OrganisationAbbreviation
+from .pagination import keyset_page, page_size
 
 logging.captureWarnings(True)
 logger = logging.getLogger(__name__)
 
+# The columns of each activity in a page of results
+RESULT_FIELDS = (
+    "identifier",
+    "reporting_org_ref",
+    "activity_status",
+    "default_currency",
+    "start_actual",
+    "end_actual",
+)
 
-class RequestConsumer(SyncConsumer):
+
+class RequestConsumer(AsyncConsumer):
     """
     Methods to fetch and cache URLs. Will cache contents
     of the given URL under a key composed of the URL and parameters.
+
+    Each worker holds one session, so connections are pooled across
+    messages, and fetches at most `fetch_limit` URLs at once.
     """
 
+    fetch_limit = 20
+
+    async def __call__(self, receive, send):
+        self.semaphore = asyncio.Semaphore(self.fetch_limit)
+        async with requesters.new_session() as self.session:
+            await super().__call__(receive, send)
+
+    @staticmethod
+    def requests(event) -> List[requesters.BaseRequest]:
+        """
+        The requests of an event: a batch as "requests" (each with a url,
+        method, params, expected_type) or "urls"; or a single one, as the
+        event's own url, method, params and expected_type
+        """
+        if "requests" in event:
+            return [requesters.BaseRequest.from_event(r) for r in event["requests"]]
+        if "urls" in event:
+            return [requesters.BaseRequest(url=url) for url in event["urls"]]
+        return [requesters.BaseRequest.from_event(event)]
+
+    async def _get(self, request: requesters.BaseRequest, refresh: bool) -> bool:
+        async with self.semaphore:
+            got = await request.get(session=self.session, refresh=refresh)
+        return got is not None
+
     async def get(self, event):
         """
-        Simple fetcher for a URL.
-        Returns cache content if there is a request hash;
-        otherwise fetches to the cache
-        and sends an 'ok' message
+        Fetch (or, with "refresh", fetch again) and cache a batch of URLs,
+        concurrently.
+        If the event has a "reply_channel", sends it a "request.fetched"
+        message with the URLs which were and were not fetched.
         """
-        request = requesters.BaseRequest.from_event()
-        async with ClientSession() as session:
-            await request.get(session=session)
+        requests = self.requests(event)
+        fetched = await asyncio.gather(
+            *[self._get(r, event.get("refresh", False)) for r in requests]
+        )
+        logger.info("Fetched %s of %s requests", sum(fetched), len(requests))
+        if event.get("reply_channel"):
+            await self.channel_layer.send(
+                event["reply_channel"],
+                {
+                    "type": "request.fetched",
+                    "ok": [r.url for r, ok in zip(requests, fetched) if ok],
+                    "failed": [r.url for r, ok in zip(requests, fetched) if not ok],
+                },
+            )
 
     async def clear_cache(self, event):
-        request = requesters.BaseRequest.from_event()
-        await request.drop()
+        await asyncio.gather(*[r.drop() for r in self.requests(event)])
 
 
 class IatiRequestConsumer(AsyncConsumer):
@@ -41,16 +97,33 @@ class IatiRequestConsumer(AsyncConsumer):
 
     async def parse_xml(self, event):
         """
-        Read an IATI xml file from cache and attempt to populate 
+        Read an IATI xml file from cache and attempt to populate
         Organisation(s) / Activit[y/ies] from it
 
         Args:
-            event: This should have a "url" like 'https://files.transparency.org/content/download/2279/14136/file/IATI_TIS_Organisation.xml'
+            event: This should have a "url" like
+                'https://files.transparency.org/content/download/2279/14136/file/IATI_TIS_Organisation.xml'  # noqa
 
         """
         url = requesters.IatiXMLRequest(event["url"])
         await url.to_instances()
 
+    async def ingest_shards(self, event):
+        """
+        Fetch and write the files of queued shards of an ingest, until none
+        are left; see `coordinator`
+
+        Args:
+            event: This should have the "run" id
+        """
+        await coordinator.process_run(event["run"], worker=self.channel_name)
+
+    async def jobs_drain(self, _):
+        """
+        Run queued fetch and parse jobs until there are none; see `jobs`
+        """
+        await jobs.drain(worker=self.channel_name)
+
     async def organisation_list_fetch(self, _):
         """
         This should put the list of organisations  to
@@ -101,22 +174,264 @@ class IatiConsumer(AsyncWebsocketConsumer):
 
 class IatiActivitiesConsumer(AsyncWebsocketConsumer):
     """
-    Creates and GETs an requesters.IatiXMLRequest object for one activities XML
-    TODO: This takes no options. It should take the URL of the activity to be collected.
+    Streams the activities of a cached IATI XML file, or of each of a
+    publisher's files, as they are parsed; a publisher's files are read from
+    cache, or fetched over the connection's session.
+
+    Send {"url": ...} or {"publisher": "ask"}, optionally with "chunk_size"
+    (activities per message) and "window" (messages sent before waiting for
+    an acknowledgement), each at most the consumer's own. Messages are:
+
+        {"event": "file", "url": ...}
+        {"event": "activities", "seq": 1, "url": ..., "activities": [...]}
+        {"event": "error", "url": ..., "error": ...}
+        {"event": "done", "activities": <count>, "seq": <last seq>}
+
+    A stream which fails ends with an "error" event without a "url".
+
+    Acknowledge each "activities" message with {"ack": <its seq>}. Each
+    holds at most `chunk_size` activities and, unless one activity is larger,
+    `chunk_bytes` of JSON.
     """
+
+    chunk_size = 100
+    chunk_bytes = 256 * 1024
+    window = 4
+
     async def connect(self):
+        self.session = requesters.new_session()
+        self.stream: Union[asyncio.Future, None] = None
+        self.sent = 0
+        self.acked = 0
+        self.acks = asyncio.Condition()
         await self.accept()
 
     async def receive(self, text_data=None, bytes_data=None):
+        try:
+            content = codec.loads(text_data or bytes_data)
+            assert isinstance(content, dict)
+        except (ValueError, AssertionError):
+            await self.send_event("error", error="Expected a JSON object")
+            return
+
+        try:
+            ack = self.count(content, "ack", 0)
+            chunk_size = min(
+                self.count(content, "chunk_size", self.chunk_size), self.chunk_size
+            )
+            window = min(self.count(content, "window", self.window), self.window)
+        except ValueError as e:
+            await self.send_event("error", error=str(e))
+            return
+
+        if "ack" in content:
+            async with self.acks:
+                self.acked = max(self.acked, ack)
+                self.acks.notify_all()
+        elif self.stream is not None and not self.stream.done():
+            await self.send_event("error", error="Already streaming")
+        elif "url" in content or "publisher" in content:
+            self.stream = asyncio.ensure_future(
+                self.run_stream(content, chunk_size=chunk_size, window=window)
+            )
+        else:
+            await self.send_event("error", error='Expected a "url" or "publisher"')
+
+    @staticmethod
+    def count(content: dict, key: str, default: int) -> int:
+        """
+        A whole number from the message, at least 1; `default` if it is missing
+
+        Raises:
+            ValueError: it is not a whole number
+        """
+        try:
+            value = int(content.get(key, default))
+        except (TypeError, ValueError):
+            raise ValueError(f'Expected "{key}" to be a whole number') from None
+        return max(1, value)
+
+    async def send_event(self, event: str, **data):
+        await self.send(text_data=codec.dumps({"event": event, **data}))
+
+    async def send_chunk(self, url: str, activities: List[str], window: int):
         """
-        Make a request for https://aidstream.org/files/xml/ask-activities.xml
+        Send already encoded activities once fewer than `window` messages
+        are waiting to be acknowledged
         """
-        request = requesters.IatiXMLRequest(
-            url="https://aidstream.org/files/xml/ask-activities.xml"
+        async with self.acks:
+            await self.acks.wait_for(lambda: self.sent - self.acked < window)
+        self.sent += 1
+        await self.send(
+            text_data=(
+                f'{{"event":"activities","seq":{self.sent},"url":{codec.dumps(url)},'
+                f'"activities":[{",".join(activities)}]}}'
+            )
         )
-        async with ClientSession() as session:
-            response_text = await request.get(session=session)
-        await self.send(text_data=json.dumps(response_text))
+
+    async def run_stream(self, content: dict, chunk_size: int, window: int):
+        try:
+            xml_requests = await self.stream_requests(content)
+            if xml_requests is None:
+                return
+            count = 0
+            for request in xml_requests:
+                count += await self.stream_file(request, chunk_size, window)
+        except asyncio.CancelledError:
+            # On disconnect; an Exception subclass before Python 3.8
+            raise
+        except Exception as e:
+            logger.error("Stream of %s failed", content, exc_info=True)
+            await self.send_event("error", error=repr(e))
+        else:
+            await self.send_event("done", activities=count, seq=self.sent)
+
+    async def stream_requests(
+        self, content: dict
+    ) -> Union[List[requesters.IatiXMLRequest], None]:
+        """
+        The files asked for: a known publisher's, as listed by the registry,
+        or a single file which has been cached already, since any other URL
+        would be fetched for whoever asked. None (with an error sent) if there
+        are none.
+        """
+        if "url" in content:
+            request = requesters.IatiXMLRequest(url=str(content["url"]))
+            if not await request.is_cached():
+                await self.send_event(
+                    "error",
+                    url=request.url,
+                    error="Not a cached file; ask for its publisher",
+                )
+                return None
+            return [request]
+        detail = requesters.OrganisationRequestDetail(
+            organisation_handle=str(content["publisher"])
+        )
+        known = await database_sync_to_async(
+            OrganisationAbbreviation.objects.filter(
+                pk=detail.organisation_handle, withdrawn=False
+            ).exists
+        )()
+        if not known or await detail.get(session=self.session) is None:
+            await self.send_event("error", url=detail.url, error="Publisher not found")
+            return None
+        return await detail.iati_xml_requests(session=self.session)
+
+    async def stream_file(
+        self, request: requesters.IatiXMLRequest, chunk_size: int, window: int
+    ) -> int:
+        await self.send_event("file", url=request.url)
+        got = await request.get(session=self.session)
+        if got is None:
+            await self.send_event("error", url=request.url, error="Download failed")
+            return 0
+
+        count = 0
+        chunk: List[str] = []
+        size = 0
+        try:
+            for name, activity in parsers.iter_children(got):
+                if name != "iati-activity":
+                    continue
+                encoded = codec.dumps(activity)
+                if chunk and (
+                    len(chunk) >= chunk_size or size + len(encoded) > self.chunk_bytes
+                ):
+                    await self.send_chunk(request.url, chunk, window)
+                    chunk, size = [], 0
+                chunk.append(encoded)
+                size += len(encoded)
+                count += 1
+        except parsers.PARSE_ERRORS as e:
+            await self.send_event("error", url=request.url, error=repr(e))
+        if chunk:
+            await self.send_chunk(request.url, chunk, window)
+        return count
 
     async def disconnect(self, close_code):
-        await self.close()
+        if self.stream is not None:
+            self.stream.cancel()
+        await self.session.close()
+
+
+def activity_page(
+    organisation_handle: str, after: Union[str, None], limit: int
+) -> Dict[str, Any]:
+    """
+    A page of a publisher's activities, in identifier order, from after the
+    identifier `after`
+    """
+    page = keyset_page(
+        Activity.objects.published_by(organisation_handle).values(*RESULT_FIELDS),
+        "identifier",
+        after=after,
+        limit=limit,
+    )
+    return {"activities": page.items, "next": page.next}
+
+
+class IngestConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Ingest one publisher's files, streaming progress as small messages; and
+    page through its activities.
+
+    Send {"action": "ingest", "publisher": "ask"} to start an ingest. Each
+    step arrives as it happens, as {"event": "files" | "downloaded" |
+    "written" | "error", "publisher": "ask", ...} (see
+    `tasks.publisher_ingest`), then {"event": "done", ...totals}.
+
+    Send {"action": "results", "publisher": "ask", "after": <identifier>,
+    "limit": 50} for {"event": "results", "activities": [...], "next":
+    <identifier of the last, or null at the end>}.
+    """
+
+    page_limit = 100
+
+    async def connect(self):
+        self.ingest: Union[asyncio.Future, None] = None
+        await self.accept()
+
+    async def receive_json(self, content, **kwargs):
+        action = content.get("action")
+        publisher = content.get("publisher")
+        if not publisher:
+            await self.send_json({"event": "error", "error": "No publisher"})
+        elif action == "ingest":
+            if self.ingest is not None and not self.ingest.done():
+                await self.send_json(
+                    {"event": "error", "error": "An ingest is already running"}
+                )
+                return
+            self.ingest = asyncio.ensure_future(self.run_ingest(publisher))
+        elif action == "results":
+            limit = page_size(content.get("limit"), default=self.page_limit)
+            page = await database_sync_to_async(activity_page)(
+                publisher, content.get("after"), limit
+            )
+            await self.send_json({"event": "results", "publisher": publisher, **page})
+        else:
+            await self.send_json({"event": "error", "error": f"No action {action}"})
+
+    async def run_ingest(self, publisher: str):
+        async def progress(event: str, **data):
+            await self.send_json({"event": event, "publisher": publisher, **data})
+
+        try:
+            totals = await tasks.publisher_ingest(publisher, progress=progress)
+        except asyncio.CancelledError:
+            # On disconnect; an Exception subclass before Python 3.8
+            raise
+        except Exception as e:
+            logger.error("Ingest of %s failed", publisher, exc_info=True)
+            await progress("error", error=repr(e))
+        else:
+            await progress("done", **totals)
+
+    async def disconnect(self, close_code):
+        if self.ingest is not None:
+            self.ingest.cancel()
+
+    @classmethod
+    async def encode_json(cls, content):
+        return json.dumps(content, cls=DjangoJSONEncoder)
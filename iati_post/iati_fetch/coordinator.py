@@ -0,0 +1,260 @@
+"""
+Ingest of IATI XML files spread over any number of channel workers
+
+The coordinator splits the files to ingest into shards, by host or by
+publisher, and records them (`IngestRun`, `IngestShard`). It sends a few
+messages to the "iati" channel, at most one per worker wanted, to wake
+workers up. Each `runworker iati` process, on any node, that gets one claims
+queued shards of the run from the database, one after another, until none
+are left. It fetches and writes their files, and reports a heartbeat between
+files. The coordinator waits for every shard to finish. It queues again the
+shards of workers which have stopped reporting, and wakes workers again while
+shards are queued.
+
+    ./manage.py ingest --shard-by host
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Union
+from urllib.parse import urlparse
+
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+
+from iati_fetch import requesters, tasks
+from iati_fetch.models import IngestRun, IngestShard, OrganisationAbbreviation
+
+logger = logging.getLogger(__name__)
+
+SHARD_BY = ("host", "publisher")
+
+
+def shard_key(request: requesters.IatiXMLRequest, by: str) -> str:
+    if by == "host":
+        return urlparse(request.url).netloc.lower()
+    if by == "publisher":
+        return request.organisation_handle or ""
+    raise ValueError(f"Shards are by one of {SHARD_BY}, not {by}")
+
+
+def shard(
+    requests: Iterable[requesters.IatiXMLRequest], by: str = "host", size: int = 20
+) -> Dict[str, List[List[requesters.IatiXMLRequest]]]:
+    """
+    Group requests by host or by publisher, in shards of at most `size`
+
+    By host, a worker fetches from one server in turn rather than many
+    workers fetching from it at once (unless it has more than `size` files).
+    """
+    groups: Dict[str, List[requesters.IatiXMLRequest]] = defaultdict(list)
+    for request in requests:
+        groups[shard_key(request, by)].append(request)
+    return {
+        key: [group[start:][:size] for start in range(0, len(group), size)]
+        for key, group in sorted(groups.items())
+    }
+
+
+def create_run(
+    shards: Dict[str, List[List[requesters.IatiXMLRequest]]], by: str
+) -> IngestRun:
+    with transaction.atomic():
+        run = IngestRun.objects.create(shard_by=by)
+        IngestShard.objects.bulk_create(
+            IngestShard(
+                run=run,
+                key=key,
+                requests=[[r.url, r.organisation_handle] for r in requests],
+            )
+            for key, key_shards in shards.items()
+            for requests in key_shards
+        )
+    return run
+
+
+def finish_run(run: IngestRun) -> Dict[str, int]:
+    """
+    Record the run as finished, and as the last ingest of each publisher
+    whose shards were all done
+    """
+    run.finished = timezone.now()
+    run.save(update_fields=["finished"])
+    publishers, incomplete = set(), set()
+    for status, requests in run.shards.values_list("status", "requests"):
+        handles = {handle for _, handle in requests if handle}
+        publishers |= handles
+        if status != IngestShard.DONE:
+            incomplete |= handles
+    OrganisationAbbreviation.mark_ingested(publishers - incomplete)
+    return run.progress()
+
+
+def shard_requests(shard: IngestShard) -> List[requesters.IatiXMLRequest]:
+    return [
+        requesters.IatiXMLRequest(url=url, organisation_handle=handle)
+        for url, handle in shard.requests
+    ]
+
+
+async def process_run(run_id: int, worker: str) -> int:
+    """
+    Claim the queued shards of a run for `worker`, and process each in turn,
+    until none are left
+
+    Returns:
+        The number of shards processed
+    """
+    processed = 0
+    while True:
+        claimed = await database_sync_to_async(IngestShard.claim_next)(run_id, worker)
+        if claimed is None:
+            return processed
+        await _process(claimed, worker)
+        processed += 1
+
+
+async def process_shard(pk: int, worker: str) -> bool:
+    """
+    Claim a shard for `worker`, then fetch and write each of its files
+
+    Returns:
+        Whether the shard was processed to the end
+    """
+    claimed = await database_sync_to_async(IngestShard.claim)(pk, worker)
+    if claimed is None:
+        logger.debug("Shard %s is not queued", pk)
+        return False
+    return await _process(claimed, worker)
+
+
+async def _process(claimed: IngestShard, worker: str) -> bool:
+    logger.info("%s processing shard %s", worker, claimed)
+    missing = 0
+    try:
+        async with requesters.new_session() as session:
+            for request in shard_requests(claimed):
+                if not await database_sync_to_async(claimed.beat)():
+                    logger.warning("Shard %s was reassigned; stopping", claimed.pk)
+                    return False
+                # As `tasks.publisher_ingest`: a file which could not be
+                # fetched is missing, and one which is not XML is written as
+                # empty
+                if await request.get(session=session) is None:
+                    missing += 1
+                    continue
+                await request.to_instances()
+    except Exception as e:
+        logger.error("Shard %s failed: %s", claimed.pk, e, exc_info=True)
+        await database_sync_to_async(claimed.finish)(failed=True)
+        return False
+    if missing:
+        # Its publishers are not yet ingested
+        logger.warning("Shard %s: %s files could not be fetched", claimed.pk, missing)
+    return await database_sync_to_async(claimed.finish)(failed=bool(missing))
+
+
+@dataclass
+class Coordinator:
+    """
+    Plan, dispatch and follow an ingest
+
+    Args:
+        channel: The channel which workers of `IatiRequestConsumer` receive
+        shard_by: "host" or "publisher"
+        shard_size: Files per shard
+        heartbeat_timeout: Seconds without a heartbeat before a running
+            shard is queued again. A worker reports between files, so this is
+            longer than the slowest file.
+        poll_interval: Seconds between checks of the shards' progress
+        retries: Times a shard is queued again before it fails
+        workers: Workers woken at once: at most this many messages are sent
+        wake_interval: Seconds before workers are woken again while shards
+            are queued; no longer than the channel layer's message expiry
+    """
+
+    channel: str = "iati"
+    shard_by: str = "host"
+    shard_size: int = 20
+    heartbeat_timeout: float = 600
+    poll_interval: float = 5
+    retries: int = 3
+    workers: int = 10
+    wake_interval: float = 60
+    # Without `organisations`, only publishers not yet ingested since they
+    # were added or restored; see `tasks.xml_requests_get`
+    incremental: bool = False
+
+    async def plan(self, organisations: Union[List[str], None] = None) -> IngestRun:
+        """
+        Record the shards of the XML files of `organisations` (by default,
+        every organisation)
+        """
+        xml_requests = await tasks.xml_requests_get(
+            organisations, incremental=self.incremental
+        )
+        shards = shard(xml_requests, by=self.shard_by, size=self.shard_size)
+        run = await database_sync_to_async(create_run)(shards, self.shard_by)
+        logger.info(
+            "Ingest %s: %s files in %s shards",
+            run.pk,
+            len(xml_requests),
+            sum(len(key_shards) for key_shards in shards.values()),
+        )
+        return run
+
+    async def dispatch(self, run_id: int, shards: int) -> None:
+        """
+        Wake up to `workers` workers, one for each of `shards` queued shards
+        of a run
+        """
+        channel_layer = get_channel_layer()
+        for _ in range(min(shards, self.workers)):
+            try:
+                await channel_layer.send(
+                    self.channel, {"type": "ingest.shards", "run": run_id}
+                )
+            except ChannelFull:
+                # Workers have messages enough waiting
+                logger.warning("Channel %s is full", self.channel)
+                return
+
+    async def wait(self, run: IngestRun) -> Dict[str, int]:
+        """
+        Wait for every shard of `run` to finish, queueing again those which
+        are stale
+
+        Returns:
+            The number of shards in each status
+        """
+        loop = asyncio.get_event_loop()
+        woken = loop.time()
+        while not await database_sync_to_async(lambda: run.done)():
+            await asyncio.sleep(self.poll_interval)
+            reassigned = await database_sync_to_async(run.reassign_stale)(
+                self.heartbeat_timeout, self.retries
+            )
+            if reassigned or loop.time() - woken >= self.wake_interval:
+                queued = await database_sync_to_async(
+                    run.shards.filter(status=IngestShard.QUEUED).count
+                )()
+                await self.dispatch(run.pk, queued)
+                woken = loop.time()
+        progress = await database_sync_to_async(finish_run)(run)
+        logger.info("Ingest %s finished: %s", run.pk, progress)
+        return progress
+
+    async def run(
+        self, organisations: Union[List[str], None] = None, wait: bool = True
+    ) -> IngestRun:
+        run = await self.plan(organisations)
+        shards = await database_sync_to_async(run.shards.count)()
+        await self.dispatch(run.pk, shards)
+        if wait:
+            await self.wait(run)
+        return run
@@ -0,0 +1,263 @@
+"""
+Helpers to read values out of xmltodict-shaped IATI elements
+"""
+
+import datetime
+import decimal
+import logging
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# The root element of an IATI XML file, and the elements it holds
+IATI_ROOTS = {
+    "iati-activities": "iati-activity",
+    "iati-organisations": "iati-organisation",
+}
+
+# IATI 2.x activity-date type codes, and the IATI 1.x names for them
+ACTIVITY_DATE_TYPES = {
+    "start_planned": {"1", "start-planned"},
+    "start_actual": {"2", "start-actual"},
+    "end_planned": {"3", "end-planned"},
+    "end_actual": {"4", "end-actual"},
+}
+
+# Sector vocabularies which hold OECD DAC 5-digit purpose codes
+DAC_SECTOR_VOCABULARIES = {None, "1", "DAC"}
+
+TRANSACTION_TYPE_COMMITMENT = "2"
+TRANSACTION_TYPE_DISBURSEMENT = "3"
+
+# IATI 1.x transaction type codes, as their IATI 2.x equivalent
+TRANSACTION_TYPES_V1 = {
+    "IF": "1",
+    "C": "2",
+    "D": "3",
+    "E": "4",
+    "IR": "5",
+    "LR": "6",
+    "R": "7",
+    "QP": "8",
+    "QS": "9",
+    "CG": "10",
+}
+
+# Larger than this does not fit Transaction.value and is surely a data error
+MAX_VALUE = decimal.Decimal("1e18")
+
+
+def as_list(value: Any) -> list:
+    """
+    xmltodict returns a single child as a dict and repeated children as a list
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def root_children(document: Any, root: str, name: str) -> list:
+    """
+    The <name> children of a parsed document's <root> element, or [] if the
+    document has some other root
+    """
+    if not isinstance(document, dict):
+        return []
+    parent = document.get(root)
+    if not isinstance(parent, dict):
+        return []
+    return as_list(parent.get(name))
+
+
+def iati_root(document: Any) -> Tuple[Union[str, None], list]:
+    """
+    The root of a parsed IATI file ("iati-activities" or "iati-organisations")
+    and the elements under it; (None, []) if it is not an IATI file
+    """
+    if isinstance(document, dict):
+        for root, name in IATI_ROOTS.items():
+            if root in document:
+                return root, root_children(document, root, name)
+    return None, []
+
+
+def attribute(element: Any, name: str) -> Union[str, None]:
+    """
+    Read "@name" from an element, if the element has attributes at all
+    """
+    if not isinstance(element, dict):
+        return None
+    value = element.get(f"@{name}")
+    if isinstance(value, str):
+        value = value.strip()
+    return value or None
+
+
+def child_attribute(element: dict, child: str, name: str) -> Union[str, None]:
+    """
+    Read "@name" from the first "child" of an element
+    """
+    children = as_list(element.get(child))
+    if not children:
+        return None
+    return attribute(children[0], name)
+
+
+def text(element: Any) -> Union[str, None]:
+    """
+    Element text; xmltodict gives a plain string unless there are attributes
+    """
+    if isinstance(element, dict):
+        element = element.get("#text")
+    if isinstance(element, str):
+        return element.strip() or None
+    return None
+
+
+def narrative_text(element: Any) -> Union[str, None]:
+    """
+    The text of the first <narrative> of an element, like <name> or <title>
+    """
+    if not isinstance(element, dict):
+        return None
+    for narrative in as_list(element.get("narrative")):
+        value = text(narrative)
+        if value:
+            return value
+    return None
+
+
+def iso_date(value: Union[str, None]) -> Union[datetime.date, None]:
+    """
+    Parse the date part of an IATI "iso-date"; bad values are dropped
+    """
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value[:10])
+    except ValueError:
+        logger.debug("Invalid iso-date %s", value)
+        return None
+
+
+def codelist_item_withdrawn(item: dict) -> bool:
+    return (
+        attribute(item, "status") == "withdrawn"
+        or attribute(item, "withdrawal-date") is not None
+    )
+
+
+def reporting_org_ref(activity: dict) -> Union[str, None]:
+    return child_attribute(activity, "reporting-org", "ref")
+
+
+def activity_status(activity: dict) -> Union[str, None]:
+    return child_attribute(activity, "activity-status", "code")
+
+
+def default_currency(activity: dict) -> Union[str, None]:
+    return attribute(activity, "default-currency")
+
+
+def sector_codes(activity: dict) -> List[str]:
+    codes = []
+    for sector in as_list(activity.get("sector")):
+        code = attribute(sector, "code")
+        if code and attribute(sector, "vocabulary") in DAC_SECTOR_VOCABULARIES:
+            codes.append(code)
+    return codes
+
+
+def recipient_countries(activity: dict) -> List[str]:
+    codes = []
+    for country in as_list(activity.get("recipient-country")):
+        code = attribute(country, "code")
+        if code:
+            codes.append(code.upper())
+    return codes
+
+
+def activity_date(date_type: str) -> Callable[[dict], Union[datetime.date, None]]:
+    def extract(activity: dict) -> Union[datetime.date, None]:
+        for date in as_list(activity.get("activity-date")):
+            if attribute(date, "type") in ACTIVITY_DATE_TYPES[date_type]:
+                return iso_date(attribute(date, "iso-date"))
+        return None
+
+    return extract
+
+
+# Activity model columns which are materialized from the activity element
+ACTIVITY_FIELDS: Dict[str, Callable[[dict], Any]] = {
+    "reporting_org_ref": reporting_org_ref,
+    "activity_status": activity_status,
+    "default_currency": default_currency,
+    "sector_codes": sector_codes,
+    "recipient_countries": recipient_countries,
+    "start_planned": activity_date("start_planned"),
+    "start_actual": activity_date("start_actual"),
+    "end_planned": activity_date("end_planned"),
+    "end_actual": activity_date("end_actual"),
+}
+
+
+def activity_fields(activity: dict) -> Dict[str, Any]:
+    """
+    Column values for the "hot" fields of an <iati-activity> element
+    """
+    return {name: extract(activity) for name, extract in ACTIVITY_FIELDS.items()}
+
+
+def transaction_type(transaction: dict) -> Union[str, None]:
+    code = child_attribute(transaction, "transaction-type", "code")
+    return TRANSACTION_TYPES_V1.get(code, code)
+
+
+def transaction_value(transaction: dict) -> Union[decimal.Decimal, None]:
+    value = text(transaction.get("value"))
+    if value is None:
+        return None
+    try:
+        amount = decimal.Decimal(value.replace(",", ""))
+    except decimal.InvalidOperation:
+        logger.debug("Invalid transaction value %s", value)
+        return None
+    if not amount.is_finite() or abs(amount) >= MAX_VALUE:
+        logger.debug("Transaction value out of range %s", value)
+        return None
+    return amount
+
+
+def transaction_value_date(transaction: dict) -> Union[datetime.date, None]:
+    return iso_date(
+        child_attribute(transaction, "value", "value-date")
+        or child_attribute(transaction, "transaction-date", "iso-date")
+    )
+
+
+def transaction_sector_code(transaction: dict) -> Union[str, None]:
+    for sector in as_list(transaction.get("sector")):
+        if attribute(sector, "vocabulary") in DAC_SECTOR_VOCABULARIES:
+            return attribute(sector, "code")
+    return None
+
+
+def transaction_fields(
+    transaction: dict, default_currency: Union[str, None] = None
+) -> Dict[str, Any]:
+    """
+    Column values for a <transaction> element; currency falls back to the
+    activity's default currency
+    """
+    return {
+        "transaction_type": transaction_type(transaction),
+        "value": transaction_value(transaction),
+        "value_date": transaction_value_date(transaction),
+        "currency": child_attribute(transaction, "value", "currency")
+        or default_currency,
+        "provider_org_ref": child_attribute(transaction, "provider-org", "ref"),
+        "receiver_org_ref": child_attribute(transaction, "receiver-org", "ref"),
+        "sector_code": transaction_sector_code(transaction),
+    }
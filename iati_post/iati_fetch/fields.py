@@ -0,0 +1,16 @@
+from django.contrib.postgres import fields
+from psycopg2.extras import Json
+
+from iati_fetch import codec
+
+
+class JSONField(fields.JSONField):
+    """
+    A jsonb field which is encoded by `codec`; it is decoded by `codec` too,
+    see `IatiFetchConfig.ready`
+    """
+
+    def get_prep_value(self, value):
+        if value is not None:
+            return Json(value, dumps=codec.dumps)
+        return value
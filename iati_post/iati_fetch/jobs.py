@@ -0,0 +1,473 @@
+"""
+A durable queue of fetch and parse jobs
+
+Jobs are rows of `models.Job`, so nothing is lost when a worker restarts or a
+channel message expires. Workers claim the highest priority jobs first
+(`PRIORITY_INTERACTIVE` refreshes jump ahead of `PRIORITY_BULK` crawls) and
+hold each for a visibility timeout; a job whose worker has gone is claimed
+again once the timeout passes. A failed job is retried after a growing delay
+until its attempts run out, then kept as "dead" for inspection. A job with a
+`dedupe_key` is not queued twice: while one with the same key is queued or
+running, enqueueing returns that one instead, raised to the new priority if
+that is higher.
+
+Channel messages only wake workers up:
+
+    job = jobs.enqueue("parse", {"url": url, "organisation_handle": "ask"})
+    async_to_sync(jobs.notify)()
+
+and `./manage.py work_jobs` drains the queue without channels at all.
+`LocalJobQueue` stands in for the database in tests.
+"""
+
+import asyncio
+import copy
+import datetime
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, List, Union
+
+from aiohttp import ClientSession
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from iati_fetch import requesters, tasks
+from iati_fetch.models import Job, Organisation, OrganisationAbbreviation
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_BULK = 0
+PRIORITY_INTERACTIVE = 100
+
+# Seconds a worker holds a job before another may take it
+VISIBILITY_TIMEOUT = 600
+# Seconds before the first retry of a failed job; doubled for each later one
+RETRY_DELAY = 30
+
+
+class JobError(Exception):
+    """
+    Raised by a handler for a job which did not succeed, and may be retried
+    """
+
+    pass
+
+
+def retry_at(job: Job, now: datetime.datetime) -> datetime.datetime:
+    return now + datetime.timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+
+
+def settle(job: Job, error: Union[str, None], retry: bool = True) -> None:
+    """
+    Set a claimed job's status after it has run: done, queued for a retry, or
+    dead
+    """
+    now = timezone.now()
+    job.worker = ""
+    job.error = error or ""
+    if error is None:
+        job.status, job.finished = Job.DONE, now
+    elif retry and job.attempts < job.max_attempts:
+        job.status, job.available_at = Job.QUEUED, retry_at(job, now)
+    else:
+        job.status, job.finished = Job.DEAD, now
+        logger.error("Job %s is dead: %s", job.pk, error)
+
+
+class DatabaseJobQueue:
+    """
+    Jobs as `models.Job` rows. Many workers claim at once without waiting on
+    each other: rows being claimed are locked and skipped.
+    """
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        priority: int = PRIORITY_BULK,
+        max_attempts: int = 5,
+        dedupe_key: Union[str, None] = None,
+    ) -> Job:
+        while True:
+            try:
+                with transaction.atomic():
+                    return Job.objects.create(
+                        kind=kind,
+                        payload=payload,
+                        priority=priority,
+                        max_attempts=max_attempts,
+                        dedupe_key=dedupe_key,
+                    )
+            except IntegrityError:
+                if dedupe_key is None:
+                    raise
+            # Unless it has finished since; raised to this priority, so that a
+            # refresh asked for by a user does not wait behind a crawl
+            active = Job.objects.filter(dedupe_key=dedupe_key, status__in=Job.ACTIVE)
+            active.filter(priority__lt=priority).update(priority=priority)
+            job = active.first()
+            if job is not None:
+                return job
+
+    def enqueue_many(
+        self,
+        kind: str,
+        payloads: List[dict],
+        priority: int = PRIORITY_BULK,
+        dedupe_keys: Union[List[str], None] = None,
+    ) -> None:
+        """
+        Queue many jobs in bulk; those whose `dedupe_keys` are queued or
+        running already are left out
+        """
+        dedupe_keys = dedupe_keys or [None] * len(payloads)
+        Job.objects.bulk_create(
+            [
+                Job(kind=kind, payload=payload, priority=priority, dedupe_key=key)
+                for payload, key in zip(payloads, dedupe_keys)
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def claim(
+        self, worker: str, limit: int = 1, timeout: float = VISIBILITY_TIMEOUT
+    ) -> List[Job]:
+        """
+        Take up to `limit` of the highest priority jobs which are available
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(
+                Job.objects.select_for_update(skip_locked=True)
+                .filter(status__in=Job.ACTIVE, available_at__lte=now)
+                .order_by("-priority", "available_at", "pk")[:limit]
+            )
+            # The lease of a job with no attempts left has run out
+            expired = [job for job in jobs if job.attempts >= job.max_attempts]
+            for job in expired:
+                self._settle(job, "Visibility timeout", retry=False)
+
+            jobs = [job for job in jobs if job not in expired]
+            until = now + datetime.timedelta(seconds=timeout)
+            Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=Job.RUNNING,
+                worker=worker,
+                attempts=F("attempts") + 1,
+                available_at=until,
+            )
+        for job in jobs:
+            job.status, job.worker, job.available_at = Job.RUNNING, worker, until
+            job.attempts += 1
+        return jobs
+
+    def _settle(self, job: Job, error: Union[str, None], retry: bool = True) -> bool:
+        # A job claimed again since has a different number of attempts
+        held = Job.objects.filter(pk=job.pk, status=Job.RUNNING, attempts=job.attempts)
+        settle(job, error, retry)
+        return bool(
+            held.update(
+                status=job.status,
+                worker=job.worker,
+                error=job.error,
+                available_at=job.available_at,
+                finished=job.finished,
+            )
+        )
+
+    def complete(self, job: Job) -> bool:
+        """
+        Returns:
+            False if the job's lease had expired and another worker has it
+        """
+        return self._settle(job, None)
+
+    def fail(self, job: Job, error: str, retry: bool = True) -> bool:
+        return self._settle(job, error, retry)
+
+    def touch(self, job: Job, timeout: float = VISIBILITY_TIMEOUT) -> bool:
+        """
+        Extend a long job's lease
+        """
+        job.available_at = timezone.now() + datetime.timedelta(seconds=timeout)
+        return bool(
+            Job.objects.filter(
+                pk=job.pk, status=Job.RUNNING, attempts=job.attempts
+            ).update(available_at=job.available_at)
+        )
+
+
+class LocalJobQueue(DatabaseJobQueue):
+    """
+    The same queue held in memory, for tests
+    """
+
+    def __init__(self):
+        self.jobs: Dict[int, Job] = {}
+        self.ids = itertools.count(1)
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        priority: int = PRIORITY_BULK,
+        max_attempts: int = 5,
+        dedupe_key: Union[str, None] = None,
+    ) -> Job:
+        if dedupe_key is not None:
+            for job in self.jobs.values():
+                if job.dedupe_key == dedupe_key and job.status in Job.ACTIVE:
+                    job.priority = max(job.priority, priority)
+                    return job
+        job = Job(
+            pk=next(self.ids),
+            kind=kind,
+            payload=payload,
+            priority=priority,
+            max_attempts=max_attempts,
+            dedupe_key=dedupe_key,
+        )
+        self.jobs[job.pk] = job
+        return job
+
+    def enqueue_many(
+        self,
+        kind: str,
+        payloads: List[dict],
+        priority: int = PRIORITY_BULK,
+        dedupe_keys: Union[List[str], None] = None,
+    ) -> None:
+        dedupe_keys = dedupe_keys or [None] * len(payloads)
+        for payload, key in zip(payloads, dedupe_keys):
+            self.enqueue(kind, payload, priority, dedupe_key=key)
+
+    def claim(
+        self, worker: str, limit: int = 1, timeout: float = VISIBILITY_TIMEOUT
+    ) -> List[Job]:
+        now = timezone.now()
+        available = sorted(
+            (
+                job
+                for job in self.jobs.values()
+                if job.status in Job.ACTIVE and job.available_at <= now
+            ),
+            key=lambda job: (-job.priority, job.available_at, job.pk),
+        )
+        claimed = []
+        for job in available[:limit]:
+            if job.attempts >= job.max_attempts:
+                settle(job, "Visibility timeout", retry=False)
+                continue
+            job.status, job.worker = Job.RUNNING, worker
+            job.available_at = now + datetime.timedelta(seconds=timeout)
+            job.attempts += 1
+            # The worker's copy, as if it had been read from the database
+            claimed.append(copy.copy(job))
+        return claimed
+
+    def _settle(self, job: Job, error: Union[str, None], retry: bool = True) -> bool:
+        held = self.jobs[job.pk]
+        if held.status != Job.RUNNING or held.attempts != job.attempts:
+            return False
+        settle(held, error, retry)
+        settle(job, error, retry)
+        return True
+
+    def touch(self, job: Job, timeout: float = VISIBILITY_TIMEOUT) -> bool:
+        held = self.jobs[job.pk]
+        if held.status != Job.RUNNING or held.attempts != job.attempts:
+            return False
+        held.available_at = job.available_at = timezone.now() + datetime.timedelta(
+            seconds=timeout
+        )
+        return True
+
+
+queue = DatabaseJobQueue()
+
+
+async def fetch(payload: dict, session: ClientSession) -> None:
+    """
+    Get (and cache) a URL; the payload is a `BaseRequest`'s url, method,
+    params and expected_type
+    """
+    request = requesters.BaseRequest.from_event(payload)
+    if await request.get(session=session) is None:
+        raise JobError(f"Could not fetch {request.url}")
+
+
+async def parse(payload: dict, session: ClientSession) -> None:
+    """
+    Get an IATI XML file and write its activities or organisations; the
+    payload is its url and organisation_handle
+    """
+    request = requesters.IatiXMLRequest(**payload)
+    if await request.get(session=session) is None:
+        raise JobError(f"Could not fetch {request.url}")
+    await request.to_instances()
+
+
+async def refresh(payload: dict, session: ClientSession) -> None:
+    """
+    Fetch a publisher's files again and write them; the payload is its
+    organisation_handle
+    """
+    totals = await tasks.publisher_ingest(
+        payload["organisation_handle"], session=session, refresh=True
+    )
+    if totals["errors"] and not (totals["activities"] or totals["organisations"]):
+        raise JobError(f"Nothing written, with {totals['errors']} errors")
+
+
+def queue_publisher_refreshes(priority: int = PRIORITY_BULK) -> None:
+    """
+    Queue a refresh of every publisher which is not withdrawn, in bulk
+    """
+    handles = list(
+        OrganisationAbbreviation.objects.filter(withdrawn=False).values_list(
+            "pk", flat=True
+        )
+    )
+    queue.enqueue_many(
+        "refresh",
+        [{"organisation_handle": handle} for handle in handles],
+        priority,
+        dedupe_keys=[f"refresh:{handle}" for handle in handles],
+    )
+
+
+async def refresh_all(payload: dict, session: ClientSession) -> None:
+    """
+    Queue a refresh of every publisher; the payload is their jobs' priority
+    """
+    await database_sync_to_async(queue_publisher_refreshes)(
+        payload.get("priority", PRIORITY_BULK)
+    )
+
+
+async def delete_all(payload: dict, session: ClientSession) -> None:
+    """
+    Delete every organisation and activity; the payload is empty
+    """
+    await database_sync_to_async(Organisation.delete_published)([])
+
+
+# Job kinds, and what runs them
+HANDLERS: Dict[str, Callable[[dict, ClientSession], Awaitable[None]]] = {
+    "fetch": fetch,
+    "parse": parse,
+    "refresh": refresh,
+    "refresh_all": refresh_all,
+    "delete_all": delete_all,
+}
+
+
+def enqueue(kind: str, payload: dict, priority: int = PRIORITY_BULK, **kwargs) -> Job:
+    assert kind in HANDLERS, f"No handler for {kind} jobs"
+    return queue.enqueue(kind, payload, priority=priority, **kwargs)
+
+
+def enqueue_refresh(organisation_handle: str, priority: int = PRIORITY_BULK) -> Job:
+    """
+    Queue a refresh of a publisher, unless one is queued or running already
+    """
+    return enqueue(
+        "refresh",
+        {"organisation_handle": organisation_handle},
+        priority,
+        dedupe_key=f"refresh:{organisation_handle}",
+    )
+
+
+def enqueue_refresh_all(priority: int = PRIORITY_BULK) -> Job:
+    """
+    Queue one job which queues a refresh of every publisher, unless it is
+    queued or running already
+    """
+    return enqueue(
+        "refresh_all", {"priority": priority}, priority, dedupe_key="refresh_all"
+    )
+
+
+def enqueue_delete_all() -> Job:
+    """
+    Queue a deletion of every organisation and activity, unless one is queued
+    or running already
+    """
+    return enqueue("delete_all", {}, PRIORITY_INTERACTIVE, dedupe_key="delete_all")
+
+
+async def notify(channel: str = "iati") -> None:
+    """
+    Wake the workers of a channel to drain the queue
+    """
+    await get_channel_layer().send(channel, {"type": "jobs.drain"})
+
+
+async def heartbeat(job: Job, jobs: DatabaseJobQueue, timeout: float) -> None:
+    """
+    Extend a running job's lease every third of its timeout, so that a long
+    job is not claimed again by another worker
+    """
+    while True:
+        await asyncio.sleep(timeout / 3)
+        if not await database_sync_to_async(jobs.touch)(job, timeout):
+            logger.warning("Job %s is no longer held by this worker", job)
+            return
+
+
+async def run(
+    job: Job,
+    session: ClientSession,
+    jobs: DatabaseJobQueue,
+    timeout: float = VISIBILITY_TIMEOUT,
+) -> None:
+    handler = HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            await database_sync_to_async(jobs.fail)(
+                job, f"No handler for {job.kind} jobs", retry=False
+            )
+            return
+        beat = asyncio.ensure_future(heartbeat(job, jobs, timeout))
+        try:
+            await handler(job.payload, session)
+        finally:
+            beat.cancel()
+    except Exception as e:
+        logger.warning("Job %s failed (attempt %s): %r", job, job.attempts, e)
+        logger.debug(e, exc_info=True)
+        await database_sync_to_async(jobs.fail)(job, repr(e))
+    else:
+        await database_sync_to_async(jobs.complete)(job)
+
+
+async def drain(
+    worker: str,
+    jobs: DatabaseJobQueue = None,
+    batch: int = 10,
+    session: Union[ClientSession, None] = None,
+    timeout: float = VISIBILITY_TIMEOUT,
+) -> int:
+    """
+    Run jobs, `batch` at a time, until none are available; each job's lease
+    of `timeout` seconds is extended while it runs
+
+    Returns:
+        The number of jobs run
+    """
+    jobs = jobs or queue
+    if session is None:
+        async with requesters.new_session() as session:
+            return await drain(worker, jobs, batch, session, timeout)
+
+    ran = 0
+    while True:
+        claimed = await database_sync_to_async(jobs.claim)(worker, batch, timeout)
+        if not claimed:
+            return ran
+        await asyncio.gather(*[run(job, session, jobs, timeout) for job in claimed])
+        ran += len(claimed)
@@ -0,0 +1,82 @@
+import random
+import time
+
+from django.contrib.postgres.fields.jsonb import JsonAdapter
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from iati_fetch.management.synthetic import synthetic_activity
+
+INDEXES = {
+    "btree": "CREATE INDEX ON benchmark_activity (element)",
+    "gin": "CREATE INDEX ON benchmark_activity USING gin (element jsonb_path_ops)",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ingest and containment (@>) query times on activity elements "
+        "with a btree index and with a GIN jsonb_path_ops index"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--activities", type=int, default=20000)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--batch", type=int, default=1000)
+
+    def handle(self, *args, activities, queries, batch, **options):
+        rng = random.Random(0)
+        elements = [synthetic_activity(i, rng) for i in range(activities)]
+        probes = [
+            {"reporting-org": {"@ref": f"XM-ORG-{rng.randrange(200)}"}}
+            for _ in range(queries)
+        ]
+
+        for name, create_index in INDEXES.items():
+            with connection.cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS benchmark_activity")
+                cursor.execute(
+                    "CREATE TEMP TABLE benchmark_activity "
+                    "(identifier text PRIMARY KEY, element jsonb)"
+                )
+                cursor.execute(create_index)
+
+                start = time.perf_counter()
+                for offset in range(0, len(elements), batch):
+                    chunk = elements[offset:][:batch]
+                    cursor.execute(
+                        "INSERT INTO benchmark_activity (identifier, element) VALUES "
+                        + ", ".join(["(%s, %s)"] * len(chunk)),
+                        [
+                            value
+                            for element in chunk
+                            for value in (
+                                element["iati-identifier"],
+                                JsonAdapter(element),
+                            )
+                        ],
+                    )
+                ingest = time.perf_counter() - start
+                cursor.execute("ANALYZE benchmark_activity")
+
+                start = time.perf_counter()
+                matched = 0
+                for probe in probes:
+                    cursor.execute(
+                        "SELECT count(*) FROM benchmark_activity WHERE element @> %s",
+                        [JsonAdapter(probe)],
+                    )
+                    matched += cursor.fetchone()[0]
+                query = time.perf_counter() - start
+
+                cursor.execute(
+                    "SELECT pg_size_pretty(pg_indexes_size('benchmark_activity'))"
+                )
+                size = cursor.fetchone()[0]
+                cursor.execute("DROP TABLE benchmark_activity")
+
+            self.stdout.write(
+                f"{name:>6}: ingest {activities} activities {ingest:.2f}s, "
+                f"{queries} @> queries {query * 1000 / queries:.2f}ms each "
+                f"({matched} rows), indexes {size}"
+            )
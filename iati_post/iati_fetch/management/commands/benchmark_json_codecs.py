@@ -0,0 +1,45 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from psycopg2.extras import Json
+
+from iati_fetch import codec
+from iati_fetch.management.synthetic import synthetic_package_search
+
+CODECS = {"json": (json.loads, json.dumps), codec.NAME: (codec.loads, codec.dumps)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the standard library's JSON with our codec on a registry "
+        "package_search response: cache decode, and encode for a jsonb column"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--datasets", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def best(self, repeat, function, *args):
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(*args)
+            seconds.append(time.perf_counter() - start)
+        return min(seconds)
+
+    def handle(self, *args, datasets, repeat, **options):
+        payload = synthetic_package_search(datasets, random.Random(0))
+        text = json.dumps(payload)
+        self.stdout.write(
+            f"package_search: {datasets} datasets, {len(text) / 1e6:.1f}MB"
+        )
+
+        for name, (loads, dumps) in CODECS.items():
+            decode = self.best(repeat, loads, text)
+            encode = self.best(repeat, lambda: Json(payload, dumps=dumps).getquoted())
+            self.stdout.write(
+                f"{name:>7}: decode {decode * 1000:.1f}ms, "
+                f"encode for jsonb {encode * 1000:.1f}ms"
+            )
@@ -0,0 +1,73 @@
+import multiprocessing
+import random
+import resource
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from iati_fetch.management.synthetic import synthetic_activities_xml
+from iati_fetch.parsers import PARSERS
+from iati_fetch.records import record_children
+
+
+def measure(parser: str, records: bool, document: bytes, repeat: int, results):
+    """
+    Parse in a child process, so that each parser starts from the same heap
+    """
+    children = record_children if records else None
+
+    def parse(document):
+        return PARSERS[parser](document, children=children)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(document)
+        seconds.append(time.perf_counter() - start)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+
+    tracemalloc.start()
+    parse(document)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results.put((min(seconds), rss * 1024, peak))
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput and peak memory of the XML parser backends "
+        "on an activities file, keeping activities as dicts or as records"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--activities", type=int, default=20000)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--file", help="An IATI XML file, instead of synthetic")
+
+    def handle(self, *args, activities, repeat, file, **options):
+        if file:
+            with open(file, "rb") as f:
+                document = f.read()
+        else:
+            document = synthetic_activities_xml(activities, random.Random(0)).encode()
+        size = len(document) / 1e6
+        self.stdout.write(f"Document: {size:.1f}MB")
+
+        context = multiprocessing.get_context("fork")
+        for parser in PARSERS:
+            for records in (False, True):
+                results = context.Queue()
+                process = context.Process(
+                    target=measure, args=(parser, records, document, repeat, results)
+                )
+                process.start()
+                seconds, rss, peak = results.get()
+                process.join()
+                name = f"{parser} ({'records' if records else 'dicts'})"
+                self.stdout.write(
+                    f"{name:>19}: {seconds:.2f}s ({size / seconds:.1f}MB/s), "
+                    f"peak RSS growth {rss / 1e6:.0f}MB, "
+                    f"peak Python allocations {peak / 1e6:.0f}MB"
+                )
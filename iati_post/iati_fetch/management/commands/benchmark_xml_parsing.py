@@ -0,0 +1,73 @@
+import random
+import time
+
+import jsonpath_rw_ext as jp
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from iati_fetch.management.synthetic import synthetic_activities_xml
+from iati_fetch.requesters import IatiXMLRequest
+
+SEARCHES = [
+    "[iati-activities][iati-activity]",
+    "['iati-organisations']['iati-organisation']",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare XML parses per file and time spent finding activities and "
+        "organisations, re-parsing each search against one cached parse"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=20)
+        parser.add_argument("--activities", type=int, default=500)
+
+    def handle(self, *args, files, activities, **options):
+        rng = random.Random(0)
+        requests = []
+        for index in range(files):
+            request = IatiXMLRequest(url=f"http://benchmark.invalid/{index}.xml")
+            cache.set(
+                request.rhash,
+                synthetic_activities_xml(activities, rng, offset=index * activities),
+            )
+            requests.append(request)
+
+        try:
+            # As every file was searched before: one parse, and one jsonpath
+            # compile, for each search
+            start = time.perf_counter()
+            found = 0
+            for request in requests:
+                text = cache.get(request.rhash)
+                for getter in SEARCHES:
+                    # jsonpath matches the list of elements, as one value
+                    for matched in jp.match(getter, request.parse(text)):
+                        found += len(matched)
+            searched = time.perf_counter() - start
+            self.report("re-parsed", requests, searched, found)
+
+            for request in requests:
+                request.parse_count = 0
+
+            start = time.perf_counter()
+            found = 0
+            for request in requests:
+                found += len(async_to_sync(request.activities)())
+                found += len(async_to_sync(request.organisations)())
+                request.forget()
+            searched = time.perf_counter() - start
+            self.report("cached", requests, searched, found)
+        finally:
+            for request in requests:
+                request.drop_sync()
+
+    def report(self, name, requests, seconds, found):
+        parses = sum(request.parse_count for request in requests)
+        self.stdout.write(
+            f"{name:>9}: {parses / len(requests):.1f} parses per file, "
+            f"{seconds * 1000 / len(requests):.1f}ms per file ({found} elements)"
+        )
@@ -0,0 +1,60 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from iati_fetch.coordinator import SHARD_BY, Coordinator
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest the XML files of every (or the given) publisher, in shards sent "
+        "to `runworker iati` workers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "organisations", nargs="*", help="Publisher handles; default all"
+        )
+        parser.add_argument("--shard-by", choices=SHARD_BY, default="host")
+        parser.add_argument("--shard-size", type=int, default=20)
+        parser.add_argument("--channel", default="iati")
+        parser.add_argument(
+            "--heartbeat-timeout",
+            type=float,
+            default=600,
+            help="Seconds without word from a worker before its shard is queued again",
+        )
+        parser.add_argument("--retries", type=int, default=3)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=10,
+            help="Workers woken at once to claim shards",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help=(
+                "Sync the list of publishers, and ingest only those not yet "
+                "ingested since they were added or restored"
+            ),
+        )
+        parser.add_argument(
+            "--no-wait",
+            action="store_true",
+            help="Dispatch the shards and exit without following them",
+        )
+
+    def handle(self, *args, **options):
+        coordinator = Coordinator(
+            channel=options["channel"],
+            shard_by=options["shard_by"],
+            shard_size=options["shard_size"],
+            heartbeat_timeout=options["heartbeat_timeout"],
+            retries=options["retries"],
+            workers=options["workers"],
+            incremental=options["incremental"],
+        )
+        run = async_to_sync(coordinator.run)(
+            options["organisations"] or None, wait=not options["no_wait"]
+        )
+        self.stdout.write(f"{run}: {run.progress()}")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from iati_fetch.models import Summary
+
+
+class Command(BaseCommand):
+    help = "Recompute every reporting organisation and recipient country summary"
+
+    def handle(self, *args, **options):
+        Summary.objects.rebuild()
+        self.stdout.write(f"{Summary.objects.count()} summaries")
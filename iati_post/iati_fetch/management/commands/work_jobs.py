@@ -0,0 +1,34 @@
+import asyncio
+import os
+import socket
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from iati_fetch import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued fetch and parse jobs, polling for more until stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=10, help="Jobs at a time")
+        parser.add_argument(
+            "--poll", type=float, default=5, help="Seconds between polls when idle"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when the queue is empty"
+        )
+
+    def handle(self, *args, **options):
+        async_to_sync(self.work)(options["batch"], options["poll"], options["once"])
+
+    async def work(self, batch: int, poll: float, once: bool):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        while True:
+            ran = await jobs.drain(worker=worker, batch=batch)
+            if ran:
+                self.stdout.write(f"{ran} jobs run")
+            if once:
+                return
+            await asyncio.sleep(poll)
@@ -0,0 +1,103 @@
+"""
+Synthetic IATI data for the benchmark commands
+"""
+
+import random
+
+import xmltodict
+
+
+def synthetic_activity(index: int, rng: random.Random) -> dict:
+    """
+    An activity shaped roughly like the xmltodict output we store
+    """
+    return {
+        "@default-currency": rng.choice(["USD", "EUR", "GBP", "AUD"]),
+        "iati-identifier": f"XM-BENCH-{index}",
+        "reporting-org": {"@ref": f"XM-ORG-{rng.randrange(200)}", "@type": "10"},
+        "activity-status": {"@code": str(rng.randrange(1, 6))},
+        "recipient-country": [
+            {"@code": rng.choice(["TL", "ID", "PG", "FJ", "KH", "LA"])}
+        ],
+        "sector": [
+            {"@code": str(rng.randrange(11110, 99820)), "@vocabulary": "1"}
+            for _ in range(rng.randrange(1, 4))
+        ],
+        "activity-date": [
+            {"@type": "1", "@iso-date": f"20{rng.randrange(10, 20)}-01-01"},
+            {"@type": "3", "@iso-date": f"20{rng.randrange(20, 25)}-12-31"},
+        ],
+        "description": {"@type": "1", "#text": "x" * rng.randrange(100, 2000)},
+    }
+
+
+def synthetic_activities_xml(count: int, rng: random.Random, offset: int = 0) -> str:
+    """
+    An <iati-activities> file of `count` synthetic activities
+    """
+    activities = []
+    for index in range(offset, offset + count):
+        activity = synthetic_activity(index, rng)
+        activity["title"] = {"narrative": [f"Synthetic activity {index}"]}
+        activity["transaction"] = [
+            {
+                "transaction-type": {"@code": rng.choice(["2", "3"])},
+                "transaction-date": {"@iso-date": "2019-06-30"},
+                "value": {
+                    "@value-date": "2019-06-30",
+                    "#text": str(rng.randrange(1000000)),
+                },
+            }
+            for _ in range(rng.randrange(0, 5))
+        ]
+        activities.append(activity)
+    return xmltodict.unparse(
+        {"iati-activities": {"@version": "2.03", "iati-activity": activities}}
+    )
+
+
+def synthetic_package_search(count: int, rng: random.Random) -> dict:
+    """
+    A registry `package_search` response of `count` datasets
+    """
+    results = []
+    for index in range(count):
+        publisher = f"publisher-{rng.randrange(500)}"
+        results.append(
+            {
+                "id": f"{index:08x}-0000-0000-0000-000000000000",
+                "name": f"{publisher}-{index}",
+                "title": f"Activity file {index}",
+                "state": "active",
+                "num_resources": 1,
+                "metadata_modified": "2019-07-01T12:00:00.000000",
+                "organization": {
+                    "name": publisher,
+                    "title": publisher.replace("-", " ").title(),
+                    "type": "organization",
+                    "description": "x" * rng.randrange(50, 500),
+                    "is_organization": True,
+                },
+                "extras": [
+                    {"key": "activity_count", "value": str(rng.randrange(1, 2000))},
+                    {"key": "filetype", "value": "activity"},
+                    {"key": "iati_version", "value": "2.03"},
+                    {"key": "data_updated", "value": "2019-06-30 09:00:00"},
+                ],
+                "resources": [
+                    {
+                        "id": f"{index:08x}-1111-1111-1111-111111111111",
+                        "format": "IATI-XML",
+                        "url": f"http://example.org/{publisher}/{index}.xml",
+                        "hash": f"{rng.getrandbits(160):040x}",
+                        "size": rng.randrange(1000, 10 ** 7),
+                    }
+                ],
+                "tags": [],
+            }
+        )
+    return {
+        "help": "https://iatiregistry.org/api/3/action/help_show?name=package_search",
+        "success": True,
+        "result": {"count": count, "results": results},
+    }
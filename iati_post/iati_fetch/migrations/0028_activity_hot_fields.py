@@ -0,0 +1,183 @@
+# Generated by Django 2.2.28 on 2026-10-19 06:36
+
+import datetime
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+# The extraction below is copied from iati_fetch.elements as it was when this
+# migration was written, so that later changes there do not change it
+
+ACTIVITY_DATE_TYPES = {
+    "start_planned": {"1", "start-planned"},
+    "start_actual": {"2", "start-actual"},
+    "end_planned": {"3", "end-planned"},
+    "end_actual": {"4", "end-actual"},
+}
+
+DAC_SECTOR_VOCABULARIES = {None, "1", "DAC"}
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def attribute(element, name):
+    if not isinstance(element, dict):
+        return None
+    value = element.get(f"@{name}")
+    if isinstance(value, str):
+        value = value.strip()
+    return value or None
+
+
+def child_attribute(element, child, name):
+    children = as_list(element.get(child))
+    if not children:
+        return None
+    return attribute(children[0], name)
+
+
+def iso_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+
+def sector_codes(activity):
+    return [
+        attribute(sector, "code")
+        for sector in as_list(activity.get("sector"))
+        if attribute(sector, "code")
+        and attribute(sector, "vocabulary") in DAC_SECTOR_VOCABULARIES
+    ]
+
+
+def recipient_countries(activity):
+    return [
+        attribute(country, "code").upper()
+        for country in as_list(activity.get("recipient-country"))
+        if attribute(country, "code")
+    ]
+
+
+def activity_date(activity, date_type):
+    for date in as_list(activity.get("activity-date")):
+        if attribute(date, "type") in ACTIVITY_DATE_TYPES[date_type]:
+            return iso_date(attribute(date, "iso-date"))
+    return None
+
+
+def activity_fields(activity):
+    return {
+        "reporting_org_ref": child_attribute(activity, "reporting-org", "ref"),
+        "activity_status": child_attribute(activity, "activity-status", "code"),
+        "default_currency": attribute(activity, "default-currency"),
+        "sector_codes": sector_codes(activity),
+        "recipient_countries": recipient_countries(activity),
+        **{
+            date_type: activity_date(activity, date_type)
+            for date_type in ACTIVITY_DATE_TYPES
+        },
+    }
+
+
+ACTIVITY_FIELDS = [
+    "reporting_org_ref",
+    "activity_status",
+    "default_currency",
+    "sector_codes",
+    "recipient_countries",
+    *ACTIVITY_DATE_TYPES,
+]
+
+
+def materialize_activity_fields(apps, schema_editor):
+    Activity = apps.get_model("iati_fetch", "Activity")
+    batch = []
+    for activity in Activity.objects.exclude(element=None).iterator(chunk_size=2000):
+        for name, value in activity_fields(activity.element).items():
+            setattr(activity, name, value)
+        batch.append(activity)
+        if len(batch) == 2000:
+            Activity.objects.bulk_update(batch, ACTIVITY_FIELDS)
+            batch = []
+    Activity.objects.bulk_update(batch, ACTIVITY_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0027_budget_documentlink_result")]
+
+    operations = [
+        migrations.AddField(
+            model_name="activity",
+            name="activity_status",
+            field=models.TextField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="default_currency",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="end_actual",
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="end_planned",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="recipient_countries",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.TextField(), blank=True, default=list, size=None
+            ),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="reporting_org_ref",
+            field=models.TextField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="sector_codes",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.TextField(), blank=True, default=list, size=None
+            ),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="start_actual",
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="start_planned",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["sector_codes"], name="activity_sector_codes_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["recipient_countries"], name="activity_countries_gin"
+            ),
+        ),
+        migrations.RunPython(materialize_activity_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,204 @@
+# Generated by Django 2.2.28 on 2026-10-19 06:39
+
+import datetime
+import decimal
+
+from django.db import migrations, models
+
+# The extraction below is copied from iati_fetch.elements as it was when this
+# migration was written, so that later changes there do not change it
+
+DAC_SECTOR_VOCABULARIES = {None, "1", "DAC"}
+
+TRANSACTION_TYPES_V1 = {
+    "IF": "1",
+    "C": "2",
+    "D": "3",
+    "E": "4",
+    "IR": "5",
+    "LR": "6",
+    "R": "7",
+    "QP": "8",
+    "QS": "9",
+    "CG": "10",
+}
+
+MAX_VALUE = decimal.Decimal("1e18")
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def attribute(element, name):
+    if not isinstance(element, dict):
+        return None
+    value = element.get(f"@{name}")
+    if isinstance(value, str):
+        value = value.strip()
+    return value or None
+
+
+def child_attribute(element, child, name):
+    children = as_list(element.get(child))
+    if not children:
+        return None
+    return attribute(children[0], name)
+
+
+def text(element):
+    if isinstance(element, dict):
+        element = element.get("#text")
+    if isinstance(element, str):
+        return element.strip() or None
+    return None
+
+
+def iso_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+
+def transaction_value(transaction):
+    value = text(transaction.get("value"))
+    if value is None:
+        return None
+    try:
+        amount = decimal.Decimal(value.replace(",", ""))
+    except decimal.InvalidOperation:
+        return None
+    if not amount.is_finite() or abs(amount) >= MAX_VALUE:
+        return None
+    return amount
+
+
+def transaction_sector_code(transaction):
+    for sector in as_list(transaction.get("sector")):
+        if attribute(sector, "vocabulary") in DAC_SECTOR_VOCABULARIES:
+            return attribute(sector, "code")
+    return None
+
+
+def transaction_fields(transaction, default_currency):
+    code = child_attribute(transaction, "transaction-type", "code")
+    return {
+        "transaction_type": TRANSACTION_TYPES_V1.get(code, code),
+        "value": transaction_value(transaction),
+        "value_date": iso_date(
+            child_attribute(transaction, "value", "value-date")
+            or child_attribute(transaction, "transaction-date", "iso-date")
+        ),
+        "currency": child_attribute(transaction, "value", "currency")
+        or default_currency,
+        "provider_org_ref": child_attribute(transaction, "provider-org", "ref"),
+        "receiver_org_ref": child_attribute(transaction, "receiver-org", "ref"),
+        "sector_code": transaction_sector_code(transaction),
+    }
+
+
+TRANSACTION_FIELDS = [
+    "transaction_type",
+    "value",
+    "value_date",
+    "currency",
+    "provider_org_ref",
+    "receiver_org_ref",
+    "sector_code",
+]
+
+
+def extract_transaction_fields(apps, schema_editor):
+    Transaction = apps.get_model("iati_fetch", "Transaction")
+    transactions = Transaction.objects.exclude(element=None).select_related("activity")
+    batch = []
+    for instance in transactions.iterator(chunk_size=2000):
+        fields = transaction_fields(
+            instance.element, instance.activity.default_currency
+        )
+        for name, value in fields.items():
+            setattr(instance, name, value)
+        batch.append(instance)
+        if len(batch) == 2000:
+            Transaction.objects.bulk_update(batch, TRANSACTION_FIELDS)
+            batch = []
+    Transaction.objects.bulk_update(batch, TRANSACTION_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0029_element_gin_indexes")]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="currency",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="provider_org_ref",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="receiver_org_ref",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="sector_code",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="transaction_type",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="value",
+            field=models.DecimalField(decimal_places=2, max_digits=20, null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="value_date",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["transaction_type", "value_date", "currency"],
+                name="transaction_type_date",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["provider_org_ref", "transaction_type", "value_date"],
+                name="transaction_provider",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["receiver_org_ref", "transaction_type", "value_date"],
+                name="transaction_receiver",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["sector_code", "transaction_type", "value_date"],
+                name="transaction_sector",
+            ),
+        ),
+        migrations.RunPython(extract_transaction_fields, migrations.RunPython.noop),
+    ]
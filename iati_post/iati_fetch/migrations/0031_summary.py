@@ -0,0 +1,75 @@
+# Generated by Django 2.2.28 on 2026-10-19 06:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0030_transaction_typed_columns")]
+
+    operations = [
+        migrations.CreateModel(
+            name="Summary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "dimension",
+                    models.TextField(
+                        choices=[
+                            ("reporting-org", "reporting-org"),
+                            ("recipient-country", "recipient-country"),
+                        ]
+                    ),
+                ),
+                ("key", models.TextField()),
+                ("activity_count", models.IntegerField(default=0)),
+                ("updated", models.DateTimeField()),
+            ],
+            options={"unique_together": {("dimension", "key")}},
+        ),
+        migrations.CreateModel(
+            name="SummaryTotal",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("year", models.IntegerField(blank=True, null=True)),
+                ("currency", models.TextField(blank=True)),
+                (
+                    "commitments",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=24),
+                ),
+                (
+                    "disbursements",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=24),
+                ),
+                (
+                    "summary",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="totals",
+                        to="iati_fetch.Summary",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["year", "currency"],
+                "unique_together": {("summary", "year", "currency")},
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 2.2.28 on 2026-10-19 06:42
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+from django.db.models import Case, TextField, Value, When
+
+# The configurations below are copied from iati_fetch.search as they were when
+# this migration was written, so that later changes there do not change it
+SEARCH_CONFIGS = {
+    "da": "danish",
+    "de": "german",
+    "en": "english",
+    "es": "spanish",
+    "fi": "finnish",
+    "fr": "french",
+    "hu": "hungarian",
+    "it": "italian",
+    "nb": "norwegian",
+    "nl": "dutch",
+    "no": "norwegian",
+    "pt": "portuguese",
+    "ro": "romanian",
+    "ru": "russian",
+    "sv": "swedish",
+    "tr": "turkish",
+}
+DEFAULT_SEARCH_CONFIG = "simple"
+
+
+def index_narratives(apps, schema_editor):
+    ActivityNarrative = apps.get_model("iati_fetch", "ActivityNarrative")
+    config = Case(
+        *[
+            When(lang=lang, then=Value(config))
+            for lang, config in SEARCH_CONFIGS.items()
+        ],
+        default=Value(DEFAULT_SEARCH_CONFIG),
+        output_field=TextField(),
+    )
+    ActivityNarrative.objects.update(
+        search=django.contrib.postgres.search.SearchVector("text", config=config)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0031_summary")]
+
+    operations = [
+        migrations.AddField(
+            model_name="activitynarrative",
+            name="search",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, null=True
+            ),
+        ),
+        migrations.RunSQL(
+            "UPDATE iati_fetch_activitynarrative "
+            "SET lang = lower(split_part(split_part(lang, '-', 1), '_', 1))",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(index_narratives, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="activitynarrative",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search"], name="activitynarrative_search_gin"
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+# Name codelists and code their items, keeping only the newest copy (the
+# highest id) of each: every refresh used to duplicate them. Items go before
+# their codelists, as the foreign key is only cascaded by Django.
+KEY_CODELISTS = [
+    "UPDATE iati_fetch_codelist SET name = element->>'@name'",
+    "DELETE FROM iati_fetch_codelistitem item USING iati_fetch_codelist codelist "
+    "WHERE item.codelist_id = codelist.id AND (codelist.name IS NULL OR EXISTS ("
+    "SELECT 1 FROM iati_fetch_codelist kept "
+    "WHERE kept.name = codelist.name AND kept.id > codelist.id))",
+    "DELETE FROM iati_fetch_codelist codelist USING iati_fetch_codelist kept "
+    "WHERE kept.name = codelist.name AND kept.id > codelist.id",
+    "DELETE FROM iati_fetch_codelist WHERE name IS NULL",
+    # The text of <code>, which has a "#text" if it has attributes
+    "UPDATE iati_fetch_codelistitem SET "
+    "code = NULLIF(btrim(CASE "
+    "WHEN jsonb_typeof(element->'code') = 'string' THEN element->>'code' "
+    "WHEN jsonb_typeof(element->'code'->'#text') = 'string' "
+    "THEN element->'code'->>'#text' END), ''), "
+    "withdrawn = COALESCE(btrim(element->>'@status') = 'withdrawn' "
+    "OR NULLIF(btrim(element->>'@withdrawal-date'), '') IS NOT NULL, false)",
+    "DELETE FROM iati_fetch_codelistitem item USING iati_fetch_codelistitem kept "
+    "WHERE kept.codelist_id = item.codelist_id AND kept.code = item.code "
+    "AND kept.id > item.id",
+    "DELETE FROM iati_fetch_codelistitem WHERE code IS NULL",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0032_activitynarrative_search")]
+
+    operations = [
+        migrations.AddField(
+            model_name="codelist", name="name", field=models.TextField(null=True)
+        ),
+        migrations.AddField(
+            model_name="codelist",
+            name="digest",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="codelistitem", name="code", field=models.TextField(null=True)
+        ),
+        migrations.AddField(
+            model_name="codelistitem",
+            name="withdrawn",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunSQL(KEY_CODELISTS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0033_codelist_sync_keys")]
+
+    operations = [
+        migrations.AlterField(
+            model_name="codelist", name="name", field=models.TextField(unique=True)
+        ),
+        migrations.AlterField(
+            model_name="codelistitem", name="code", field=models.TextField()
+        ),
+        migrations.AlterUniqueTogether(
+            name="codelistitem", unique_together={("codelist", "code")}
+        ),
+    ]
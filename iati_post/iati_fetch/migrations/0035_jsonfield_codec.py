@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:06
+
+from django.db import migrations
+
+import iati_fetch.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0034_codelist_unique_keys")]
+
+    operations = [
+        migrations.AlterField(
+            model_name="activity",
+            name="element",
+            field=iati_fetch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="budget",
+            name="element",
+            field=iati_fetch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="codelist",
+            name="element",
+            field=iati_fetch.fields.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="codelistitem",
+            name="element",
+            field=iati_fetch.fields.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="documentlink",
+            name="element",
+            field=iati_fetch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="organisation",
+            name="element",
+            field=iati_fetch.fields.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="result",
+            name="element",
+            field=iati_fetch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="transaction",
+            name="description",
+            field=iati_fetch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="transaction",
+            name="element",
+            field=iati_fetch.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="transaction",
+            name="ref",
+            field=iati_fetch.fields.JSONField(blank=True, null=True),
+        ),
+    ]
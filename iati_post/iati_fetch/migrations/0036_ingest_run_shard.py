@@ -0,0 +1,77 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+import iati_fetch.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0035_jsonfield_codec")]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestRun",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(default=django.utils.timezone.now)),
+                ("finished", models.DateTimeField(blank=True, null=True)),
+                ("shard_by", models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="IngestShard",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.TextField()),
+                ("requests", iati_fetch.fields.JSONField(default=list)),
+                (
+                    "status",
+                    models.TextField(
+                        choices=[
+                            ("queued", "queued"),
+                            ("running", "running"),
+                            ("done", "done"),
+                            ("failed", "failed"),
+                        ],
+                        default="queued",
+                    ),
+                ),
+                ("worker", models.TextField(blank=True, default="")),
+                ("heartbeat", models.DateTimeField(default=django.utils.timezone.now)),
+                ("attempts", models.IntegerField(default=0)),
+                (
+                    "run",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="shards",
+                        to="iati_fetch.IngestRun",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="ingestshard",
+            index=models.Index(
+                fields=["run", "status"], name="iati_fetch__run_id_7e475d_idx"
+            ),
+        ),
+    ]
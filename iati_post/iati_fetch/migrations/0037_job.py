@@ -0,0 +1,61 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+import iati_fetch.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0036_ingest_run_shard")]
+
+    operations = [
+        migrations.CreateModel(
+            name="Job",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("kind", models.TextField()),
+                ("payload", iati_fetch.fields.JSONField(default=dict)),
+                ("priority", models.IntegerField(default=0)),
+                (
+                    "status",
+                    models.TextField(
+                        choices=[
+                            ("queued", "queued"),
+                            ("running", "running"),
+                            ("done", "done"),
+                            ("dead", "dead"),
+                        ],
+                        default="queued",
+                    ),
+                ),
+                (
+                    "available_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("max_attempts", models.IntegerField(default=5)),
+                ("worker", models.TextField(blank=True, default="")),
+                ("error", models.TextField(blank=True, default="")),
+                ("created", models.DateTimeField(default=django.utils.timezone.now)),
+                ("finished", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="job",
+            index=models.Index(
+                condition=models.Q(status__in=["queued", "running"]),
+                fields=["-priority", "available_at"],
+                name="job_claim_idx",
+            ),
+        ),
+    ]
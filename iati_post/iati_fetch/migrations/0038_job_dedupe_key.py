@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0037_job")]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="dedupe_key",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="job",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(status__in=["queued", "running"]),
+                fields=("dedupe_key",),
+                name="job_dedupe_uniq",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0038_job_dedupe_key")]
+
+    operations = [
+        migrations.AddField(
+            model_name="activity",
+            name="file_digest",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="ingested_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="publisher",
+            field=models.TextField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="activity",
+            name="source_hash",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                fields=["source_hash", "ingested_at"], name="activity_source_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0039_activity_provenance")]
+
+    operations = [
+        migrations.CreateModel(
+            name="SourceIngest",
+            fields=[
+                ("source_hash", models.TextField(primary_key=True, serialize=False)),
+                ("publisher", models.TextField(blank=True, db_index=True, null=True)),
+                ("file_digest", models.TextField()),
+                ("completed_at", models.DateTimeField()),
+            ],
+        )
+    ]
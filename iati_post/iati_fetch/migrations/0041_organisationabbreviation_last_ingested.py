@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("iati_fetch", "0040_source_ingest")]
+
+    operations = [
+        migrations.AddField(
+            model_name="organisationabbreviation",
+            name="last_ingested",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # Publishers with activities written from their files have been
+        # ingested; the others are ingested by the next incremental ingest
+        migrations.RunSQL(
+            "UPDATE iati_fetch_organisationabbreviation abbreviation "
+            "SET last_ingested = now() WHERE NOT withdrawn AND EXISTS ("
+            "SELECT 1 FROM iati_fetch_activity activity "
+            "WHERE activity.publisher = abbreviation.abbreviation)",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,22 +1,155 @@
 from __future__ import annotations
 
+import datetime
+import hashlib
+import json
 import logging
-from typing import Tuple, Union
-
-from django.contrib.postgres.fields import JSONField
-from django.db import IntegrityError, models
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchRank, SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import Count, F, Max, Q, Sum, TextField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import ExtractYear
 from django.utils import timezone
 
+from iati_fetch.codelists import codelist_registry_changed
+from iati_fetch.elements import (
+    ACTIVITY_FIELDS,
+    TRANSACTION_TYPE_COMMITMENT,
+    TRANSACTION_TYPE_DISBURSEMENT,
+    as_list,
+    codelist_item_withdrawn,
+    narrative_text,
+    text,
+)
+from iati_fetch.fields import JSONField
+from iati_fetch.records import (  # noqa: F401
+    ActivityFormatException,
+    ActivityRecord,
+    TransactionRecord,
+    activity_record,
+)
+from iati_fetch.search import normalise_lang, search_config, search_query
+
 logger = logging.getLogger(__name__)
 
+# Rows per INSERT, and activities per transaction, when writing in bulk
+BULK_BATCH_SIZE = 500
+
+# Transaction columns written from a TransactionRecord
+TRANSACTION_COLUMNS = TransactionRecord.__slots__
+
+# Activity columns written from a Provenance
+PROVENANCE_COLUMNS = ("publisher", "source_hash", "file_digest")
+
+
+def flatten(elements: list) -> Iterable:
+    for element in elements:
+        if isinstance(element, list):
+            yield from flatten(element)
+        else:
+            yield element
+
+
+@dataclass
+class PublisherChanges:
+    """
+    How the list of publishers changed when it was synced with the registry
+    """
+
+    added: List[str]
+    # No longer listed by the registry
+    withdrawn: List[str]
+    # Withdrawn before, and listed again
+    restored: List[str]
+
 
 class OrganisationAbbreviation(models.Model):
     abbreviation = models.TextField(primary_key=True)
     withdrawn = models.BooleanField(default=False)
+    # When the publisher's files were last all written; None until then, and
+    # again once it is restored
+    last_ingested = models.DateTimeField(blank=True, null=True)
 
     def __str__(self):
         return self.abbreviation
 
+    @classmethod
+    def pending(cls) -> List[str]:
+        """
+        The publishers, not withdrawn, whose files have not all been written
+        since they were added or restored
+        """
+        return list(
+            cls.objects.filter(withdrawn=False, last_ingested=None)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
+    @classmethod
+    def mark_ingested(cls, abbreviations: Iterable[str]) -> None:
+        cls.objects.filter(pk__in=list(abbreviations)).update(
+            last_ingested=timezone.now()
+        )
+
+    @classmethod
+    def sync(cls, abbreviations: Iterable[str]) -> PublisherChanges:
+        """
+        Make the publishers those of `abbreviations` (the registry's list):
+        add new ones, mark those which are not listed as withdrawn, and those
+        which are listed again as not withdrawn
+
+        This is one transaction, of set-based statements from a temporary
+        table of the list.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE publisher_list (abbreviation text PRIMARY KEY) "
+                "ON COMMIT DROP"
+            )
+            cursor.execute(
+                "INSERT INTO publisher_list SELECT unnest(%s::text[])",
+                [sorted({a for a in abbreviations if a})],
+            )
+            # A row which was inserted (rather than updated) has no xmax. A
+            # restored publisher is ingested again
+            cursor.execute(
+                f"INSERT INTO {table} (abbreviation, withdrawn) "
+                "SELECT abbreviation, false FROM publisher_list "
+                "ON CONFLICT (abbreviation) DO UPDATE SET "
+                "withdrawn = false, last_ingested = NULL "
+                f"WHERE {table}.withdrawn "
+                "RETURNING abbreviation, xmax = 0"
+            )
+            listed = cursor.fetchall()
+            cursor.execute(
+                f"UPDATE {table} SET withdrawn = true "
+                "WHERE NOT withdrawn AND NOT EXISTS (SELECT 1 FROM publisher_list "
+                f"WHERE publisher_list.abbreviation = {table}.abbreviation) "
+                "RETURNING abbreviation"
+            )
+            withdrawn = [row[0] for row in cursor.fetchall()]
+            # Dropped at commit; but a savepoint is not a commit
+            cursor.execute("DROP TABLE publisher_list")
+        changes = PublisherChanges(
+            added=sorted(a for a, inserted in listed if inserted),
+            withdrawn=sorted(withdrawn),
+            restored=sorted(a for a, inserted in listed if not inserted),
+        )
+        logger.info(
+            "Publishers: %s added, %s withdrawn, %s restored",
+            len(changes.added),
+            len(changes.withdrawn),
+            len(changes.restored),
+        )
+        return changes
+
 
 class Organisation(models.Model):
 
@@ -29,107 +162,334 @@ class Organisation(models.Model):
     def __str__(self):
         return self.id
 
+    @classmethod
+    def published(
+        cls, organisation_handles: Sequence[str] = ()
+    ) -> Tuple[models.QuerySet, ActivityQuerySet]:
+        """
+        The organisations of these publishers (or of every publisher), and
+        the activities they report or which were written from their files
+        """
+        organisations = cls.objects.all()
+        activities = Activity.objects.all()
+        if organisation_handles:
+            organisations = organisations.filter(
+                abbreviation_id__in=organisation_handles
+            )
+            activities = activities.filter(
+                Q(reporting_org_ref__in=organisations.values("id"))
+                | Q(publisher__in=organisation_handles)
+            )
+        return organisations, activities
+
+    @classmethod
+    def delete_published(
+        cls, organisation_handles: Sequence[str] = ()
+    ) -> Dict[str, int]:
+        """
+        Delete the organisations of these publishers (or of every publisher)
+        and the activities they report, in batches; see
+        `ActivityQuerySet.bulk_delete`
+
+        Returns:
+            The number of rows deleted, by model label
+        """
+        organisations, activities = cls.published(organisation_handles)
+        # Their files are written again in full the next time
+        ingests = SourceIngest.objects.all()
+        if organisation_handles:
+            ingests = ingests.filter(
+                Q(publisher__in=organisation_handles)
+                | Q(source_hash__in=activities.values("source_hash"))
+            )
+        ingests.delete()
+        deleted = activities.bulk_delete()
+        # Nothing refers to organisations: this is one DELETE
+        deleted[cls._meta.label], _ = organisations.delete()
+        return deleted
+
     @classmethod
     def from_xml(
         cls,
-        organisation_element: dict,
+        organisation_element: Union[dict, List[dict]],
         abbr: str,
         update: bool = False,
-        attempt: int = 0,
-    ):
+    ) -> List[str]:
+        """
+        Upsert one or many <iati-organisation> elements for a publisher
+
+        All of the organisations in a file are written with a fixed number of
+        statements (``INSERT ... ON CONFLICT``) regardless of how many
+        elements there are.
+
+        Args:
+            organisation_element: An organisation element or a list of them
+            abbr: The publisher handle ("abbreviation") the elements came from
+            update: Overwrite the element of organisations which already exist
+
+        Returns:
+            The identifiers of the organisations written
+        """
         assert abbr
         if isinstance(organisation_element, list):
-            for child_element in organisation_element:
-                return cls.from_xml(child_element, abbr, update)
-            return
-        if "organisation-identifier" not in organisation_element:
+            elements = organisation_element
+        else:
+            elements = [organisation_element]
+
+        organisations: Dict[str, dict] = {}
+        for element in elements:
+            if not isinstance(element, dict):
+                logger.error("Invalid organisation element: %s", str(element)[:200])
+                continue
+            if "organisation-identifier" not in element:
+
+                # Sometimes we get an "activity" in our "organisation" data
+                if "iati-identifier" in element:
+                    logger.error(
+                        "Masquerading Activity is trying to be an Organisation"
+                    )
+                    Activity.from_xml([element])
+                    continue
 
-            # Sometimes we get an "activity" in our "organisation" data
-            if "iati-identifier" in organisation_element:
-                logger.error("Masquerading Activity is trying to be an Organisation")
-                Activity.from_xml(organisation_element)
-                return
+                logger.error("Invalid organisation element: %s", str(element)[:200])
+                logger.error(
+                    "Wrong type for organisation element - no organisation-identifier"
+                )
+                continue
+            organisations[element["organisation-identifier"]] = element
+
+        if not organisations:
+            return []
 
+        # "abbreviation" is one-to-one: a publisher only has one organisation
+        if len(organisations) > 1:
             logger.error(
-                "Invalid organisation element: %s", str(organisation_element)[:200]
+                "%s organisations published by %s; only the first is kept",
+                len(organisations),
+                abbr,
             )
-            logger.error(
-                "Wrong type for organisation element - noorganisation-identifier key"
+            pk = next(iter(organisations))
+            organisations = {pk: organisations[pk]}
+
+        return cls._upsert(organisations, abbr, update)
+
+    @classmethod
+    def _upsert(cls, organisations: Dict[str, dict], abbr: str, update: bool):
+        element_field = cls._meta.get_field("element")
+        values = []
+        params: list = []
+        for pk, element in organisations.items():
+            values.append("(%s, %s, %s)")
+            params.extend(
+                [pk, element_field.get_db_prep_value(element, connection), abbr]
             )
-            return
 
-        pk = organisation_element["organisation-identifier"]
+        if update:
+            on_conflict = (
+                "ON CONFLICT (id) DO UPDATE SET element = EXCLUDED.element, "
+                "abbreviation_id = EXCLUDED.abbreviation_id"
+            )
+        else:
+            on_conflict = "ON CONFLICT DO NOTHING"
+
+        table = cls._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {OrganisationAbbreviation._meta.db_table} "
+                "(abbreviation, withdrawn) VALUES (%s, false) "
+                "ON CONFLICT (abbreviation) DO NOTHING",
+                [abbr],
+            )
+            if update:
+                # The publisher's organisation identifier has changed
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE abbreviation_id = %s "
+                    "AND NOT (id = ANY(%s))",
+                    [abbr, list(organisations)],
+                )
+            cursor.execute(
+                f"INSERT INTO {table} (id, element, abbreviation_id) "
+                f"VALUES {', '.join(values)} "
+                f"{on_conflict} RETURNING id",
+                params,
+            )
+            written = [row[0] for row in cursor.fetchall()]
+        logger.debug("Upserted organisations %s for %s", written, abbr)
+        return written
 
-        exists = cls.objects.filter(pk=pk).exists()
 
-        if exists and not update:
-            logger.debug(f"skip update of {pk}")
-            return
+def placeholder(model, column: str) -> str:
+    """
+    The SQL placeholder for a value of `column`; JSON values are JSON text,
+    and arrays are cast so that an empty list has a type. A search vector
+    takes two values: its text search configuration and its text.
+    """
+    field = model._meta.get_field(column)
+    if isinstance(field, (ArrayField, JSONField)):
+        return f"%s::{field.db_type(connection)}"
+    if isinstance(field, SearchVectorField):
+        return "to_tsvector(%s::regconfig, COALESCE(%s, ''))"
+    return "%s"
+
+
+def bulk_insert(
+    model,
+    columns: Sequence[str],
+    rows: Iterable[Sequence],
+    batch_size: int = BULK_BATCH_SIZE,
+) -> None:
+    """
+    INSERT rows of values for `columns`, `batch_size` rows per statement
 
-        ab_instance = OrganisationAbbreviation.objects.get_or_create(pk=abbr)[0]
-        try:
-            o, _created = cls.objects.get_or_create(
-                pk=pk,
-                abbreviation=ab_instance,
-                defaults=dict(element=organisation_element),
+    JSON columns take JSON text, as made by `codec.dumps`.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    row_sql = f"({', '.join(placeholder(model, column) for column in columns)})"
+    statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            cursor.execute(
+                statement + ", ".join([row_sql] * len(batch)),
+                [value for row in batch for value in row],
             )
-        except IntegrityError:
-            if attempt < 3:
-                attempt += 1
-                return cls.from_xml(organisation_element, abbr, update, attempt=attempt)
-            logger.error("Broke while trying to do organisation update")
-            return cls.objects.filter(pk=pk).first()
-        if _created:
-            logger.debug(f"Created {o}")
-        if not _created:
-            logger.debug(f"Updating {o}")
-            o.iatiorganisation = organisation_element
-            o.save()
-        return o
-
-
-class ActivityFormatException(Exception):
-    pass
 
 
 class ActivityLinkedModel(models.Model):
     activity = models.ForeignKey("iati_fetch.Activity", on_delete=models.CASCADE)
-    element = JSONField(db_index=True, blank=True, null=True)
+    element = JSONField(blank=True, null=True)
 
     class Meta:
         abstract = True
 
     @classmethod
-    def from_xml(cls, activity_id, element_list):
-        for e in element_list:
-            cls.objects.create(activity_id=activity_id, element=e)
+    def write_records(cls, elements: Iterable[Tuple[str, str]]) -> None:
+        """
+        Insert (activity identifier, element JSON) pairs
+        """
+        bulk_insert(cls, ["activity_id", "element"], elements)
+
+
+class TransactionQuerySet(models.QuerySet):
+    def of_type(self, *codes: str):
+        return self.filter(transaction_type__in=codes)
+
+    def commitments(self):
+        return self.of_type(TRANSACTION_TYPE_COMMITMENT)
+
+    def disbursements(self):
+        return self.of_type(TRANSACTION_TYPE_DISBURSEMENT)
+
+    def totals(self, *fields: str):
+        """
+        Sum of "value" grouped by the given columns; "year" is the
+        year of the value date
+        """
+        queryset = self
+        if "year" in fields:
+            queryset = queryset.annotate(year=ExtractYear("value_date"))
+        return (
+            queryset.values(*fields)
+            .annotate(total=Sum("value"), count=Count("pk"))
+            .order_by(*fields)
+        )
 
 
 class Transaction(ActivityLinkedModel):
 
     activity = models.ForeignKey("iati_fetch.Activity", on_delete=models.CASCADE)
-    element = JSONField(db_index=True, blank=True, null=True)
+    element = JSONField(blank=True, null=True)
 
-    # These fields can be long enough to cause indexing to fail
+    # These fields were long enough to cause btree indexing of "element" to fail
     ref = JSONField(blank=True, null=True)
     description = JSONField(blank=True, null=True)
 
+    # Typed columns extracted from the element at ingest; see elements.py
+    transaction_type = models.TextField(blank=True, null=True)
+    value = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+    value_date = models.DateField(blank=True, null=True)
+    currency = models.TextField(blank=True, null=True)
+    provider_org_ref = models.TextField(blank=True, null=True)
+    receiver_org_ref = models.TextField(blank=True, null=True)
+    sector_code = models.TextField(blank=True, null=True)
+
+    objects = TransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=["element"],
+                opclasses=["jsonb_path_ops"],
+                name="transaction_element_gin",
+            ),
+            models.Index(
+                fields=["transaction_type", "value_date", "currency"],
+                name="transaction_type_date",
+            ),
+            models.Index(
+                fields=["provider_org_ref", "transaction_type", "value_date"],
+                name="transaction_provider",
+            ),
+            models.Index(
+                fields=["receiver_org_ref", "transaction_type", "value_date"],
+                name="transaction_receiver",
+            ),
+            models.Index(
+                fields=["sector_code", "transaction_type", "value_date"],
+                name="transaction_sector",
+            ),
+        ]
+
     @classmethod
-    def from_xml(cls, activity_id, transactions):
-        cls.objects.filter(activity_id=activity_id).delete()
-        for t in transactions:
-            try:
-                transaction_ref = t.pop("@ref", None)
-                transaction_description = t.pop("description", None)
-                cls.objects.create(
-                    activity_id=activity_id,
-                    element=t,
-                    ref=transaction_ref,
-                    description=transaction_description,
-                )
-            except BaseException:
-                logger.error("We have a problem with %s", (t), exc_info=1)
-                raise
+    def write_records(
+        cls, transactions: Iterable[Tuple[str, TransactionRecord]]
+    ) -> None:
+        """
+        Insert (activity identifier, TransactionRecord) pairs
+        """
+        columns = ["activity_id"] + list(TRANSACTION_COLUMNS)
+        bulk_insert(
+            cls,
+            columns,
+            (
+                [activity_id] + [getattr(record, c) for c in TRANSACTION_COLUMNS]
+                for activity_id, record in transactions
+            ),
+        )
+
+
+class ActivityNarrativeManager(models.Manager):
+    def search(
+        self, text: str, langs: List[str] = None, limit: int = 100
+    ) -> List[Tuple[str, float]]:
+        """
+        Activity identifiers with narratives matching `text`, best first
+
+        Args:
+            text: Words to search for
+            langs: Only search narratives in these languages; the words
+                are stemmed for each of them
+            limit: The number of activities to return
+
+        Returns:
+            (activity identifier, rank) pairs
+        """
+        query = search_query(text, langs)
+        narratives = self.get_queryset().filter(search=query)
+        if langs:
+            narratives = narratives.filter(
+                lang__in=[normalise_lang(lang) for lang in langs]
+            )
+        return list(
+            narratives.values("activity_id")
+            .annotate(rank=Max(SearchRank(F("search"), query)))
+            .order_by("-rank", "activity_id")
+            .values_list("activity_id", "rank")[:limit]
+        )
 
 
 class ActivityNarrative(models.Model):
@@ -142,6 +502,12 @@ class ActivityNarrative(models.Model):
     path = models.TextField(blank=True, null=True)
     lang = models.TextField(blank=True, null=True)
     text = models.TextField(blank=True, null=True)
+    search = SearchVectorField(blank=True, null=True)
+
+    objects = ActivityNarrativeManager()
+
+    class Meta:
+        indexes = [GinIndex(fields=["search"], name="activitynarrative_search_gin")]
 
 
 class Budget(ActivityLinkedModel):
@@ -156,155 +522,635 @@ class DocumentLink(ActivityLinkedModel):
     pass
 
 
-class Activity(models.Model):
+def activity_document_sql() -> str:
+    """
+    SQL for each activity as one JSON document: its element, with its
+    transactions, budgets, results, document links and narratives as they
+    are stored
+    """
+    activity = connection.ops.quote_name(Activity._meta.db_table)
 
-    identifier = models.TextField(primary_key=True)
-    element = JSONField(db_index=True, blank=True, null=True)
+    def parts(model, value: str = "element") -> str:
+        table = connection.ops.quote_name(model._meta.db_table)
+        return (
+            f"(SELECT coalesce(jsonb_agg({value} ORDER BY id), '[]') FROM {table} "
+            f"WHERE activity_id = {activity}.identifier)"
+        )
 
-    def save_narratives(self, narratives, activity_element):
+    transaction = (
+        "coalesce(element, '{}') || "
+        "jsonb_strip_nulls(jsonb_build_object('@ref', ref, 'description', description))"
+    )
+    narrative = "jsonb_build_object('path', path, 'lang', lang, 'text', text)"
+    return (
+        f"jsonb_build_object('identifier', {activity}.identifier, "
+        f"'element', {activity}.element, "
+        f"'transactions', {parts(Transaction, transaction)}, "
+        f"'budgets', {parts(Budget)}, "
+        f"'results', {parts(Result)}, "
+        f"'document_links', {parts(DocumentLink)}, "
+        f"'narratives', {parts(ActivityNarrative, narrative)})::text"
+    )
 
-        # Save narrative objects
-        narrative_instances = []
-        for path, text_or_items in narratives.items():
-            for text_item in text_or_items:
-                if text_item is None:
-                    logger.debug("No text")
-                    continue
-                text = None
-                lang = None
-
-                if isinstance(text_item, str):
-                    text = text_item
-                    lang = activity_element.get("@xml:lang", None)
-                elif isinstance(text_item, dict):
-                    lang = text_item.get("@xml:lang", None)
-                    text = text_item.get("#text", None)
-
-                if not lang:
-                    logger.debug("No lang assume en")
-                    lang = "en"
-
-                if text:
-                    narrative_instances.append(
-                        ActivityNarrative(activity_id=self.pk, lang=lang, text=text)
-                    )
 
-                else:
-                    # This happens when there is a lang tag but no #text
-                    logger.debug("No text")
-                    continue
+@dataclass(frozen=True)
+class Provenance:
+    """
+    Where activities being written came from
+    """
 
-        ActivityNarrative.objects.bulk_create(narrative_instances)
+    # The handle of the publisher whose file it is
+    publisher: Union[str, None]
+    # The `BaseRequest.source_hash` of the file
+    source_hash: str
+    # A digest of the file's content
+    file_digest: str
+    ingested_at: datetime.datetime = field(default_factory=timezone.now)
 
-    @staticmethod
-    def _validate_activity_xml(activity_element):
-        if not isinstance(activity_element, dict):
-            raise ActivityFormatException(
-                "Expected activity_element was %s not dictionary",
-                type(activity_element),
-            )
-        if "iati-identifier" not in activity_element:
-            raise ActivityFormatException(
-                "Expected iati-identifier was missing in activity"
+    @property
+    def values(self) -> tuple:
+        return (self.publisher, self.source_hash, self.file_digest)
+
+
+@dataclass
+class SourceChanges:
+    """
+    How the activities of a file changed when it was written again
+    """
+
+    added: List[str]
+    # Written again: they were from this file before too
+    updated: List[str]
+    # No longer in the file, so deleted
+    removed: List[str]
+
+
+# Rows which belong to an activity, and are replaced or deleted with it
+ACTIVITY_LINKED_MODELS = (Transaction, Budget, Result, DocumentLink, ActivityNarrative)
+
+
+class ActivityQuerySet(models.QuerySet):
+    def reported_by(self, ref: str):
+        return self.filter(reporting_org_ref=ref)
+
+    def in_country(self, code: str):
+        return self.filter(recipient_countries__contains=[code.upper()])
+
+    def in_sector(self, code: str):
+        return self.filter(sector_codes__contains=[code])
+
+    def from_source(self, source_hash: str):
+        """
+        Activities last written from the file with this request hash
+        """
+        return self.filter(source_hash=source_hash)
+
+    def from_publisher(self, organisation_handle: str):
+        """
+        Activities last written from the files of a publisher
+        """
+        return self.filter(publisher=organisation_handle)
+
+    def published_by(self, organisation_handle: str):
+        """
+        Activities reported by the organisation of a publisher
+        """
+        return self.filter(
+            reporting_org_ref__in=Organisation.objects.filter(
+                abbreviation_id=organisation_handle
+            ).values("id")
+        )
+
+    def bulk_delete(self, batch_size: int = BULK_BATCH_SIZE) -> Dict[str, int]:
+        """
+        Delete these activities and their transactions, budgets, results,
+        document links and narratives with set-based SQL; unlike `delete`,
+        which loads every row of them first
+
+        Each batch of `batch_size` activities (the next range of identifiers)
+        is deleted in its own short transaction; summaries are refreshed once,
+        at the end.
+
+        Returns:
+            The number of rows deleted, by model label
+        """
+        deleted = {
+            model._meta.label: 0 for model in (*ACTIVITY_LINKED_MODELS, self.model)
+        }
+        previous_keys: Dict[str, set] = {d: set() for d in SUMMARY_DIMENSIONS}
+        after = None
+        try:
+            while True:
+                batch = self.order_by("identifier")
+                if after is not None:
+                    batch = batch.filter(identifier__gt=after)
+                identifiers = list(
+                    batch.values_list("identifier", flat=True)[:batch_size]
+                )
+                if not identifiers:
+                    break
+                after = identifiers[-1]
+                for dimension, keys in Summary.objects.keys_for(identifiers).items():
+                    previous_keys[dimension].update(keys)
+                with transaction.atomic(), connection.cursor() as cursor:
+                    for model in ACTIVITY_LINKED_MODELS:
+                        cursor.execute(
+                            f"DELETE FROM {model._meta.db_table} "
+                            "WHERE activity_id = ANY(%s)",
+                            [identifiers],
+                        )
+                        deleted[model._meta.label] += cursor.rowcount
+                    cursor.execute(
+                        f"DELETE FROM {self.model._meta.db_table} "
+                        "WHERE identifier = ANY(%s)",
+                        [identifiers],
+                    )
+                    deleted[self.model._meta.label] += cursor.rowcount
+        finally:
+            try:
+                Summary.objects.refresh_for([], previous_keys)
+            except Exception:
+                # Not to hide an error from the delete itself
+                logger.error("Summaries were not refreshed", exc_info=True)
+        logger.info("Deleted %s", deleted)
+        return deleted
+
+    def documents(self):
+        """
+        The JSON text of each activity and its related parts (see
+        `activity_document_sql`), in identifier order
+        """
+        return (
+            self.annotate(
+                document=RawSQL(activity_document_sql(), [], output_field=TextField())
             )
+            .order_by("identifier")
+            .values_list("document", flat=True)
+        )
 
-    @staticmethod
-    def _iid(activity_element):
-        iid = activity_element["iati-identifier"]
-        if not isinstance(iid, str):
-            raise ActivityFormatException("Expected iati-identifier was a bad format")
-        if iid == "":
-            raise ActivityFormatException("Expected iati-identifier was a bad format")
-        return iid
+    def version(self) -> str:
+        """
+        A key which changes whenever any of these activities is written or
+        deleted: how many there are, and when the last of them was written.
+        Unlike a digest of their `documents`, it is read from one index scan.
+        """
+        found = self.aggregate(count=Count("pk"), last=Max("ingested_at"))
+        last = found["last"].isoformat() if found["last"] else ""
+        return f"{found['count']}-{last}"
+
+
+class Activity(models.Model):
+
+    identifier = models.TextField(primary_key=True)
+    element = JSONField(blank=True, null=True)
+
+    # "Hot" fields materialized from the element at ingest; see elements.py
+    reporting_org_ref = models.TextField(blank=True, null=True, db_index=True)
+    activity_status = models.TextField(blank=True, null=True, db_index=True)
+    default_currency = models.TextField(blank=True, null=True)
+    sector_codes = ArrayField(models.TextField(), blank=True, default=list)
+    recipient_countries = ArrayField(models.TextField(), blank=True, default=list)
+    start_planned = models.DateField(blank=True, null=True)
+    start_actual = models.DateField(blank=True, null=True, db_index=True)
+    end_planned = models.DateField(blank=True, null=True)
+    end_actual = models.DateField(blank=True, null=True, db_index=True)
+
+    # Provenance: where the activity was last written from (see `Provenance`)
+    # and when, however it was written
+    publisher = models.TextField(blank=True, null=True, db_index=True)
+    source_hash = models.TextField(blank=True, null=True)
+    file_digest = models.TextField(blank=True, null=True)
+    ingested_at = models.DateTimeField(blank=True, null=True)
+
+    objects = ActivityQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=["element"],
+                opclasses=["jsonb_path_ops"],
+                name="activity_element_gin",
+            ),
+            GinIndex(fields=["sector_codes"], name="activity_sector_codes_gin"),
+            GinIndex(fields=["recipient_countries"], name="activity_countries_gin"),
+            models.Index(
+                fields=["source_hash", "ingested_at"], name="activity_source_idx"
+            ),
+        ]
 
     @classmethod
     def from_xml(
-        cls, activity_element: dict, update=True
-    ) -> Union[None, Tuple[Activity, bool]]:
-        def find_narratives(element, path, narratives={}):
-            """
-            Narratives can be arbitrary lengths which makes
-            "sensible" activities hard to index.
-            Take these fields into a related model.
-            """
-            for k, v in element.items():
-                if k == "narrative":
-                    narratives[f"{path}[{k}]"] = element.pop(k)
-                elif isinstance(v, dict):
-                    narratives.update(find_narratives(v, f"{path}[{k}]", narratives))
-                elif isinstance(v, list):
-                    for index, _element in enumerate(v):
-                        narratives.update(
-                            find_narratives(
-                                _element, f"{path}[{k}][{index}]", narratives
-                            )
-                        )
-            return narratives
+        cls,
+        activity_element: Union[dict, list],
+        update=True,
+        provenance: Union[Provenance, None] = None,
+    ) -> List[str]:
+        """
+        Write one or many <iati-activity> elements (or ActivityRecords of
+        them); see `write_records`
 
+        Elements which are not valid activities are logged and skipped.
+        The elements are modified, and should be discarded.
+        """
         # Handle nested lists of activities
         if isinstance(activity_element, list):
-            for child_element in activity_element:
-                cls.from_xml(child_element)
-            return
+            records = (
+                activity_record(element) for element in flatten(activity_element)
+            )
+        else:
+            records = iter([activity_record(activity_element)])
+        return cls.write_records(
+            (record for record in records if record is not None),
+            update=update,
+            provenance=provenance,
+        )
+
+    @classmethod
+    def replace_source(
+        cls, activity_element: Union[dict, list], provenance: Provenance
+    ) -> SourceChanges:
+        """
+        Write the activities of a file (as `from_xml`), and delete those which
+        were written from it before but which it no longer has
+
+        Activities are written in many transactions. The file's `SourceIngest`
+        is cleared first and recorded last, so it is only there when the file
+        has been written in full.
+        """
+        SourceIngest.objects.filter(source_hash=provenance.source_hash).delete()
+        from_source = cls.objects.from_source(provenance.source_hash)
+        before = set(from_source.values_list("identifier", flat=True))
+        written = set(cls.from_xml(activity_element, provenance=provenance))
+        # Not written just now
+        stale = from_source.filter(ingested_at__lt=provenance.ingested_at)
+        removed = sorted(stale.values_list("identifier", flat=True))
+        if removed:
+            cls.objects.filter(identifier__in=removed).bulk_delete()
+        SourceIngest.record(provenance)
+        return SourceChanges(
+            added=sorted(written - before),
+            updated=sorted(written & before),
+            removed=removed,
+        )
+
+    @classmethod
+    def write_records(
+        cls,
+        records: Iterable[ActivityRecord],
+        update: bool = True,
+        batch_size: int = BULK_BATCH_SIZE,
+        provenance: Union[Provenance, None] = None,
+    ) -> List[str]:
+        """
+        Upsert activities and replace their transactions, budgets, results,
+        document links and narratives
+
+        Each batch of activities is written in one transaction, with a fixed
+        number of statements whatever its size; summaries are refreshed
+        once, at the end.
+
+        Args:
+            records: Activities, as from `ActivityRecord.from_element`
+            update: Overwrite activities which already exist
+            batch_size: Activities per transaction
+            provenance: Where the activities came from; without it, the
+                provenance columns other than `ingested_at` are left as they
+                were
+
+        Returns:
+            The identifiers of the activities written
+        """
+        records = iter(records)
+        ingested_at = provenance.ingested_at if provenance else timezone.now()
+        written: List[str] = []
+        previous_keys: Dict[str, set] = {d: set() for d in SUMMARY_DIMENSIONS}
+        try:
+            while True:
+                # The last of repeated identifiers wins
+                batch = {r.identifier: r for r in islice(records, batch_size)}
+                if not batch:
+                    break
+                for dimension, keys in Summary.objects.keys_for(list(batch)).items():
+                    previous_keys[dimension].update(keys)
+                with transaction.atomic():
+                    written.extend(
+                        cls._write_batch(
+                            list(batch.values()), update, ingested_at, provenance
+                        )
+                    )
+        finally:
+            try:
+                Summary.objects.refresh_for(written, previous_keys)
+            except Exception:
+                # Not to hide an error from the write itself
+                logger.error("Summaries were not refreshed", exc_info=True)
+        return written
 
-        cls._validate_activity_xml(activity_element)
-        iid = cls._iid(activity_element)
+    @classmethod
+    def _write_batch(
+        cls,
+        records: List[ActivityRecord],
+        update: bool,
+        ingested_at: datetime.datetime,
+        provenance: Union[Provenance, None] = None,
+    ) -> List[str]:
+        table = connection.ops.quote_name(cls._meta.db_table)
+        columns = ["identifier", "element", "ingested_at"] + list(ACTIVITY_FIELDS)
+        if provenance is not None:
+            columns.extend(PROVENANCE_COLUMNS)
+        row_sql = f"({', '.join(placeholder(cls, column) for column in columns)})"
+        if update:
+            on_conflict = "ON CONFLICT (identifier) DO UPDATE SET " + ", ".join(
+                f"{column} = EXCLUDED.{column}" for column in columns[1:]
+            )
+        else:
+            on_conflict = "ON CONFLICT DO NOTHING"
+        params: list = []
+        for record in records:
+            params.extend([record.identifier, record.element, ingested_at])
+            params.extend(record.fields.values())
+            if provenance is not None:
+                params.extend(provenance.values)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) "
+                f"VALUES {', '.join([row_sql] * len(records))} "
+                f"{on_conflict} RETURNING identifier",
+                params,
+            )
+            written = {row[0] for row in cursor.fetchall()}
+        if not update:
+            logger.debug("Skipped %s existing activities", len(records) - len(written))
+        records = [r for r in records if r.identifier in written]
+        if not records:
+            return []
+
+        identifiers = [r.identifier for r in records]
+        for model in ACTIVITY_LINKED_MODELS:
+            model.objects.filter(activity_id__in=identifiers).delete()
+
+        Transaction.write_records(
+            (r.identifier, t) for r in records for t in r.transactions
+        )
+        Budget.write_records((r.identifier, e) for r in records for e in r.budgets)
+        Result.write_records((r.identifier, e) for r in records for e in r.results)
+        DocumentLink.write_records(
+            (r.identifier, e) for r in records for e in r.document_links
+        )
+        # Indexed for search as they are inserted
+        bulk_insert(
+            ActivityNarrative,
+            ["activity_id", "path", "lang", "text", "search"],
+            (
+                (r.identifier, n.path, n.lang, n.text, search_config(n.lang), n.text)
+                for r in records
+                for n in r.narratives
+            ),
+        )
+        logger.debug("Wrote activities %s", identifiers)
+        return identifiers
 
-        # Pop fields which will become related models
-        transactions = activity_element.pop("transaction", [])
 
-        # Pop fields - no models yet for these
-        budget = activity_element.pop("budget", [])
-        doclink = activity_element.pop("doclink", [])
-        result = activity_element.pop("result", [])
+class SourceIngest(models.Model):
+    """
+    The last complete write of the activities of a file: recorded once every
+    activity has been written and those it no longer has deleted, so that a
+    write which stopped part way is not taken for a finished one
+    """
 
-        narratives = find_narratives(activity_element, "")
+    # The `BaseRequest.source_hash` of the file
+    source_hash = models.TextField(primary_key=True)
+    publisher = models.TextField(blank=True, null=True, db_index=True)
+    # A digest of the content which was written
+    file_digest = models.TextField()
+    completed_at = models.DateTimeField()
 
-        # Perform save or update
-        exists = cls.objects.filter(pk=iid).exists()
-        if cls.objects.filter(pk=iid).exists() and not update:
-            logger.debug(f"skip update of activity {iid}")
-            return
+    def __str__(self):
+        return f"{self.source_hash} ({self.file_digest})"
 
-        elif exists:
-            cls.objects.filter(pk=iid).update(element=activity_element)
-            logger.debug(f"update activity {iid}")
+    @classmethod
+    def is_complete(cls, source_hash: str, file_digest: str) -> bool:
+        """
+        Whether this content of the file was last written in full
+        """
+        return cls.objects.filter(
+            source_hash=source_hash, file_digest=file_digest
+        ).exists()
 
-        else:
-            try:
-                cls.objects.create(pk=iid, element=activity_element)
-                logger.debug(f"create activity {iid}")
-            except IntegrityError:
-                """? race condition ? """
-                try:
-                    cls.objects.create(pk=iid, element=activity_element)
-                except IntegrityError as e:
-                    logger.error("Could not save activity: %s", e)
-            except Exception as e:
-                logger.error("Could not save activity: %s", e)
-                logger.error("%s", activity_element)
-                raise
-
-        # If we successfully saved - save transactions
-        if not cls.objects.filter(pk=iid).exists():
-            logger.error("Activity %s not saved", iid)
+    @classmethod
+    def record(cls, provenance: Provenance) -> None:
+        """
+        Record that a file has been written in full; in one statement, as
+        another worker may just have written the same file
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {cls._meta.db_table} "
+                "(source_hash, publisher, file_digest, completed_at) "
+                "VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (source_hash) DO UPDATE SET "
+                "publisher = EXCLUDED.publisher, "
+                "file_digest = EXCLUDED.file_digest, "
+                "completed_at = EXCLUDED.completed_at",
+                [
+                    provenance.source_hash,
+                    provenance.publisher,
+                    provenance.file_digest,
+                    timezone.now(),
+                ],
+            )
+
+
+# How activities relate to the key of each summary "dimension"; "{key}" is
+# the summary key column in the SQL below
+SUMMARY_DIMENSIONS = {
+    "reporting-org": "activity.reporting_org_ref = {key}",
+    "recipient-country": "activity.recipient_countries @> ARRAY[{key}]",
+}
+
+# The first key of the advisory locks which serialize refreshes of a summary
+SUMMARY_LOCK = 3010
+
+
+class SummaryManager(models.Manager):
+    def keys_for(self, identifiers: List[str]) -> Dict[str, set]:
+        """
+        The summary keys which these activities currently contribute to
+        """
+        keys: Dict[str, set] = {dimension: set() for dimension in SUMMARY_DIMENSIONS}
+        activities = Activity.objects.filter(pk__in=identifiers).values_list(
+            "reporting_org_ref", "recipient_countries"
+        )
+        for reporting_org_ref, recipient_countries in activities:
+            if reporting_org_ref:
+                keys["reporting-org"].add(reporting_org_ref)
+            keys["recipient-country"].update(recipient_countries)
+        return keys
+
+    def refresh_for(
+        self, identifiers: List[str], previous_keys: Dict[str, set] = None
+    ) -> None:
+        """
+        Refresh the summaries which these activities contribute to, now or before
+        an update (as returned by `keys_for`)
+        """
+        keys = self.keys_for(identifiers)
+        for dimension, previous in (previous_keys or {}).items():
+            keys[dimension] |= previous
+        for dimension, dimension_keys in keys.items():
+            self.refresh(dimension, dimension_keys)
+
+    def rebuild(self) -> None:
+        """
+        Refresh every summary from scratch
+        """
+        self.refresh("reporting-org", self._all_reporting_orgs())
+        self.refresh("recipient-country", self._all_recipient_countries())
+
+    def _all_reporting_orgs(self):
+        keys = set(
+            Activity.objects.exclude(reporting_org_ref=None)
+            .values_list("reporting_org_ref", flat=True)
+            .distinct()
+        )
+        keys.update(
+            self.filter(dimension="reporting-org").values_list("key", flat=True)
+        )
+        return keys
+
+    def _all_recipient_countries(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT DISTINCT unnest(recipient_countries) "
+                f"FROM {Activity._meta.db_table}"
+            )
+            keys = {row[0] for row in cursor.fetchall()}
+        keys.update(
+            self.filter(dimension="recipient-country").values_list("key", flat=True)
+        )
+        return keys
+
+    def refresh(self, dimension: str, keys) -> None:
+        """
+        Recompute the summaries of `dimension` for `keys` with set-based SQL
+        """
+        keys = sorted(keys)
+        if not keys:
             return
+        join = SUMMARY_DIMENSIONS[dimension]
+        summary = self.model._meta.db_table
+        total = SummaryTotal._meta.db_table
+        activity = Activity._meta.db_table
+        transaction_table = Transaction._meta.db_table
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Concurrent refreshes of a key would both delete its totals and
+            # then both insert them; lock the keys, in order, until commit
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(%s, hashtext(%s || ':' || k.key)) "
+                "FROM unnest(%s::text[]) AS k(key)",
+                [SUMMARY_LOCK, dimension, keys],
+            )
+            cursor.execute(
+                f"INSERT INTO {summary} (dimension, key, activity_count, updated) "
+                "SELECT %s, k.key, count(activity.identifier), now() "
+                "FROM unnest(%s::text[]) AS k(key) "
+                f"LEFT JOIN {activity} activity ON {join.format(key='k.key')} "
+                "GROUP BY k.key "
+                "ON CONFLICT (dimension, key) DO UPDATE SET "
+                "activity_count = EXCLUDED.activity_count, updated = EXCLUDED.updated",
+                [dimension, keys],
+            )
+            cursor.execute(
+                f"DELETE FROM {total} USING {summary} summary "
+                f"WHERE {total}.summary_id = summary.id "
+                "AND summary.dimension = %s AND summary.key = ANY(%s)",
+                [dimension, keys],
+            )
+            cursor.execute(
+                f"DELETE FROM {summary} "
+                "WHERE dimension = %s AND key = ANY(%s) AND activity_count = 0",
+                [dimension, keys],
+            )
+            cursor.execute(
+                f"INSERT INTO {total} "
+                "(summary_id, year, currency, commitments, disbursements) "
+                "SELECT summary.id, "
+                "EXTRACT(YEAR FROM t.value_date)::integer AS year, "
+                "coalesce(t.currency, '') AS currency, "
+                "coalesce(sum(t.value) FILTER (WHERE t.transaction_type = %s), 0), "
+                "coalesce(sum(t.value) FILTER (WHERE t.transaction_type = %s), 0) "
+                f"FROM {summary} summary "
+                f"JOIN {activity} activity ON {join.format(key='summary.key')} "
+                f"JOIN {transaction_table} t ON t.activity_id = activity.identifier "
+                "WHERE summary.dimension = %s AND summary.key = ANY(%s) "
+                "AND t.transaction_type IN (%s, %s) "
+                "GROUP BY summary.id, year, currency",
+                [
+                    TRANSACTION_TYPE_COMMITMENT,
+                    TRANSACTION_TYPE_DISBURSEMENT,
+                    dimension,
+                    keys,
+                    TRANSACTION_TYPE_COMMITMENT,
+                    TRANSACTION_TYPE_DISBURSEMENT,
+                ],
+            )
+        logger.debug("Refreshed %s %s summaries", len(keys), dimension)
+
+    def lookup(self, dimension: str, key: str) -> Union["Summary", None]:
+        return (
+            self.filter(dimension=dimension, key=key).prefetch_related("totals").first()
+        )
 
-        # Post-create:
-        instance = cls.objects.filter(pk=iid).get()
-        Transaction.from_xml(iid, transactions)
-        Budget.from_xml(iid, budget)
-        DocumentLink.from_xml(iid, doclink)
-        Result.from_xml(iid, result)
-        instance.save_narratives(narratives, activity_element)
+
+class Summary(models.Model):
+    """
+    Activity count and transaction totals per reporting organisation or
+    recipient country, maintained as activities are ingested.
+
+    A country summary counts the full value of an activity's transactions
+    against each of its recipient countries.
+    """
+
+    dimension = models.TextField(choices=[(d, d) for d in SUMMARY_DIMENSIONS])
+    key = models.TextField()
+    activity_count = models.IntegerField(default=0)
+    updated = models.DateTimeField()
+
+    objects = SummaryManager()
+
+    class Meta:
+        unique_together = [("dimension", "key")]
+
+    def __str__(self):
+        return f"{self.dimension} {self.key}"
+
+
+class SummaryTotal(models.Model):
+    """
+    Commitments and disbursements of a Summary for one year and currency
+    """
+
+    summary = models.ForeignKey(
+        Summary, on_delete=models.CASCADE, related_name="totals"
+    )
+    year = models.IntegerField(blank=True, null=True)
+    currency = models.TextField(blank=True)
+    commitments = models.DecimalField(max_digits=24, decimal_places=2, default=0)
+    disbursements = models.DecimalField(max_digits=24, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [("summary", "year", "currency")]
+        ordering = ["year", "currency"]
 
 
 class CodelistManager(models.Manager):
     def names(self):
-        return self.get_queryset().values_list("element__@name", flat=True)
+        return self.get_queryset().values_list("name", flat=True)
 
     def get_by_name(self, name: str) -> "Codelist":
-        return self.get_queryset().get(**{"element__@name": name})
+        return self.get_queryset().get(name=name)
 
 
 class Codelist(models.Model):
@@ -312,71 +1158,129 @@ class Codelist(models.Model):
     IATI codelist items
     """
 
+    name = models.TextField(unique=True)
     element = JSONField(null=True)
+    # Digest of the parsed codelist file, to skip unchanged files
+    digest = models.TextField(blank=True, default="")
     objects = CodelistManager()
 
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def _digest(element) -> str:
+        encoded = json.dumps(element, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha1(encoded.encode()).hexdigest()
+
     @classmethod
-    def from_dict(cls, element):
+    def from_dict(cls, element) -> bool:
         """
         Takes the content of an IATI Codelist XML and adapts it
         to suit the Codelist and CodelistItem models
+
+        Codelists are keyed by name and items by code: items are inserted,
+        updated or marked withdrawn (when no longer published) in bulk.
+
+        Returns:
+            Whether anything changed
         """
+        digest = cls._digest(element)
 
         # Handle some odd nesting
         codelist = element["codelist"]
-        codelist_wrapper = codelist.pop("codelist-items")
-        codelists = codelist_wrapper["codelist-item"]
-
+        codelist_wrapper = codelist.pop("codelist-items", None) or {}
         # This happens when only one element is in a list
-        if isinstance(codelists, dict):
-            codelists = [codelists]
+        items = as_list(codelist_wrapper.get("codelist-item"))
+        name = codelist["@name"]
+
+        incoming: Dict[str, dict] = {}
+        for item in items:
+            code = text(item.get("code"))
+            if code is None:
+                logger.warning('Codelist "%s" item has no code: %s', name, item)
+                continue
+            incoming[code] = item
+
+        with transaction.atomic():
+            instance, created = cls.objects.select_for_update().get_or_create(
+                name=name, defaults=dict(element=codelist, digest=digest)
+            )
+            if not created and instance.digest == digest:
+                logger.debug('Codelist "%s" is unchanged', name)
+                return False
+            if not created:
+                instance.element = codelist
+                instance.digest = digest
+                instance.save(update_fields=["element", "digest"])
+
+            existing = {item.code: item for item in instance.codelistitem_set.all()}
+            inserts = []
+            updates = []
+            for code, item in incoming.items():
+                withdrawn = codelist_item_withdrawn(item)
+                current = existing.get(code)
+                if current is None:
+                    inserts.append(
+                        CodelistItem(
+                            codelist=instance,
+                            code=code,
+                            element=item,
+                            withdrawn=withdrawn,
+                        )
+                    )
+                elif current.element != item or current.withdrawn != withdrawn:
+                    current.element = item
+                    current.withdrawn = withdrawn
+                    updates.append(current)
+            removed = [
+                item.pk
+                for code, item in existing.items()
+                if code not in incoming and not item.withdrawn
+            ]
+
+            CodelistItem.objects.bulk_create(inserts)
+            CodelistItem.objects.bulk_update(updates, ["element", "withdrawn"])
+            CodelistItem.objects.filter(pk__in=removed).update(withdrawn=True)
+            transaction.on_commit(codelist_registry_changed)
 
-        instance, _ = cls.objects.get_or_create(element=codelist)
-        CodelistItem.objects.bulk_create(
-            [CodelistItem(element=item, codelist=instance) for item in codelists]
-        )
         logger.debug(
-            'Codelist "%s" saved with %s items',
-            instance.element["@name"],
-            len(codelists),
+            'Codelist "%s" saved: %s new, %s updated, %s withdrawn items',
+            name,
+            len(inserts),
+            len(updates),
+            len(removed),
         )
+        return True
 
 
 class CodelistItemManager(models.Manager):
     def by_name(self, name):
-        return self.get_queryset().filter(**{"codelist__element__@name": name})
+        return self.get_queryset().filter(codelist__name=name)
 
     def withdrawn(self):
         """
-        Returns IATI codes with a "withdrawal date" which is not null
+        Returns IATI codes which are withdrawn, or no longer published
         """
-        return (
-            self.get_queryset()
-            .filter(**{"element__@withdrawal-date__isnull": False})
-            .select_related("codelist")
-        )
+        return self.get_queryset().filter(withdrawn=True).select_related("codelist")
 
 
 class CodelistItem(models.Model):
     element = JSONField(null=True)
     codelist = models.ForeignKey(Codelist, on_delete=models.CASCADE)
+    code = models.TextField()
+    withdrawn = models.BooleanField(default=False)
     objects = CodelistItemManager()
 
+    class Meta:
+        unique_together = [("codelist", "code")]
+
     @property
     def name(self):
-        try:
-            narrative = self.element["name"]["narrative"]
-        except KeyError:
-            logger.warn('No "name" property could be determined')
-            return ""
-
-        if isinstance(narrative, str):
-            return narrative
-        elif isinstance(narrative, list):
-            return narrative[0]
-        else:
+        name = narrative_text(self.element.get("name"))
+        if name is None:
             logger.warn('No "name" property could be determined')
             return ""
+        return name
 
 
 class Request(models.Model):
@@ -392,3 +1296,196 @@ class RequestCacheRecord(models.Model):
     def save(self, *args, **kwargs):
         """ On save, update timestamps """
         self.when = timezone.now().date()
+
+
+class IngestRun(models.Model):
+    """
+    One ingest of IATI XML files, split into shards which channel workers
+    process; see `coordinator`
+    """
+
+    created = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(blank=True, null=True)
+    # How the files were grouped into shards: "host" or "publisher"
+    shard_by = models.TextField()
+
+    def __str__(self):
+        return f"Ingest {self.pk} by {self.shard_by}"
+
+    def progress(self) -> Dict[str, int]:
+        """
+        The number of shards in each status
+        """
+        counts = dict.fromkeys(IngestShard.STATUSES, 0)
+        counts.update(
+            self.shards.values_list("status").annotate(n=Count("pk")).order_by()
+        )
+        return counts
+
+    @property
+    def done(self) -> bool:
+        return not self.shards.filter(status__in=IngestShard.ACTIVE).exists()
+
+    def reassign_stale(self, timeout: float, retries: int) -> List[int]:
+        """
+        Queue again the shards of workers which have not been heard from in
+        `timeout` seconds; shards which have been reassigned `retries` times
+        fail instead. Queued shards wait for a worker, however long.
+
+        Returns:
+            The shards queued again
+        """
+        cutoff = timezone.now() - datetime.timedelta(seconds=timeout)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {IngestShard._meta.db_table} SET "
+                f"status = CASE WHEN attempts >= %s "
+                f"THEN '{IngestShard.FAILED}' ELSE '{IngestShard.QUEUED}' END, "
+                "attempts = attempts + 1, worker = '', heartbeat = %s "
+                "WHERE run_id = %s AND status = %s AND heartbeat < %s "
+                "RETURNING id, status",
+                [retries, timezone.now(), self.pk, IngestShard.RUNNING, cutoff],
+            )
+            reassigned = cursor.fetchall()
+        for pk, status in reassigned:
+            logger.warning("Ingest %s shard %s is stale: %s", self.pk, pk, status)
+        return [pk for pk, status in reassigned if status == IngestShard.QUEUED]
+
+
+class IngestShard(models.Model):
+    """
+    XML files which one worker fetches and writes, in turn
+
+    A worker claims a queued shard, and holds it while its heartbeat is
+    recent; a shard which is processed twice is harmless, since activities
+    and organisations are upserted.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = (QUEUED, RUNNING, DONE, FAILED)
+    ACTIVE = (QUEUED, RUNNING)
+
+    run = models.ForeignKey(IngestRun, on_delete=models.CASCADE, related_name="shards")
+    # The host or publisher handle the files were grouped by
+    key = models.TextField()
+    # [url, publisher handle] of each file
+    requests = JSONField(default=list)
+    status = models.TextField(choices=[(s, s) for s in STATUSES], default=QUEUED)
+    # The channel name of the worker holding the shard
+    worker = models.TextField(blank=True, default="")
+    # When the shard was last queued, or its worker last reported
+    heartbeat = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["run", "status"])]
+
+    def __str__(self):
+        return f"{self.key} ({self.status})"
+
+    @classmethod
+    def claim(cls, pk: int, worker: str) -> Union["IngestShard", None]:
+        """
+        Take a queued shard for `worker`; None if it is not queued (another
+        worker has it, or it is finished)
+        """
+        claimed = cls.objects.filter(pk=pk, status=cls.QUEUED).update(
+            status=cls.RUNNING, worker=worker, heartbeat=timezone.now()
+        )
+        return cls.objects.get(pk=pk) if claimed else None
+
+    @classmethod
+    def claim_next(cls, run_id: int, worker: str) -> Union["IngestShard", None]:
+        """
+        Take the next queued shard of a run for `worker`; None if there are
+        none. Shards being claimed by other workers are skipped, not waited for.
+        """
+        with transaction.atomic():
+            shard = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(run_id=run_id, status=cls.QUEUED)
+                .order_by("pk")
+                .first()
+            )
+            if shard is None:
+                return None
+            shard.status, shard.worker = cls.RUNNING, worker
+            shard.heartbeat = timezone.now()
+            shard.save(update_fields=["status", "worker", "heartbeat"])
+        return shard
+
+    def beat(self) -> bool:
+        """
+        Report that this shard's worker is alive; False if the shard has been
+        reassigned, and the worker should stop
+        """
+        return bool(
+            IngestShard.objects.filter(
+                pk=self.pk, status=self.RUNNING, worker=self.worker
+            ).update(heartbeat=timezone.now())
+        )
+
+    def finish(self, failed: bool = False) -> bool:
+        """
+        Mark this shard done (or failed); False if it has been reassigned
+        """
+        return bool(
+            IngestShard.objects.filter(
+                pk=self.pk, status=self.RUNNING, worker=self.worker
+            ).update(
+                status=self.FAILED if failed else self.DONE, heartbeat=timezone.now()
+            )
+        )
+
+
+class Job(models.Model):
+    """
+    Fetch or parse work, queued in the database so that it survives restarts;
+    see `jobs`
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    DEAD = "dead"
+    STATUSES = (QUEUED, RUNNING, DONE, DEAD)
+    ACTIVE = (QUEUED, RUNNING)
+
+    kind = models.TextField()
+    payload = JSONField(default=dict)
+    # Higher first; see `jobs.PRIORITY_INTERACTIVE`
+    priority = models.IntegerField(default=0)
+    status = models.TextField(choices=[(s, s) for s in STATUSES], default=QUEUED)
+    # When a queued job may run; or, while it runs, when its worker's lease
+    # expires and another worker may take it
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    worker = models.TextField(blank=True, default="")
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(blank=True, null=True)
+    # At most one queued or running job has each key; see `jobs.enqueue`
+    dedupe_key = models.TextField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["-priority", "available_at"],
+                name="job_claim_idx",
+                condition=Q(status__in=["queued", "running"]),
+            )
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dedupe_key"],
+                name="job_dedupe_uniq",
+                condition=Q(status__in=["queued", "running"]),
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.pk} ({self.status})"
@@ -0,0 +1,56 @@
+"""
+Keyset ("seek") pagination
+
+Each page is read from an index, after the key of the last row of the page
+before, however deep into the list it is; unlike OFFSET, which reads (and
+throws away) every earlier row.
+"""
+
+from dataclasses import dataclass
+from typing import Any, List, Union
+
+from django.db.models import QuerySet
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+@dataclass
+class Page:
+    items: List[Any]
+    # The key to ask for the next page after; None on the last page
+    next: Union[Any, None]
+
+
+def page_size(value: Union[str, int, None], default: int = PAGE_SIZE) -> int:
+    """
+    A requested page size, within 1 and MAX_PAGE_SIZE
+    """
+    try:
+        size = int(value) if value else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_page(
+    queryset: QuerySet, key: str, after: Any = None, limit: int = PAGE_SIZE
+) -> Page:
+    """
+    The rows of `queryset` (of model instances or `.values()`) in `key`
+    order, from after `after`
+
+    One more row than the page is read, to know whether there is a next page.
+    """
+    queryset = queryset.order_by(key)
+    if after is not None:
+        queryset = queryset.filter(**{f"{key}__gt": after})
+    end = limit + 1
+    items = list(queryset[:end])
+    if len(items) <= limit:
+        return Page(items=items, next=None)
+    items = items[:limit]
+    last = items[-1]
+    return Page(
+        items=items, next=last[key] if isinstance(last, dict) else getattr(last, key)
+    )
@@ -0,0 +1,246 @@
+"""
+XML to dict parsers
+
+Both backends produce xmltodict's default output: attributes as "@name",
+text as "#text" when an element also has attributes or children, qualified
+names kept as "prefix:name", whitespace stripped, and repeated elements (or
+those named in `force_list`) as lists.
+
+"lxml" parses in C and releases each element as soon as it has been
+converted, so only the resulting dicts are held in memory. With either, a
+`children` function can replace each child of the root element (each
+activity, say) with something more compact as soon as that child has been
+parsed, so the whole document is never held as dicts.
+"""
+
+import io
+import sys
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple, Union
+from xml.parsers.expat import ExpatError
+
+import xmltodict
+from lxml import etree
+
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
+# Xml to JSON is not always clear about whether
+# element should be treated as a single element or a list.
+# In any situation where you encounter issues iterating over
+# something and find it's an unexpected type,
+# improve handling by adding it here.
+FORCE_LIST = frozenset(
+    {
+        "transaction",
+        "iati-activity",
+        "iati-organisation",
+        "narrative",
+        "total-budget",
+        "budget-line",
+        "codelist-item",
+        "budget",
+        "result",
+    }
+)
+
+# What the parsers raise for a document which is not (well formed) XML
+PARSE_ERRORS = (ExpatError, etree.XMLSyntaxError, TypeError, AssertionError)
+
+
+# Called with the name and value of each child of the root element; what it
+# returns is kept instead of the value
+Children = Callable[[str, Any], Any]
+
+
+def parse_xmltodict(
+    text: str, force_list: Set[str] = FORCE_LIST, children: Children = None
+) -> dict:
+    def replace_child(path: list, key: str, value: Any) -> Tuple[str, Any]:
+        # Each child of the root, as soon as it ends; not its attributes or
+        # text, which are pushed while it is at the same depth
+        if len(path) == 2 and key[0] not in "@#":
+            value = children(key, value)
+        return key, value
+
+    return xmltodict.parse(
+        text, force_list=force_list, postprocessor=replace_child if children else None
+    )
+
+
+def _push(item: Union[None, dict], key: str, data, force_list: Set[str]) -> dict:
+    """
+    Add a child to an element's dict, as xmltodict does
+    """
+    if item is None:
+        item = {}
+    if key in item:
+        value = item[key]
+        if isinstance(value, list):
+            value.append(data)
+        else:
+            item[key] = [value, data]
+    elif key in force_list:
+        item[key] = [data]
+    else:
+        item[key] = data
+    return item
+
+
+def _qualified_name(element, name: str) -> str:
+    """
+    "{uri}local" as the "prefix:local" which appears in the document
+    """
+    if not name.startswith("{"):
+        return name
+    uri, local = name[1:].split("}", 1)
+    if uri == XML_NAMESPACE:
+        return f"xml:{local}"
+    if name == element.tag:
+        prefix = element.prefix
+    else:
+        prefix = next((p for p, u in element.nsmap.items() if p and u == uri), None)
+    return f"{prefix}:{local}" if prefix else local
+
+
+def _attributes(element, item: Union[None, dict]) -> Union[None, dict]:
+    for name, value in element.items():
+        if name[0] == "{":
+            name = _qualified_name(element, name)
+        if item is None:
+            item = {}
+        item[sys.intern("@" + name)] = value
+    return item
+
+
+def _finish(item: Union[None, dict], chunks: List[str], force_list: Set[str]):
+    data = "".join(chunks).strip() or None if chunks else None
+    if item is None:
+        return data
+    if data:
+        _push(item, "#text", data, force_list)
+    return item
+
+
+def _convert(element, declarations: Dict, force_list: Set[str]):
+    """
+    An element and its children, as xmltodict would parse them
+    """
+    item = declarations.pop(element, None) if declarations else None
+    item = _attributes(element, item)
+    text = element.text
+    chunks = [text] if text else []
+    for child in element:
+        tail = child.tail
+        if tail:
+            chunks.append(tail)
+        name = child.tag
+        if name[0] == "{":
+            name = _qualified_name(child, name)
+        item = _push(
+            item,
+            sys.intern(name),
+            _convert(child, declarations, force_list),
+            force_list,
+        )
+    return _finish(item, chunks, force_list)
+
+
+def _lxml_events(text: Union[str, bytes], force_list: Set[str]) -> Iterator[tuple]:
+    """
+    Parse with lxml's iterparse: ("root", (element, attributes)) as the root
+    element starts, ("child", (name, value)) as each of its children ends,
+    and ("end", text chunks) at the end
+    """
+    assert text
+    # As xmltodict: text is read as UTF-8 whatever it declares, and bytes in
+    # their declared encoding
+    encoding = None
+    if isinstance(text, str):
+        text, encoding = text.encode("utf-8"), "utf-8"
+
+    events = etree.iterparse(
+        io.BytesIO(text),
+        events=("start-ns", "start", "end"),
+        encoding=encoding,
+        huge_tree=True,
+        no_network=True,
+        remove_comments=True,
+        remove_pis=True,
+        resolve_entities=False,
+    )
+
+    # Namespaces declared by an element appear as "@xmlns:prefix" attributes
+    pending: Dict[str, str] = {}
+    declarations: Dict = {}
+
+    # Each child of the root is converted, then released, as soon as it ends
+    root = None
+    chunks: List[str] = []
+    depth = 0
+    for event, element in events:
+        if event == "start-ns":
+            prefix, uri = element
+            pending["@xmlns:" + prefix if prefix else "@xmlns"] = uri
+        elif event == "start":
+            depth += 1
+            if pending:
+                declarations[element] = pending
+                pending = {}
+            if root is None:
+                root = element
+                yield "root", (root, _attributes(root, declarations.pop(root, None)))
+        else:
+            depth -= 1
+            if depth == 1:
+                name = sys.intern(_qualified_name(element, element.tag))
+                yield "child", (name, _convert(element, declarations, force_list))
+                element.clear(keep_tail=True)
+                while element.getprevious() is not None:
+                    chunks.append(element.getprevious().tail or "")
+                    del root[0]
+
+    assert root is not None
+    chunks.insert(0, root.text or "")
+    chunks.extend(child.tail or "" for child in root)
+    yield "end", chunks
+
+
+def parse_lxml(
+    text: Union[str, bytes],
+    force_list: Set[str] = FORCE_LIST,
+    children: Children = None,
+) -> dict:
+    """
+    Parse with lxml's iterparse, to the same dicts as `parse_xmltodict`
+    """
+    root = None
+    item: Union[None, dict] = None
+    for event, value in _lxml_events(text, force_list):
+        if event == "child":
+            name, value = value
+            if children:
+                value = children(name, value)
+            item = _push(item, name, value, force_list)
+        elif event == "root":
+            root, item = value
+        else:
+            item = _finish(item, value, force_list)
+    return _push(None, _qualified_name(root, root.tag), item, force_list)
+
+
+def iter_children(
+    text: Union[str, bytes], force_list: Set[str] = FORCE_LIST
+) -> Iterator[Tuple[str, Any]]:
+    """
+    The name and value of each child of the root element (each activity,
+    say), as soon as it has been parsed; as `parse_lxml` would have them
+    """
+    for event, value in _lxml_events(text, force_list):
+        if event == "child":
+            yield value
+
+
+PARSERS: Dict[str, Callable[..., dict]] = {
+    "xmltodict": parse_xmltodict,
+    "lxml": parse_lxml,
+}
+DEFAULT_PARSER = "xmltodict"
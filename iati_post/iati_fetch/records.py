@@ -0,0 +1,244 @@
+"""
+Compact, typed records of <iati-activity> elements
+
+An activity is held as its typed column values plus the JSON text of each
+part which is stored as "element", rather than as the nested dicts which
+the XML parsers produce; that is many times smaller. Records are made as
+soon as an activity has been parsed and are what `Activity.write_records`
+writes.
+"""
+
+import datetime
+import decimal
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple, Union
+
+from iati_fetch import codec
+from iati_fetch.elements import (
+    ACTIVITY_FIELDS,
+    activity_fields,
+    as_list,
+    transaction_fields,
+)
+from iati_fetch.search import normalise_lang
+
+logger = logging.getLogger(__name__)
+
+# Narratives without an xml:lang, on an activity without one
+DEFAULT_NARRATIVE_LANG = "en"
+
+
+class ActivityFormatException(Exception):
+    pass
+
+
+def dumps(value: Any) -> Union[str, None]:
+    """
+    JSON text for a jsonb column
+    """
+    if value is None:
+        return None
+    return codec.dumps(value)
+
+
+@dataclass
+class NarrativeRecord:
+    __slots__ = ("path", "lang", "text")
+    path: str
+    lang: str
+    text: str
+
+
+@dataclass
+class TransactionRecord:
+    __slots__ = (
+        "element",
+        "ref",
+        "description",
+        "transaction_type",
+        "value",
+        "value_date",
+        "currency",
+        "provider_org_ref",
+        "receiver_org_ref",
+        "sector_code",
+    )
+    element: str
+    ref: Union[str, None]
+    description: Union[str, None]
+    transaction_type: Union[str, None]
+    value: Union[decimal.Decimal, None]
+    value_date: Union[datetime.date, None]
+    currency: Union[str, None]
+    provider_org_ref: Union[str, None]
+    receiver_org_ref: Union[str, None]
+    sector_code: Union[str, None]
+
+    @classmethod
+    def from_element(
+        cls, transaction: dict, default_currency: Union[str, None] = None
+    ) -> "TransactionRecord":
+        fields = transaction_fields(transaction, default_currency)
+        ref = dumps(transaction.pop("@ref", None))
+        description = dumps(transaction.pop("description", None))
+        return cls(
+            element=dumps(transaction), ref=ref, description=description, **fields
+        )
+
+
+@dataclass
+class ActivityRecord:
+    __slots__ = (
+        "identifier",
+        "element",
+        "reporting_org_ref",
+        "activity_status",
+        "default_currency",
+        "sector_codes",
+        "recipient_countries",
+        "start_planned",
+        "start_actual",
+        "end_planned",
+        "end_actual",
+        "transactions",
+        "budgets",
+        "results",
+        "document_links",
+        "narratives",
+    )
+    identifier: str
+    element: str
+    reporting_org_ref: Union[str, None]
+    activity_status: Union[str, None]
+    default_currency: Union[str, None]
+    sector_codes: List[str]
+    recipient_countries: List[str]
+    start_planned: Union[datetime.date, None]
+    start_actual: Union[datetime.date, None]
+    end_planned: Union[datetime.date, None]
+    end_actual: Union[datetime.date, None]
+    transactions: Tuple[TransactionRecord, ...]
+    budgets: Tuple[str, ...]
+    results: Tuple[str, ...]
+    document_links: Tuple[str, ...]
+    narratives: Tuple[NarrativeRecord, ...]
+
+    @property
+    def fields(self) -> Dict[str, Any]:
+        """
+        The "hot" column values, as `elements.activity_fields`
+        """
+        return {name: getattr(self, name) for name in ACTIVITY_FIELDS}
+
+    @classmethod
+    def from_element(cls, activity_element: Any) -> "ActivityRecord":
+        """
+        Record an <iati-activity> element; the element is modified and
+        should be discarded
+        """
+        identifier = activity_identifier(activity_element)
+        fields = activity_fields(activity_element)
+
+        # Parts which are written to related models
+        transactions = activity_element.pop("transaction", None) or []
+        budgets = activity_element.pop("budget", None) or []
+        document_links = activity_element.pop("doclink", None) or []
+        results = activity_element.pop("result", None) or []
+
+        return cls(
+            identifier=identifier,
+            narratives=tuple(activity_narratives(activity_element)),
+            element=dumps(activity_element),
+            transactions=tuple(
+                TransactionRecord.from_element(t, fields["default_currency"])
+                for t in as_list(transactions)
+                if isinstance(t, dict)
+            ),
+            budgets=tuple(dumps(e) for e in as_list(budgets)),
+            results=tuple(dumps(e) for e in as_list(results)),
+            document_links=tuple(dumps(e) for e in as_list(document_links)),
+            **fields,
+        )
+
+
+def activity_identifier(activity_element: Any) -> str:
+    if not isinstance(activity_element, dict):
+        raise ActivityFormatException(
+            "Expected activity_element was %s not dictionary", type(activity_element)
+        )
+    if "iati-identifier" not in activity_element:
+        raise ActivityFormatException(
+            "Expected iati-identifier was missing in activity"
+        )
+    iid = activity_element["iati-identifier"]
+    if not isinstance(iid, str) or iid == "":
+        raise ActivityFormatException("Expected iati-identifier was a bad format")
+    return iid
+
+
+def find_narratives(element: Any, path: str, narratives: Dict[str, list] = None):
+    """
+    Narratives can be arbitrary lengths which makes
+    "sensible" activities hard to index.
+    Take these fields into a related model.
+    """
+    if narratives is None:
+        narratives = {}
+    if not isinstance(element, dict):
+        return narratives
+    for k, v in list(element.items()):
+        if k == "narrative":
+            narratives[f"{path}[{k}]"] = element.pop(k)
+        elif isinstance(v, dict):
+            find_narratives(v, f"{path}[{k}]", narratives)
+        elif isinstance(v, list):
+            for index, _element in enumerate(v):
+                find_narratives(_element, f"{path}[{k}][{index}]", narratives)
+    return narratives
+
+
+def activity_narratives(activity_element: dict) -> List[NarrativeRecord]:
+    """
+    Remove the <narrative>s from an activity element, as records with their
+    path in the element and their (normalised) language
+    """
+    activity_lang = activity_element.get("@xml:lang", None)
+    records = []
+    for path, text_or_items in find_narratives(activity_element, "").items():
+        for text_item in as_list(text_or_items):
+            if isinstance(text_item, str):
+                text, lang = text_item, activity_lang
+            elif isinstance(text_item, dict):
+                # No text when there is a lang tag but no #text
+                text, lang = text_item.get("#text"), text_item.get("@xml:lang")
+            else:
+                continue
+            if text:
+                lang = normalise_lang(lang) or DEFAULT_NARRATIVE_LANG
+                records.append(NarrativeRecord(path=path, lang=lang, text=text))
+    return records
+
+
+def activity_record(activity_element: Any) -> Union[ActivityRecord, None]:
+    """
+    Record an activity element, or log and skip one which is not valid
+    """
+    if isinstance(activity_element, ActivityRecord):
+        return activity_element
+    try:
+        return ActivityRecord.from_element(activity_element)
+    except ActivityFormatException as e:
+        logger.error("Skipping activity: %s", e)
+        logger.debug("%s", str(activity_element)[:200])
+        return None
+
+
+def record_children(name: str, element: Any) -> Any:
+    """
+    For `parsers`: each <iati-activity> as an ActivityRecord as soon as it has
+    been parsed
+    """
+    if name == "iati-activity":
+        return activity_record(element)
+    return element
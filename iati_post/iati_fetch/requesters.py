@@ -1,14 +1,14 @@
 import asyncio
-import json
+import hashlib
 import logging
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
 from ssl import SSLError
-from typing import Dict, List, Mapping, Union
+from typing import Dict, Iterable, List, Mapping, Tuple, Union
 from xml.parsers.expat import ExpatError
 
 import aiohttp
 import jsonpath_rw_ext as jp
-import xmltodict
 from aiohttp import (
     ClientOSError,
     ClientPayloadError,
@@ -18,11 +18,13 @@ from aiohttp import (
     TCPConnector,
 )
 from aiohttp.client_exceptions import ClientConnectorError
-from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.sync import sync_to_async
 from bs4 import BeautifulSoup
 from channels.db import database_sync_to_async
 from django.core.cache import cache
 
+from iati_fetch import codec
+from iati_fetch.elements import iati_root, root_children
 from iati_fetch.make_hashable import request_hash
 from iati_fetch.models import (
     Activity,
@@ -30,7 +32,18 @@ from iati_fetch.models import (
     Codelist,
     Organisation,
     OrganisationAbbreviation,
+    Provenance,
+    PublisherChanges,
+    SourceIngest,
 )
+from iati_fetch.parsers import (
+    DEFAULT_PARSER,
+    FORCE_LIST,
+    PARSE_ERRORS,
+    PARSERS,
+    Children,
+)
+from iati_fetch.records import record_children
 
 logging.captureWarnings(True)
 logger = logging.getLogger(__name__)
@@ -88,6 +101,43 @@ class NoSessionError(Exception):
     pass
 
 
+@lru_cache(maxsize=None)
+def compile_path(getter: str):
+    """
+    Parse a jsonpath expression once per process rather than once per match
+    """
+    return jp.parse(getter)
+
+
+def match(getter: str, got) -> list:
+    """
+    Like `jsonpath_rw_ext.match`, with a precompiled expression
+    """
+    return [found.value for found in compile_path(getter).find(got)]
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def new_session() -> ClientSession:
+    """
+    A session as used for all of our fetching: IATI publishers' certificates
+    are often invalid
+    """
+    return ClientSession(connector=TCPConnector(ssl=False))
+
+
+async def fetch_all(
+    requests: Iterable["BaseRequest"], session: ClientSession, limit: int
+) -> None:
+    """
+    Get (and cache) requests over one session, at most `limit` at a time
+    """
+    sema = asyncio.Semaphore(limit)
+    await asyncio.gather(*[r.bound_get(sema, session=session) for r in requests])
+
+
 @dataclass
 class BaseRequest:
     """
@@ -106,11 +156,15 @@ class BaseRequest:
         self.rhash = request_hash(**self.session_params)
 
     @classmethod
-    def from_event(cls, event):
+    def from_event(cls, event: Mapping):
         """
         From a "channels" event with a url, method, params; create a Request object
+
+        Keys of the event which are not arguments of the request (its "type")
+        are ignored.
         """
-        return cls(**event)
+        names = {f.name for f in fields(cls) if f.init}
+        return cls(**{k: v for k, v in event.items() if k in names})
 
     async def is_cached(self):
         has = await AsyncCache.has(self.rhash)
@@ -142,7 +196,7 @@ class BaseRequest:
 
             assert response.status == 200
             if self.expected_type == "json":
-                response_text = await response.json()
+                response_text = await response.json(loads=codec.loads)
             else:
                 response_text = await response.text()
             return response, response_text
@@ -160,65 +214,63 @@ class BaseRequest:
         If session is truthy, create one with no warning
         If falsey, create a session with a warning
         If session is a ClientSession use the provided Session
+        refresh:
+        Fetch again, even if the response is cached. The cached response is
+        only replaced when the fetch succeeds.
         """
-        has_key = await self.is_cached()  # noqa
-
         # Return from cache
-        if has_key:
-            if not refresh:
-                logger.debug(
-                    "Cache: response returned %s %s %s",
-                    self.method,
-                    self.url,
-                    self.params,
+        if not refresh and await self.is_cached():
+            logger.debug(
+                "Cache: response returned %s %s %s", self.method, self.url, self.params
+            )
+            response_text = await AsyncCache.get(self.rhash)
+            if self.expected_type == "json" and isinstance(response_text, str):
+                response_text = codec.loads(response_text)
+                assert isinstance(response_text, dict) or isinstance(
+                    response_text, list
                 )
-                response_text = await AsyncCache.get(self.rhash)
-                if self.expected_type == "json" and isinstance(response_text, str):
-                    response_text = json.loads(response_text)
-                    assert isinstance(response_text, dict) or isinstance(
-                        response_text, list
-                    )
 
-                return response_text
-            logger.debug("Cache: response dropped %s", self.url)
-            await self.drop()
-        else:
-            try:
-                if isinstance(session, ClientSession):
-                    response, response_text = await self._request(session=session)
-                else:
-                    if internal_session is not True:
-                        raise NoSessionError(
-                            'No "Session" object. Creating one session for request may be inefficient. pass "internal_session" arg'  # noqa
-                        )
-
-                    async with ClientSession(
-                        connector=TCPConnector(ssl=False)
-                    ) as session:
-                        response, response_text = await self._request(session)
-
-            except (
-                ResponseUnsuccessfulException,
-                ClientPayloadError,
-                SSLError,
-                ClientResponseError,
-                ClientConnectorError,
-                ServerDisconnectedError,
-                ClientOSError,
-            ) as e:
-                logger.warn("URL fetch failure %s", self)
-                logger.debug(e, exc_info=True)
-                return None
-            except NoSessionError:
-                raise
-            except Exception as e:
-                logger.error(e, exc_info=True)
-                return None
-            if cache:
-                await AsyncCache.set(self.rhash, response_text)
-                logger.debug("Cache: response saved %s", self.url)
             return response_text
 
+        try:
+            if isinstance(session, ClientSession):
+                response, response_text = await self._request(session=session)
+            else:
+                if internal_session is not True:
+                    raise NoSessionError(
+                        'No "Session" object. Creating one session for request may be inefficient. pass "internal_session" arg'  # noqa
+                    )
+
+                async with new_session() as session:
+                    response, response_text = await self._request(session)
+
+        except (
+            ResponseUnsuccessfulException,
+            ClientPayloadError,
+            SSLError,
+            ClientResponseError,
+            ClientConnectorError,
+            ServerDisconnectedError,
+            ClientOSError,
+        ) as e:
+            logger.warn("URL fetch failure %s", self)
+            logger.debug(e, exc_info=True)
+            return None
+        except NoSessionError:
+            raise
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            return None
+        if cache:
+            await AsyncCache.set(self.rhash, response_text)
+            if isinstance(response_text, str):
+                digest = await sync_to_async(text_digest)(response_text)
+                await AsyncCache.set(self.digest_key, digest)
+            else:
+                await AsyncCache.delete(self.digest_key)
+            logger.debug("Cache: response saved %s", self.url)
+        return response_text
+
     async def bound_get(self, sema, session=None, wait=0):
         """
         Wrap self.get with a semaphore; allow a wait if desired
@@ -228,11 +280,42 @@ class BaseRequest:
         async with sema:
             await self.get(session=session)
 
+    @property
+    def source_hash(self) -> str:
+        """
+        A digest of `rhash`, to record what was written from this request
+        """
+        return hashlib.sha1(repr(self.rhash).encode()).hexdigest()
+
+    @property
+    def digest_key(self) -> tuple:
+        """
+        The cache key of a digest of the cached response; see `digest`
+        """
+        return ("digest",) + self.rhash
+
+    async def digest(self) -> Union[str, None]:
+        """
+        A digest of the cached (text) response, kept beside it when it is
+        fetched so that it need not be read again; None if it is not cached
+        """
+        digest = await AsyncCache.get(self.digest_key)
+        if digest is None:
+            # Cached before digests were kept
+            got = await AsyncCache.get(self.rhash)
+            if not isinstance(got, str):
+                return None
+            digest = await sync_to_async(text_digest)(got)
+            await AsyncCache.set(self.digest_key, digest)
+        return digest
+
     def drop_sync(self):
         cache.delete(self.rhash)
+        cache.delete(self.digest_key)
 
     async def drop(self):
         await AsyncCache.delete(self.rhash)
+        await AsyncCache.delete(self.digest_key)
 
 
 @dataclass
@@ -241,37 +324,40 @@ class JSONRequest(BaseRequest):
 
     async def matches(self, getter, session: Union[ClientSession, None]):
         got = await self.get(session=session)
-        return jp.match(getter, got)
+        return match(getter, got)
 
 
 @dataclass
 class OrganisationRequestList(JSONRequest):
     url: str = organisation_list_url
 
-    async def to_list(self, session: Union[ClientSession, None]):
-        result = await self.get(session=session)
-        return result["result"]
-
-    def to_models(self):
+    async def to_list(
+        self, session: Union[ClientSession, None], internal_session: bool = False
+    ) -> Union[List[str], None]:
         """
-        Create OrganisationAbbreviation models
+        The registry's publisher handles; None if they could not be fetched
         """
-        in_models = set(OrganisationAbbreviation.objects.values_list("pk", flat=True))
-        in_iati_url = set(async_to_sync(self.to_list)())
+        result = await self.get(session=session, internal_session=internal_session)
+        if result is None:
+            return None
+        return result["result"]
 
-        additions = in_iati_url - in_models
-        withdrawn = in_models - in_iati_url
+    async def to_models(
+        self, session: Union[ClientSession, None] = None, internal_session: bool = False
+    ) -> Union[PublisherChanges, None]:
+        """
+        Sync OrganisationAbbreviation models with the registry's list; see
+        `OrganisationAbbreviation.sync`
 
-        # Additions from IATI record
-        OrganisationAbbreviation.objects.bulk_create(
-            [OrganisationAbbreviation(pk=pk) for pk in additions]
-        )
-        # No longer in IATI record
-        OrganisationAbbreviation.objects.filter(pk__in=withdrawn).update(withdrawn=True)
-        # Was missing from IATI last time, but it came back
-        OrganisationAbbreviation.objects.filter(withdrawn=True).exclude(
-            pk__in=withdrawn
-        ).update(withdrawn=False)
+        Returns:
+            How the publishers changed; None if the list could not be
+            fetched, or was empty, when nothing is changed
+        """
+        handles = await self.to_list(session, internal_session=internal_session)
+        if not handles:
+            logger.error("No publishers from %s: not synced", self)
+            return None
+        return await database_sync_to_async(OrganisationAbbreviation.sync)(handles)
 
 
 @dataclass
@@ -312,6 +398,16 @@ class OrganisationRequestDetail(JSONRequest):
             for resource in resources
         ]
 
+    async def cached_xml_requests(self) -> List["IatiXMLRequest"]:
+        """
+        This publisher's XML files which are in the cache, without fetching
+        anything
+        """
+        if not await self.is_cached():
+            return []
+        requests = await self.iati_xml_requests(session=None)
+        return [request for request in requests if await request.is_cached()]
+
     async def result__results(self):
         result = await self.result()
         return result["results"]
@@ -319,46 +415,67 @@ class OrganisationRequestDetail(JSONRequest):
 
 @dataclass
 class XMLRequest(BaseRequest):
-    async def to_json(self) -> dict:
+    """
+    An XML file; the parsed document is kept on the request, so that each
+    file is parsed once however many times it is searched
+
+    `parser` is one of `parsers.PARSERS`: "lxml" is faster and uses less
+    memory for large files.
+    """
+
+    parser: str = DEFAULT_PARSER
+    parse_count: int = field(default=0, init=False, repr=False, compare=False)
+    _parsed: Union[None, dict] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    async def to_json(self, children: Children = None) -> dict:
         """
         Activity objects as xmltojson'd objects
+
+        Args:
+            children: Replaces each child of the root, as it is parsed; see
+                `parsers`. Not applied if the document was already parsed.
         """
+        if self._parsed is not None:
+            return self._parsed
         logger.debug("to_json %s", self)
         cached = await self.is_cached()
         if not cached:
             logger.warn("Request was not cached")
             return {}
         got = await self.get(session=None)
-        # Xml to JSON is not always clear about whether
-        # element should be treated as a single element or a list.
-        # In any situation where you encounter issues iterating over
-        # something and find it's an unexpected type,
-        # improve handling by setting force_list to true.
-
-        force_list = {
-            "transaction",
-            "iati-activity",
-            "iati-organisation",
-            "narrative",
-            "total-budget",
-            "budget-line",
-            "codelist-item",
-            "budget",
-            "result",
-        }
+        self._parsed = await sync_to_async(self.parse)(got, children=children)
+        return self._parsed
+
+    def parse(self, got: Union[str, None], children: Children = None) -> dict:
+        """
+        Parse XML text to xmltodict'd objects; {} if it is not valid XML
+        """
+        self.parse_count += 1
         try:
             assert got
-            return xmltodict.parse(got, force_list=force_list)
-        except (ExpatError, TypeError, AssertionError) as e:
+            return PARSERS[self.parser](got, force_list=FORCE_LIST, children=children)
+        except PARSE_ERRORS as e:
             logger.warn("XML parse error %s", self)
             logger.error(e, exc_info=True)
 
-        logger.debug("to_json %s", self)
         return {}
 
+    def forget(self):
+        """
+        Release the parsed document: it is large, and writing it to models
+        modifies it
+        """
+        self._parsed = None
+
+    async def drop(self):
+        self.forget()
+        await super().drop()
+
     async def matches(self, getter) -> list:
         got: dict = await self.to_json()
-        matches: list = jp.match(getter, got)
+        matches: list = match(getter, got)
         return matches
 
 
@@ -367,40 +484,120 @@ class IatiXMLRequest(XMLRequest):
 
     organisation_handle: Union[str, None] = None
 
-    async def activities(self):
-        return await self.matches("[iati-activities][iati-activity]")
+    async def activities(self) -> List[dict]:
+        got = await self.to_json()
+        return root_children(got, "iati-activities", "iati-activity")
 
-    async def organisations(self):
-        return await self.matches("""['iati-organisations']['iati-organisation']""")
+    async def organisations(self) -> List[dict]:
+        got = await self.to_json()
+        return root_children(got, "iati-organisations", "iati-organisation")
 
-    async def to_instances(self):
+    async def elements(self) -> Tuple[Union[str, None], List[dict]]:
         """
-        Write to Django models
+        The root of this file and its activities or organisations, from a
+        single parse
         """
+        got = await self.to_json()
+        return iati_root(got)
 
-        organisations = await self.organisations()
-        activities = await self.activities()
+    async def to_instances(
+        self,
+        activities: bool = True,
+        organisations: bool = True,
+        skip_unchanged: bool = True,
+    ) -> Tuple[Union[str, None], List[str]]:
+        """
+        Write to Django models
 
-        if activities:
-            try:
-                await database_sync_to_async(Activity.from_xml)(activities)
-            except ActivityFormatException:
-                logger.error("Failed to import %s", activities)
-                logger.error("%s", self)
-            except (ExpatError, TypeError) as e:
-                logger.error("%s Failure on file %s", e, self)
-                pass
-
-        if organisations:
-            try:
-                await database_sync_to_async(Organisation.from_xml)(organisations)
-            except KeyError:
-                logger.error("Failed to import %s", organisations)
-                logger.error("%s", self)
-                raise
-            except (ExpatError, TypeError) as e:
-                logger.error("%s Failure on file %s", e, self)
-                pass
+        Activities are written with their provenance (see
+        `models.Provenance`), replacing those written from this file before.
+
+        Args:
+            activities: Write the elements of an "iati-activities" file
+            organisations: Write the elements of an "iati-organisations" file
+            skip_unchanged: Write nothing, and do not parse, if this file's
+                activities were last written from the same content
+
+        Returns:
+            The root of the file, and the identifiers of the activities or
+            organisations written
+        """
+        try:
+            if not await self.is_cached():
+                logger.warn("Request was not cached")
+                return None, []
+            got = await self.get(session=None)
+            # Hashing and parsing a large file take a while: not on the loop
+            digest = await sync_to_async(text_digest)(got)
+            if skip_unchanged and activities and await self._unchanged(digest):
+                logger.info("Activities of %s are unchanged", self)
+                return "iati-activities", []
+            if self._parsed is None:
+                # Activities are kept as compact records from as soon as each
+                # one is parsed
+                self._parsed = await sync_to_async(self.parse)(
+                    got, children=record_children
+                )
+            del got
+            root, elements = await self.elements()
+            if not elements:
+                logger.debug("Nothing to write from %s (root %s)", self, root)
+            elif root == "iati-activities" and activities:
+                return root, await self._write_activities(elements, digest)
+            elif root == "iati-organisations" and organisations:
+                return root, await self._write_organisations(elements)
+            return root, []
+        finally:
+            self.forget()
+
+    async def _unchanged(self, digest: str) -> bool:
+        return await database_sync_to_async(SourceIngest.is_complete)(
+            self.source_hash, digest
+        )
+
+    async def _write_activities(self, activities: List[dict], digest: str) -> List[str]:
+        logger.info("Writing %s activities from %s", len(activities), self)
+        provenance = Provenance(
+            publisher=self.organisation_handle,
+            source_hash=self.source_hash,
+            file_digest=digest,
+        )
+        try:
+            changes = await database_sync_to_async(Activity.replace_source)(
+                activities, provenance
+            )
+            logger.info(
+                "%s: %s activities added, %s updated, %s removed",
+                self,
+                len(changes.added),
+                len(changes.updated),
+                len(changes.removed),
+            )
+            return changes.added + changes.updated
+        except ActivityFormatException:
+            logger.error("Failed to import %s", activities)
+            logger.error("%s", self)
+        except (ExpatError, TypeError) as e:
+            logger.error("%s Failure on file %s", e, self)
+        return []
+
+    async def _write_organisations(self, organisations: List[dict]) -> List[str]:
+        if not self.organisation_handle:
+            logger.error("No publisher handle for organisations in %s", self)
+            return []
+        logger.info("Writing %s organisations from %s", len(organisations), self)
+        try:
+            # The publisher's file as it is now
+            return await database_sync_to_async(Organisation.from_xml)(
+                organisations, abbr=self.organisation_handle, update=True
+            )
+        except KeyError:
+            logger.error("Failed to import %s", organisations)
+            logger.error("%s", self)
+            raise
+        except (ExpatError, TypeError) as e:
+            logger.error("%s Failure on file %s", e, self)
+        return []
 
     async def to_instances_semaphored(
         self, sema: asyncio.Semaphore, session: Union[ClientSession, None]
@@ -413,8 +610,25 @@ class IatiXMLRequest(XMLRequest):
 @dataclass
 class IatiCodelistDetailRequest(XMLRequest):
     async def to_instances(self):
-        as_json = await self.to_json()
-        await database_sync_to_async(Codelist.from_dict)(element=as_json)
+        """
+        Parse and save a cached codelist in a database thread
+        """
+        if not await self.is_cached():
+            logger.warn("Request was not cached %s", self)
+            return
+        got = await self.get(session=None)
+        await database_sync_to_async(self._save)(got)
+
+    def _save(self, got: str):
+        as_json = self.parse(got)
+        if not as_json:
+            logger.error("No codelist in %s", self)
+            return
+        Codelist.from_dict(element=as_json)
+
+    async def to_instances_semaphored(self, sema: asyncio.Semaphore):
+        async with sema:
+            await self.to_instances()
 
 
 @dataclass
@@ -425,9 +639,14 @@ class IatiCodelistListRequest(BaseRequest):
     IATI publishes its codelists in 3 formats: XML, JSON, and  CSV.
     XML is "canonical" and includes all data. Past experience has shown that
     the JSON data misses attributes (ie "withdrawn" status.)
+
+    Codelist files are fetched at most `fetch_limit` at a time, and parsed and
+    saved at most `write_limit` at a time (each save takes a database thread).
     """
 
     url: str = "http://reference.iatistandard.org/203/codelists/downloads/clv3/xml/"
+    fetch_limit: int = 10
+    write_limit: int = 4
 
     async def _process_links(self, session: Union[ClientSession, None]) -> List[str]:
         """
@@ -442,7 +661,9 @@ class IatiCodelistListRequest(BaseRequest):
                 xml_refs.append(self.url + href)
         return xml_refs
 
-    async def _xml_requests(self, session: ClientSession) -> List[XMLRequest]:
+    async def _xml_requests(
+        self, session: ClientSession
+    ) -> List[IatiCodelistDetailRequest]:
         """
         Fetch 'XMLRequest' objects for all the links
         """
@@ -451,23 +672,22 @@ class IatiCodelistListRequest(BaseRequest):
 
     async def _fetch_links(
         self, session: Union[ClientSession, None] = None
-    ) -> List[XMLRequest]:
+    ) -> List[IatiCodelistDetailRequest]:
         """
         Cache all of the xml files found on the page with a single Session object
         """
         if session:
             xml_requests = await self._xml_requests(session=session)
-            await asyncio.gather(*[r.get(session=session) for r in xml_requests])
+            await fetch_all(xml_requests, session=session, limit=self.fetch_limit)
             return xml_requests
 
-        async with ClientSession() as session:
-            xml_requests = await self._xml_requests(session=session)
-            await asyncio.gather(*[r.get(session=session) for r in xml_requests])
-            return xml_requests
+        async with new_session() as session:
+            return await self._fetch_links(session=session)
 
-    async def to_instances(self):
+    async def to_instances(self, session: Union[ClientSession, None] = None):
         """
         Save as "Codelist" items
         """
-        requests = await self._fetch_links()
-        await asyncio.gather(*[r.to_instances() for r in requests])
+        requests = await self._fetch_links(session=session)
+        sema = asyncio.Semaphore(self.write_limit)
+        await asyncio.gather(*[r.to_instances_semaphored(sema) for r in requests])
@@ -0,0 +1,72 @@
+"""
+Full-text search configuration for ActivityNarrative text
+"""
+
+from functools import reduce
+from operator import or_
+from typing import Iterable, Union
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db.models import Case, TextField, Value, When
+
+# Postgres text search configurations for IATI (ISO 639-1) narrative languages
+SEARCH_CONFIGS = {
+    "da": "danish",
+    "de": "german",
+    "en": "english",
+    "es": "spanish",
+    "fi": "finnish",
+    "fr": "french",
+    "hu": "hungarian",
+    "it": "italian",
+    "nb": "norwegian",
+    "nl": "dutch",
+    "no": "norwegian",
+    "pt": "portuguese",
+    "ro": "romanian",
+    "ru": "russian",
+    "sv": "swedish",
+    "tr": "turkish",
+}
+
+# For languages Postgres cannot stem: lowercased words only
+DEFAULT_SEARCH_CONFIG = "simple"
+
+
+def normalise_lang(lang: Union[str, None]) -> Union[str, None]:
+    """
+    "EN-gb" -> "en"
+    """
+    if not lang:
+        return None
+    return lang.strip().split("-")[0].split("_")[0].lower() or None
+
+
+def search_config(lang: Union[str, None]) -> str:
+    return SEARCH_CONFIGS.get(normalise_lang(lang), DEFAULT_SEARCH_CONFIG)
+
+
+def search_vector(field: str = "text") -> SearchVector:
+    """
+    A tsvector of `field` using the configuration of each row's "lang"
+    """
+    config = Case(
+        *[
+            When(lang=lang, then=Value(config))
+            for lang, config in SEARCH_CONFIGS.items()
+        ],
+        default=Value(DEFAULT_SEARCH_CONFIG),
+        output_field=TextField(),
+    )
+    return SearchVector(field, config=config)
+
+
+def search_query(text: str, langs: Iterable[str] = None) -> SearchQuery:
+    """
+    Match `text` stemmed for any of `langs` (default: every configured language)
+    """
+    if langs:
+        configs = {search_config(lang) for lang in langs}
+    else:
+        configs = set(SEARCH_CONFIGS.values()) | {DEFAULT_SEARCH_CONFIG}
+    return reduce(or_, [SearchQuery(text, config=config) for config in sorted(configs)])
@@ -1,51 +1,36 @@
-import asyncio
 import logging
-from typing import List
-from xml.parsers.expat import ExpatError
+from typing import Any, Awaitable, Callable, Dict, List, Union
 
-from aiohttp import ClientSession, TCPConnector
+from aiohttp import ClientSession
 from channels.db import database_sync_to_async
 
-from iati_fetch.models import Activity, ActivityFormatException, Organisation
-
-from . import requesters
+from . import models, requesters
 
 logger = logging.getLogger(__name__)
 
+# Called with the name of each step of an ingest, and its details
+Progress = Callable[..., Awaitable[None]]
+
 
 async def fetch_requests(*requests, semaphore_count=2000, cached=True, uncached=True):
-    sem = asyncio.Semaphore(semaphore_count)
-    tasks = []
-    print(len(requests))
+    """
+    Get (and cache) requests over one session, `semaphore_count` at a time
 
-    async def only_uncached_requests():
-        returned = []
-        for r in requests:
-            include = await r.is_cached()
-            print(include)
-        if not include:
-            returned.append(r)
-        return returned
-
-    async def only_cached_requests():
-        returned = []
+    Args:
+        cached: Include requests which are already cached
+        uncached: Include requests which are not cached yet
+    """
+    if not cached or not uncached:
+        included = []
         for r in requests:
-            include = await r.is_cached()
-        if include:
-            returned.append(r)
-        return returned
-
-    if not cached:
-        requests = await only_uncached_requests()
-    if not uncached:
-        requests = await only_cached_requests()
-
-    async with ClientSession(connector=TCPConnector(ssl=False)) as session:
-        for request in requests:
-            tasks.append(request.bound_get(sem, session=session))
-        task_count = len(tasks)
-        print(f"Gathering {task_count} tasks")
-        await asyncio.gather(*tasks)
+            is_cached = await r.is_cached()
+            if (cached and is_cached) or (uncached and not is_cached):
+                included.append(r)
+        requests = tuple(included)
+
+    logger.info("Gathering %s requests", len(requests))
+    async with requesters.new_session() as session:
+        await requesters.fetch_all(requests, session=session, limit=semaphore_count)
     return requests
 
 
@@ -72,7 +57,7 @@ async def xml_requests_list(
     with an organisation  abbreviation
     """
     requests_list = []
-    async with ClientSession(connector=TCPConnector(ssl=False)) as session:
+    async with requesters.new_session() as session:
         for detail_request in organisations:
             xml_requests = await detail_request.iati_xml_requests(session=session)
             for xml_request in xml_requests:
@@ -86,16 +71,45 @@ async def xml_requests_fetch(requests_list: List[requesters.IatiXMLRequest]) ->
     return await fetch_requests(*requests_list)
 
 
+async def publishers_sync(
+    session: Union[ClientSession, None] = None
+) -> Union[models.PublisherChanges, None]:
+    """
+    Sync the publishers with the registry's list; None if it could not be
+    fetched
+    """
+    return await requesters.OrganisationRequestList().to_models(
+        session=session, internal_session=session is None
+    )
+
+
 async def xml_requests_get(
-    organisations: List[str] = None
+    organisations: List[str] = None, incremental: bool = False
 ) -> List[requesters.IatiXMLRequest]:
     """
     Fetches all of the XML requests associated with particular organisations
+
+    Args:
+        organisations: Publisher handles; by default, every publisher
+        incremental: Instead of every publisher, sync the list of publishers
+            and only those which have not been ingested since they were added
+            or restored (see `models.OrganisationAbbreviation.pending`)
     """
     logger.info("Fetching Organisation List")
-    if not organisations:
+    if not organisations and incremental:
+        if await publishers_sync() is None:
+            logger.warning("Publishers not synced; ingesting those pending")
+        organisations = await database_sync_to_async(
+            models.OrganisationAbbreviation.pending
+        )()
+        if not organisations:
+            logger.info("No publishers to ingest")
+            return []
+    elif not organisations:
         orl = requesters.OrganisationRequestList()
-        organisations = await orl.to_list(session=None)
+        organisations = await orl.to_list(session=None, internal_session=True)
+        if organisations is None:
+            return []
     logger.info("Convert list into request objects")
     organisation_requests = await organisation_requests_list(organisations)
     logger.info("Grab XML file references for organisations: as URLs")
@@ -111,41 +125,97 @@ async def xml_requests_get(
 
 
 async def xml_requests_process(
-    organisations: list = None, include_activities=True, include_organisations=True
+    organisations: list = None,
+    include_activities=True,
+    include_organisations=True,
+    incremental: bool = False,
 ):
     # Collect & cache all of the Organisation information from IATI
-    xml_requests = await xml_requests_get(organisations)
+    xml_requests = await xml_requests_get(organisations, incremental=incremental)
     logger.info("XML requests are going to be processed")
+    # Publishers with a file which was not cached
+    incomplete = set()
     for req in xml_requests:
-        # Search for tags in the JSON-dumped data
-        activity_elements: List[dict] = []
-        organisation_elements: List[dict] = []
-
-        if include_activities:
-            activity_elements = await req.activities()
-        if activity_elements:
-            try:
-                logger.info(f"activity_elements process from {req}")
-                await database_sync_to_async(Activity.from_xml)(activity_elements)
-            except ActivityFormatException:
-                logger.error("Failed to import %s", activity_elements)
-                logger.error("%s", req)
-            except (ExpatError, TypeError) as e:
-                logger.error("%s Failure on file %s", e, req)
-                raise
-                pass
-        if include_organisations:
-            logger.info(f"organisations process from {req}")
-            organisation_elements = await req.organisations()
-        if organisation_elements:
-            try:
-                await database_sync_to_async(Organisation.from_xml)(
-                    organisation_elements, abbr=req.organisation_handle
-                )
-            except KeyError:
-                logger.error("Failed to import %s", organisation_elements)
-                logger.error("%s", req)
-                raise
-            except (ExpatError, TypeError) as e:
-                logger.error("%s Failure on file %s", e, req)
-                pass
+        if not await req.is_cached():
+            incomplete.add(req.organisation_handle)
+            continue
+        # One parse per file: its root says whether it holds activities or
+        # organisations
+        await req.to_instances(
+            activities=include_activities, organisations=include_organisations
+        )
+    await database_sync_to_async(models.OrganisationAbbreviation.mark_ingested)(
+        {req.organisation_handle for req in xml_requests} - incomplete
+    )
+
+
+async def publisher_ingest(
+    organisation_handle: str,
+    progress: Union[Progress, None] = None,
+    session: Union[ClientSession, None] = None,
+    refresh: bool = False,
+) -> Dict[str, Any]:
+    """
+    Fetch and write each of the XML files of one publisher, reporting as it
+    goes
+
+    Args:
+        progress: Awaited with each event: "files" (the URLs found),
+            "downloaded" (a URL and its size in bytes), "written" (a URL and
+            the number of activities and organisations written from it) and
+            "error" (a URL and what went wrong)
+        refresh: Fetch the publisher's list of files and each file again,
+            even if they are cached
+
+    Returns:
+        The totals of the ingest
+    """
+    if session is None:
+        async with requesters.new_session() as session:
+            return await publisher_ingest(
+                organisation_handle, progress, session, refresh
+            )
+
+    async def report(event: str, **data):
+        if progress is not None:
+            await progress(event, **data)
+
+    detail = requesters.OrganisationRequestDetail(
+        organisation_handle=organisation_handle
+    )
+    totals = dict(files=0, bytes=0, activities=0, organisations=0, errors=0)
+    if await detail.get(session=session, refresh=refresh) is None:
+        totals["errors"] += 1
+        await report("error", url=detail.url, error="Publisher not found")
+        return totals
+
+    xml_requests = await detail.iati_xml_requests(session=session)
+    totals["files"] = len(xml_requests)
+    await report("files", urls=[r.url for r in xml_requests])
+
+    for request in xml_requests:
+        got = await request.get(session=session, refresh=refresh)
+        if got is None:
+            totals["errors"] += 1
+            await report("error", url=request.url, error="Download failed")
+            continue
+        size = len(got.encode("utf-8"))
+        totals["bytes"] += size
+        await report("downloaded", url=request.url, bytes=size)
+        del got
+
+        try:
+            root, written = await request.to_instances()
+        except Exception as e:
+            logger.error("Ingest of %s failed", request, exc_info=True)
+            totals["errors"] += 1
+            await report("error", url=request.url, error=repr(e))
+            continue
+        key = "organisations" if root == "iati-organisations" else "activities"
+        totals[key] += len(written)
+        await report("written", url=request.url, **{key: len(written)})
+    if not totals["errors"]:
+        await database_sync_to_async(models.OrganisationAbbreviation.mark_ingested)(
+            [organisation_handle]
+        )
+    return totals
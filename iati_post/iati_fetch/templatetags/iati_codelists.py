@@ -0,0 +1,13 @@
+from django import template
+
+from iati_fetch.codelists import registry
+
+register = template.Library()
+
+
+@register.filter
+def codelist_name(code, codelist):
+    """
+    {{ "TL"|codelist_name:"Country" }} -> "Timor-Leste"
+    """
+    return registry.name(codelist, code, default=code)
@@ -1,8 +1,16 @@
+from unittest import mock
+
 import pytest
-from channels.testing import WebsocketCommunicator
+from channels.layers import get_channel_layer
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
 
+from iati_fetch import consumers, requesters
 from iati_post.routing import application
 
+IN_MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+# Refuses connections at once
+UNREACHABLE_URL = "http://127.0.0.1:1/"
+
 
 @pytest.mark.asyncio
 async def test_echo():
@@ -35,3 +43,183 @@ async def test_fetch_organisation_list():
     # assert "result" in response
     # Close
     await communicator.disconnect()
+
+
+def test_request_from_event():
+    request = requesters.BaseRequest.from_event(
+        {"type": "get", "url": "http://example.com/", "params": {"a": "1"}}
+    )
+    assert request.url == "http://example.com/"
+    assert request.params == {"a": "1"}
+
+
+@pytest.mark.asyncio
+async def test_request_consumer_batch(settings):
+    """
+    A batch of URLs is fetched (here, from cache) in one message
+    """
+    settings.CHANNEL_LAYERS = IN_MEMORY_LAYERS
+    urls = [f"http://example.com/batch/{i}" for i in range(3)]
+    for url in urls:
+        await requesters.AsyncCache.set(requesters.BaseRequest(url=url).rhash, url)
+    channel_layer = get_channel_layer()
+    reply_channel = await channel_layer.new_channel()
+
+    communicator = ApplicationCommunicator(
+        consumers.RequestConsumer, {"type": "channel", "channel": "request"}
+    )
+    await communicator.send_input(
+        {
+            "type": "get",
+            "urls": urls + [UNREACHABLE_URL],
+            "reply_channel": reply_channel,
+        }
+    )
+    reply = await channel_layer.receive(reply_channel)
+    assert reply == {"type": "request.fetched", "ok": urls, "failed": [UNREACHABLE_URL]}
+
+    await communicator.send_input(
+        {"type": "clear_cache", "requests": [{"url": url} for url in urls]}
+    )
+    # Messages are handled in turn
+    await communicator.send_input(
+        {"type": "get", "url": UNREACHABLE_URL, "reply_channel": reply_channel}
+    )
+    await channel_layer.receive(reply_channel)
+    for url in urls:
+        assert not await requesters.BaseRequest(url=url).is_cached()
+    communicator.stop()
+
+
+@pytest.mark.asyncio
+async def test_request_consumer_refresh(settings):
+    """
+    With "refresh", a cached URL is fetched again; a failed fetch leaves the
+    cached response in place
+    """
+    settings.CHANNEL_LAYERS = IN_MEMORY_LAYERS
+    request = requesters.BaseRequest(url=UNREACHABLE_URL)
+    await requesters.AsyncCache.set(request.rhash, "cached")
+    channel_layer = get_channel_layer()
+    reply_channel = await channel_layer.new_channel()
+
+    communicator = ApplicationCommunicator(
+        consumers.RequestConsumer, {"type": "channel", "channel": "request"}
+    )
+    await communicator.send_input(
+        {"type": "get", "url": UNREACHABLE_URL, "reply_channel": reply_channel}
+    )
+    reply = await channel_layer.receive(reply_channel)
+    assert reply["ok"] == [UNREACHABLE_URL]
+
+    await communicator.send_input(
+        {
+            "type": "get",
+            "url": UNREACHABLE_URL,
+            "refresh": True,
+            "reply_channel": reply_channel,
+        }
+    )
+    reply = await channel_layer.receive(reply_channel)
+    assert reply["failed"] == [UNREACHABLE_URL]
+    assert await requesters.AsyncCache.get(request.rhash) == "cached"
+    communicator.stop()
+    await request.drop()
+
+
+@pytest.mark.asyncio
+async def test_activities_streamed_with_acks(settings):
+    """
+    Activities arrive in chunks, no more than `window` ahead of the client
+    """
+    settings.CHANNEL_LAYERS = IN_MEMORY_LAYERS
+    url = "http://example.com/stream-activities.xml"
+    request = requesters.IatiXMLRequest(url=url)
+    await requesters.AsyncCache.set(
+        request.rhash,
+        "<iati-activities>"
+        + "".join(
+            f"<iati-activity><iati-identifier>ST-{i}</iati-identifier></iati-activity>"
+            for i in range(5)
+        )
+        + "</iati-activities>",
+    )
+    communicator = WebsocketCommunicator(consumers.IatiActivitiesConsumer, "/")
+    connected, _ = await communicator.connect()
+    assert connected
+
+    await communicator.send_to(text_data="not json")
+    assert (await communicator.receive_json_from())["event"] == "error"
+
+    await communicator.send_json_to({"url": url, "window": "wide"})
+    error = await communicator.receive_json_from()
+    assert error == {
+        "event": "error",
+        "error": 'Expected "window" to be a whole number',
+    }
+
+    # A window of 0 would wait for an acknowledgement before the first chunk
+    await communicator.send_json_to({"url": url, "chunk_size": 2, "window": 0})
+    assert await communicator.receive_json_from() == {"event": "file", "url": url}
+    identifiers = []
+    for seq in (1, 2, 3):
+        chunk = await communicator.receive_json_from()
+        assert (chunk["event"], chunk["seq"], chunk["url"]) == ("activities", seq, url)
+        identifiers.extend(a["iati-identifier"] for a in chunk["activities"])
+        if seq < 3:
+            assert await communicator.receive_nothing(timeout=0.1)
+        await communicator.send_json_to({"ack": seq})
+    assert identifiers == [f"ST-{i}" for i in range(5)]
+    done = await communicator.receive_json_from()
+    assert done == {"event": "done", "activities": 5, "seq": 3}
+
+    await communicator.disconnect()
+    request.drop_sync()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_only_known_files_are_streamed(settings):
+    """
+    Nothing is fetched for a URL or publisher which is not known already
+    """
+    settings.CHANNEL_LAYERS = IN_MEMORY_LAYERS
+    communicator = WebsocketCommunicator(consumers.IatiActivitiesConsumer, "/")
+    connected, _ = await communicator.connect()
+    assert connected
+
+    with mock.patch.object(requesters.BaseRequest, "get") as get:
+        await communicator.send_json_to({"url": UNREACHABLE_URL})
+        error = await communicator.receive_json_from()
+        assert (error["event"], error["url"]) == ("error", UNREACHABLE_URL)
+        await communicator.send_json_to({"publisher": "unknown"})
+        error = await communicator.receive_json_from()
+        assert (error["event"], error["error"]) == ("error", "Publisher not found")
+    get.assert_not_called()
+    await communicator.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_stream_failure_is_reported(settings):
+    settings.CHANNEL_LAYERS = IN_MEMORY_LAYERS
+    url = "http://example.com/stream-failure.xml"
+    request = requesters.IatiXMLRequest(url=url)
+    await requesters.AsyncCache.set(request.rhash, "<iati-activities/>")
+    communicator = WebsocketCommunicator(consumers.IatiActivitiesConsumer, "/")
+    connected, _ = await communicator.connect()
+    assert connected
+
+    with mock.patch.object(
+        consumers.IatiActivitiesConsumer,
+        "stream_file",
+        side_effect=RuntimeError("broken"),
+    ):
+        await communicator.send_json_to({"url": url})
+        error = await communicator.receive_json_from()
+    assert error == {"event": "error", "error": "RuntimeError('broken')"}
+    # And another may be asked for
+    await communicator.send_json_to({"url": url})
+    assert await communicator.receive_json_from() == {"event": "file", "url": url}
+    assert (await communicator.receive_json_from())["event"] == "done"
+    await communicator.disconnect()
+    request.drop_sync()
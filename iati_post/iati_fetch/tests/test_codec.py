@@ -0,0 +1,28 @@
+from django.test import TestCase
+
+from iati_fetch import codec
+from iati_fetch.models import Activity, Organisation, OrganisationAbbreviation
+
+
+class CodecTestCase(TestCase):
+    def test_round_trip(self):
+        value = {"a": [1, 2.5, None, True, "é"], "b": {"c": "d"}}
+        self.assertEqual(codec.loads(codec.dumps(value)), value)
+        self.assertEqual(codec.loads(codec.dumps(value).encode()), value)
+        self.assertEqual(codec.dumps({"a": 1}), '{"a":1}')
+
+    def test_unsupported_values_fall_back(self):
+        self.assertEqual(codec.dumps({1: 2 ** 70}), '{"1":%s}' % 2 ** 70)
+
+    def test_jsonfield(self):
+        field = Organisation._meta.get_field("element")
+        # Compact, as the stdlib json.dumps default is not
+        self.assertEqual(field.get_prep_value({"a": 1}).dumps({"a": 1}), '{"a":1}')
+        self.assertIsNone(field.get_prep_value(None))
+
+        OrganisationAbbreviation.objects.create(pk="xm")
+        element = {"organisation-identifier": "XM-1", "name": {"narrative": ["é"]}}
+        Organisation.objects.create(pk="XM-1", abbreviation_id="xm", element=element)
+        self.assertEqual(Organisation.objects.get().element, element)
+        self.assertTrue(Organisation.objects.filter(element__contains=element).exists())
+        self.assertFalse(Activity.objects.filter(element__contains={"a": 1}).exists())
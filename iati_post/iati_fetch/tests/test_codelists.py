@@ -0,0 +1,107 @@
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase
+
+from iati_fetch.codelists import CodelistRegistry
+from iati_fetch.models import Codelist, CodelistItem
+
+
+def codelist_element(name="Sector", items=None):
+    """
+    A codelist XML file as parsed by XMLRequest.to_json
+    """
+    if items is None:
+        items = [
+            {"code": "11110", "name": {"narrative": ["Education policy"]}},
+            {
+                "@status": "withdrawn",
+                "code": "11120",
+                "name": {"narrative": [{"@xml:lang": "en", "#text": "Facilities"}]},
+            },
+        ]
+    return {
+        "codelist": {
+            "@name": name,
+            "@complete": "1",
+            "metadata": {"name": {"narrative": [name]}},
+            "codelist-items": {"codelist-item": items},
+        }
+    }
+
+
+class CodelistRegistryTestCase(TransactionTestCase):
+    """
+    Transactional, since the registry is told of changes on commit
+    """
+
+    def setUp(self):
+        Codelist.from_dict(codelist_element())
+        self.registry = CodelistRegistry()
+
+    def test_lookup(self):
+        self.assertEqual(self.registry.name("Sector", "11110"), "Education policy")
+        self.assertEqual(self.registry.name("Sector", "11120"), "Facilities")
+        self.assertTrue(self.registry.withdrawn("Sector", "11120"))
+        self.assertFalse(self.registry.withdrawn("Sector", "11110"))
+        self.assertEqual(self.registry.name("Sector", "99999", "?"), "?")
+        self.assertEqual(self.registry.get("Country"), {})
+
+    def test_loaded_once(self):
+        with self.assertNumQueries(1):
+            for _ in range(10):
+                self.registry.name("Sector", "11110")
+
+    def test_reloaded_after_codelist_refresh(self):
+        self.registry.name("Sector", "11110")
+        self.registry.check_interval = 0
+        Codelist.from_dict(
+            codelist_element(
+                "Country", [{"code": "TL", "name": {"narrative": ["Timor-Leste"]}}]
+            )
+        )
+        self.assertEqual(self.registry.name("Country", "TL"), "Timor-Leste")
+
+    def test_item_name(self):
+        item = CodelistItem.objects.by_name("Sector").get(code="11120")
+        self.assertEqual(item.name, "Facilities")
+
+    def test_template_filter(self):
+        rendered = Template(
+            '{% load iati_codelists %}{{ code|codelist_name:"Sector" }}'
+        ).render(Context({"code": "11110"}))
+        self.assertEqual(rendered, "Education policy")
+
+
+class CodelistSyncTestCase(TestCase):
+    def test_refresh_is_idempotent(self):
+        self.assertTrue(Codelist.from_dict(codelist_element()))
+        with self.assertNumQueries(3):
+            self.assertFalse(Codelist.from_dict(codelist_element()))
+        self.assertEqual(Codelist.objects.count(), 1)
+        self.assertEqual(CodelistItem.objects.count(), 2)
+
+    def test_items_diffed_by_code(self):
+        Codelist.from_dict(codelist_element())
+        Codelist.from_dict(
+            codelist_element(
+                items=[
+                    {"code": "11110", "name": {"narrative": ["Education"]}},
+                    {"code": "11130", "name": {"narrative": ["Teacher training"]}},
+                ]
+            )
+        )
+        items = {
+            item.code: (item.name, item.withdrawn)
+            for item in CodelistItem.objects.by_name("Sector")
+        }
+        self.assertEqual(
+            items,
+            {
+                "11110": ("Education", False),
+                "11120": ("Facilities", True),
+                "11130": ("Teacher training", False),
+            },
+        )
+        self.assertEqual(
+            list(CodelistItem.objects.withdrawn().values_list("code", flat=True)),
+            ["11120"],
+        )
@@ -0,0 +1,175 @@
+import asyncio
+import datetime
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from iati_fetch import coordinator, requesters
+from iati_fetch.models import Activity, IngestShard, OrganisationAbbreviation
+
+IN_MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def xml_request(url, handle):
+    return requesters.IatiXMLRequest(url=url, organisation_handle=handle)
+
+
+class ShardTestCase(SimpleTestCase):
+    requests = [
+        xml_request("http://a.example.com/1.xml", "one"),
+        xml_request("http://A.example.com/2.xml", "two"),
+        xml_request("http://a.example.com/3.xml", "one"),
+        xml_request("http://b.example.com/1.xml", "one"),
+    ]
+
+    def test_by_host(self):
+        shards = coordinator.shard(self.requests, by="host", size=2)
+        self.assertEqual(list(shards), ["a.example.com", "b.example.com"])
+        self.assertEqual([len(s) for s in shards["a.example.com"]], [2, 1])
+        self.assertEqual([len(s) for s in shards["b.example.com"]], [1])
+
+    def test_by_publisher(self):
+        shards = coordinator.shard(self.requests, by="publisher", size=20)
+        self.assertEqual(
+            {k: len(s[0]) for k, s in shards.items()}, {"one": 3, "two": 1}
+        )
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            coordinator.shard(self.requests, by="country")
+
+
+class IngestShardTestCase(TestCase):
+    def setUp(self):
+        self.run = coordinator.create_run(
+            coordinator.shard(ShardTestCase.requests, by="host", size=2), "host"
+        )
+        self.a, self.b, self.c = self.run.shards.order_by("pk")
+
+    def test_created(self):
+        self.assertEqual(
+            self.a.requests,
+            [
+                ["http://a.example.com/1.xml", "one"],
+                ["http://A.example.com/2.xml", "two"],
+            ],
+        )
+        self.assertEqual(self.run.progress()["queued"], 3)
+        self.assertFalse(self.run.done)
+
+    def test_claimed_once(self):
+        shard = IngestShard.claim(self.a.pk, "worker-1")
+        self.assertEqual(shard.worker, "worker-1")
+        self.assertIsNone(IngestShard.claim(self.a.pk, "worker-2"))
+        self.assertTrue(shard.beat())
+        self.assertTrue(shard.finish())
+        self.assertFalse(shard.beat())
+        self.assertEqual(
+            self.run.progress(), dict(queued=2, running=0, done=1, failed=0)
+        )
+
+    def test_claim_next(self):
+        claimed = [IngestShard.claim_next(self.run.pk, "w") for _ in range(4)]
+        self.assertEqual(
+            [shard and shard.pk for shard in claimed],
+            [self.a.pk, self.b.pk, self.c.pk, None],
+        )
+        self.assertEqual(self.run.progress()["running"], 3)
+
+    def test_stale_shards_reassigned(self):
+        shard = IngestShard.claim(self.a.pk, "worker-1")
+        IngestShard.claim(self.b.pk, "worker-2")
+        past = timezone.now() - datetime.timedelta(seconds=60)
+        IngestShard.objects.filter(pk__in=[self.a.pk, self.c.pk]).update(heartbeat=past)
+
+        # A queued shard waits for a worker, and uses up no attempts
+        reassigned = self.run.reassign_stale(timeout=30, retries=1)
+        self.assertEqual(reassigned, [self.a.pk])
+        self.assertEqual(IngestShard.objects.get(pk=self.c.pk).attempts, 0)
+        # The worker which was not heard from has lost its shard
+        self.assertFalse(shard.beat())
+        self.assertEqual(IngestShard.claim(self.a.pk, "worker-3").worker, "worker-3")
+
+        # Out of retries
+        IngestShard.objects.filter(pk=self.a.pk).update(heartbeat=past)
+        self.assertEqual(self.run.reassign_stale(timeout=30, retries=1), [])
+        self.assertEqual(IngestShard.objects.get(pk=self.a.pk).status, "failed")
+
+    @override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+    @async_to_sync
+    async def test_dispatch(self):
+        # One message for each worker wanted, not for each shard
+        await coordinator.Coordinator(channel="iati-test", workers=2).dispatch(
+            self.run.pk, 3
+        )
+        channel_layer = get_channel_layer()
+        for _ in range(2):
+            message = await channel_layer.receive("iati-test")
+            self.assertEqual(message, {"type": "ingest.shards", "run": self.run.pk})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(channel_layer.receive("iati-test"), 0.1)
+
+
+class ProcessShardTestCase(TransactionTestCase):
+    """
+    Transactional, since a worker writes from database threads
+    """
+
+    xml = (
+        "<iati-activities><iati-activity><iati-identifier>SH-{}</iati-identifier>"
+        "</iati-activity></iati-activities>"
+    )
+
+    def setUp(self):
+        OrganisationAbbreviation.objects.create(abbreviation="sh")
+        self.requests = [
+            xml_request(f"http://example.com/shard-{i}.xml", "sh") for i in range(2)
+        ]
+        for i, request in enumerate(self.requests):
+            async_to_sync(requesters.AsyncCache.set)(request.rhash, self.xml.format(i))
+        self.run = coordinator.create_run({"sh": [self.requests]}, "publisher")
+        self.shard = self.run.shards.get()
+
+    def tearDown(self):
+        for request in self.requests:
+            request.drop_sync()
+
+    def test_process(self):
+        processed = async_to_sync(coordinator.process_shard)(self.shard.pk, "w")
+        self.assertTrue(processed)
+        self.assertEqual(
+            set(Activity.objects.values_list("pk", flat=True)), {"SH-0", "SH-1"}
+        )
+        self.assertTrue(self.run.done)
+        self.assertEqual(coordinator.finish_run(self.run)["done"], 1)
+        self.assertIsNotNone(OrganisationAbbreviation.objects.get().last_ingested)
+
+        # Another worker given the same shard leaves it alone
+        self.assertFalse(async_to_sync(coordinator.process_shard)(self.shard.pk, "x"))
+
+    def test_process_run(self):
+        self.assertEqual(async_to_sync(coordinator.process_run)(self.run.pk, "w"), 1)
+        self.assertEqual(
+            set(Activity.objects.values_list("pk", flat=True)), {"SH-0", "SH-1"}
+        )
+        self.assertEqual(async_to_sync(coordinator.process_run)(self.run.pk, "w"), 0)
+
+    def test_missing_file(self):
+        self.requests[1].drop_sync()
+        IngestShard.objects.filter(pk=self.shard.pk).update(
+            requests=[[r.url, "sh"] for r in self.requests]
+            + [["http://127.0.0.1:1/shard-missing.xml", "sh"]]
+        )
+        async_to_sync(coordinator.process_shard)(self.shard.pk, "w")
+        self.assertEqual(coordinator.finish_run(self.run)["failed"], 1)
+        # To be ingested again
+        self.assertEqual(OrganisationAbbreviation.pending(), ["sh"])
+
+    def test_file_which_is_not_xml(self):
+        # Fetched, so ingested as publisher_ingest would have it
+        async_to_sync(requesters.AsyncCache.set)(self.requests[1].rhash, "not xml")
+        self.assertTrue(async_to_sync(coordinator.process_shard)(self.shard.pk, "w"))
+        self.assertEqual(coordinator.finish_run(self.run)["done"], 1)
+        self.assertEqual(OrganisationAbbreviation.pending(), [])
@@ -0,0 +1,237 @@
+import threading
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.db import DatabaseError
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from iati_fetch import consumers, requesters, tasks
+from iati_fetch.models import (
+    Activity,
+    Organisation,
+    OrganisationAbbreviation,
+    SourceIngest,
+)
+
+IN_MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+ACTIVITIES_XML = (
+    "<iati-activities>"
+    + "".join(
+        f"<iati-activity><iati-identifier>PT-1-{i}</iati-identifier>"
+        '<reporting-org ref="PT-1"/></iati-activity>'
+        for i in range(3)
+    )
+    + "</iati-activities>"
+)
+ORGANISATIONS_XML = (
+    "<iati-organisations><iati-organisation>"
+    "<organisation-identifier>PT-1</organisation-identifier>"
+    "</iati-organisation></iati-organisations>"
+)
+
+
+class PublisherIngestTestCase(TransactionTestCase):
+    """
+    Transactional, since files are written from database threads
+    """
+
+    files = {
+        "http://example.com/pt-org.xml": ORGANISATIONS_XML,
+        "http://example.com/pt-activities.xml": ACTIVITIES_XML,
+        "http://127.0.0.1:1/pt-missing.xml": None,
+    }
+
+    def setUp(self):
+        self.requests = [requesters.OrganisationRequestDetail(organisation_handle="pt")]
+        search = {
+            "result": {
+                "results": [
+                    {
+                        "resources": [
+                            {"format": "IATI-XML", "url": url} for url in self.files
+                        ]
+                    }
+                ]
+            }
+        }
+        async_to_sync(requesters.AsyncCache.set)(self.requests[0].rhash, search)
+        for url, text in self.files.items():
+            request = requesters.IatiXMLRequest(url=url)
+            self.requests.append(request)
+            if text is not None:
+                async_to_sync(requesters.AsyncCache.set)(request.rhash, text)
+
+    def tearDown(self):
+        for request in self.requests:
+            request.drop_sync()
+
+    def test_progress(self):
+        events = []
+
+        async def progress(event, **data):
+            events.append((event, data))
+
+        totals = async_to_sync(tasks.publisher_ingest)("pt", progress=progress)
+        self.assertEqual(
+            totals,
+            dict(
+                files=3,
+                bytes=len(ACTIVITIES_XML) + len(ORGANISATIONS_XML),
+                activities=3,
+                organisations=1,
+                errors=1,
+            ),
+        )
+        self.assertEqual(
+            [event for event, _ in events],
+            ["files", "downloaded", "written", "downloaded", "written", "error"],
+        )
+        self.assertEqual(events[0][1], {"urls": list(self.files)})
+        self.assertEqual(
+            events[4][1],
+            {"url": "http://example.com/pt-activities.xml", "activities": 3},
+        )
+
+    def test_incremental(self):
+        publishers = requesters.OrganisationRequestList()
+        self.requests.append(publishers)
+        async_to_sync(requesters.AsyncCache.set)(
+            publishers.rhash, {"result": ["pt", "other"]}
+        )
+        OrganisationAbbreviation.objects.create(
+            abbreviation="other", last_ingested=timezone.now()
+        )
+        xml_requests = async_to_sync(tasks.xml_requests_get)(incremental=True)
+        self.assertEqual({r.url for r in xml_requests}, set(self.files))
+
+        # Until all of its files are written, "pt" is still to be ingested
+        self.assertEqual(async_to_sync(tasks.publisher_ingest)("pt")["errors"], 1)
+        xml_requests = async_to_sync(tasks.xml_requests_get)(incremental=True)
+        self.assertEqual({r.url for r in xml_requests}, set(self.files))
+
+        missing = requesters.IatiXMLRequest(url="http://127.0.0.1:1/pt-missing.xml")
+        async_to_sync(requesters.AsyncCache.set)(missing.rhash, "<iati-activities/>")
+        self.assertEqual(async_to_sync(tasks.publisher_ingest)("pt")["errors"], 0)
+        self.assertEqual(async_to_sync(tasks.xml_requests_get)(incremental=True), [])
+
+    def test_unchanged_file_is_skipped(self):
+        url = "http://example.com/pt-activities.xml"
+        request = requesters.IatiXMLRequest(url=url, organisation_handle="pt")
+        async_to_sync(request.to_instances)()
+        activity = Activity.objects.get(pk="PT-1-0")
+        self.assertEqual(
+            (activity.publisher, activity.source_hash), ("pt", request.source_hash)
+        )
+
+        request = requesters.IatiXMLRequest(url=url, organisation_handle="pt")
+        self.assertEqual(async_to_sync(request.to_instances)(), ("iati-activities", []))
+        self.assertEqual(request.parse_count, 0)
+
+        # Changed: one activity fewer
+        async_to_sync(requesters.AsyncCache.set)(
+            request.rhash, ACTIVITIES_XML.replace("PT-1-2", "PT-1-0")
+        )
+        root, written = async_to_sync(request.to_instances)()
+        self.assertEqual(written, ["PT-1-0", "PT-1-1"])
+        self.assertEqual(
+            set(Activity.objects.from_publisher("pt").values_list("pk", flat=True)),
+            {"PT-1-0", "PT-1-1"},
+        )
+
+    def test_parsed_off_the_loop(self):
+        request = requesters.IatiXMLRequest(
+            url="http://example.com/pt-activities.xml", organisation_handle="pt"
+        )
+        threads = {}
+
+        def recorded(name, function):
+            def wrapper(*args, **kwargs):
+                threads[name] = threading.get_ident()
+                return function(*args, **kwargs)
+
+            return wrapper
+
+        async def ingest():
+            threads["loop"] = threading.get_ident()
+            return await request.to_instances()
+
+        with mock.patch.object(
+            requesters, "text_digest", recorded("digest", requesters.text_digest)
+        ), mock.patch.object(request, "parse", recorded("parse", request.parse)):
+            self.assertEqual(len(async_to_sync(ingest)()[1]), 3)
+        self.assertNotIn(threads["loop"], (threads["digest"], threads["parse"]))
+
+    def test_changed_organisation_is_updated(self):
+        url = "http://example.com/pt-org.xml"
+        request = requesters.IatiXMLRequest(url=url, organisation_handle="pt")
+        self.assertEqual(async_to_sync(request.to_instances)()[1], ["PT-1"])
+
+        async_to_sync(requesters.AsyncCache.set)(
+            request.rhash,
+            ORGANISATIONS_XML.replace(
+                "</organisation-identifier>", "</organisation-identifier><name/>"
+            ),
+        )
+        self.assertEqual(async_to_sync(request.to_instances)()[1], ["PT-1"])
+        self.assertIn("name", Organisation.objects.get(pk="PT-1").element)
+
+    def test_partly_written_file_is_written_again(self):
+        url = "http://example.com/pt-activities.xml"
+        request = requesters.IatiXMLRequest(url=url, organisation_handle="pt")
+        # Stopped after its activities were written
+        with mock.patch.object(
+            SourceIngest, "record", side_effect=DatabaseError("stopped")
+        ):
+            with self.assertRaises(DatabaseError):
+                async_to_sync(request.to_instances)()
+        self.assertEqual(Activity.objects.from_source(request.source_hash).count(), 3)
+        self.assertFalse(SourceIngest.objects.exists())
+
+        request = requesters.IatiXMLRequest(url=url, organisation_handle="pt")
+        root, written = async_to_sync(request.to_instances)()
+        self.assertEqual(len(written), 3)
+        self.assertEqual(
+            SourceIngest.objects.get().file_digest,
+            requesters.text_digest(ACTIVITIES_XML),
+        )
+
+    @override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+    @async_to_sync
+    async def test_websocket(self):
+        communicator = WebsocketCommunicator(consumers.IngestConsumer, "/ingest/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await communicator.send_json_to({"action": "ingest", "publisher": "pt"})
+        events = []
+        while not events or events[-1]["event"] != "done":
+            events.append(await communicator.receive_json_from())
+        self.assertEqual(events[-1]["activities"], 3)
+
+        await communicator.send_json_to(
+            {"action": "results", "publisher": "pt", "limit": 2}
+        )
+        page = await communicator.receive_json_from()
+        self.assertEqual(
+            [a["identifier"] for a in page["activities"]], ["PT-1-0", "PT-1-1"]
+        )
+        self.assertEqual(page["next"], "PT-1-1")
+        await communicator.send_json_to(
+            {"action": "results", "publisher": "pt", "after": page["next"]}
+        )
+        page = await communicator.receive_json_from()
+        self.assertEqual([a["identifier"] for a in page["activities"]], ["PT-1-2"])
+        self.assertIsNone(page["next"])
+        # A limit which is not a number is the default
+        await communicator.send_json_to(
+            {"action": "results", "publisher": "pt", "limit": "all"}
+        )
+        page = await communicator.receive_json_from()
+        self.assertEqual(len(page["activities"]), 3)
+
+        await communicator.send_json_to({"action": "unknown", "publisher": "pt"})
+        self.assertEqual((await communicator.receive_json_from())["event"], "error")
+        await communicator.disconnect()
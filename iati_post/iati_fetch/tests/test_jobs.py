@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from iati_fetch import jobs
+from iati_fetch.models import Job
+
+
+class JobQueueTests:
+    """
+    The same behaviour from the database queue and its local stand-in
+    """
+
+    def expire(self, job):
+        raise NotImplementedError
+
+    def test_priority(self):
+        bulk = self.queue.enqueue("fetch", {"url": "http://example.com/1"})
+        interactive = self.queue.enqueue(
+            "fetch", {"url": "http://example.com/2"}, jobs.PRIORITY_INTERACTIVE
+        )
+        claimed = self.queue.claim("w", limit=1)
+        self.assertEqual([j.pk for j in claimed], [interactive.pk])
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual([j.pk for j in self.queue.claim("w", limit=5)], [bulk.pk])
+        self.assertEqual(self.queue.claim("w"), [])
+
+    def test_retried_then_dead(self):
+        self.queue.enqueue("fetch", {}, max_attempts=2)
+        job = self.queue.claim("w")[0]
+        self.assertTrue(self.queue.fail(job, "Oops"))
+        self.assertEqual(job.status, Job.QUEUED)
+        # Not until the retry delay has passed
+        self.assertEqual(self.queue.claim("w"), [])
+        self.expire(job)
+
+        job = self.queue.claim("w")[0]
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(self.queue.fail(job, "Oops again"))
+        self.assertEqual(job.status, Job.DEAD)
+        self.expire(job)
+        self.assertEqual(self.queue.claim("w"), [])
+
+    def test_lease_expires(self):
+        self.queue.enqueue("fetch", {})
+        job = self.queue.claim("w1")[0]
+        self.assertTrue(self.queue.touch(job))
+        self.expire(job)
+        again = self.queue.claim("w2")[0]
+        self.assertEqual((again.worker, again.attempts), ("w2", 2))
+
+        # The first worker no longer holds the job
+        self.assertFalse(self.queue.complete(job))
+        self.assertTrue(self.queue.complete(again))
+        self.assertEqual(self.queue.claim("w3"), [])
+
+    def test_dedupe(self):
+        first = self.queue.enqueue("refresh", {}, dedupe_key="refresh:ask")
+        self.assertEqual(
+            self.queue.enqueue("refresh", {}, dedupe_key="refresh:ask").pk, first.pk
+        )
+        other = self.queue.enqueue("refresh", {}, dedupe_key="refresh:dfid")
+        self.assertNotEqual(other.pk, first.pk)
+
+        # Still running: not queued again
+        job = self.queue.claim("w", limit=1)[0]
+        self.assertEqual(
+            self.queue.enqueue("refresh", {}, dedupe_key="refresh:ask").pk, job.pk
+        )
+        # Once done it may be
+        self.queue.complete(job)
+        again = self.queue.enqueue("refresh", {}, dedupe_key="refresh:ask")
+        self.assertNotIn(again.pk, (first.pk, other.pk))
+
+    def test_dedupe_raises_priority(self):
+        crawl = self.queue.enqueue("refresh", {}, dedupe_key="refresh:ask")
+        self.queue.enqueue("refresh", {"n": 1}, priority=10)
+        # Asked for again by a user: ahead of the rest of the crawl
+        asked = self.queue.enqueue(
+            "refresh", {}, jobs.PRIORITY_INTERACTIVE, dedupe_key="refresh:ask"
+        )
+        self.assertEqual(asked.pk, crawl.pk)
+        self.assertEqual(asked.priority, jobs.PRIORITY_INTERACTIVE)
+        # Never lowered
+        self.queue.enqueue("refresh", {}, dedupe_key="refresh:ask")
+        job = self.queue.claim("w", limit=1)[0]
+        self.assertEqual((job.pk, job.priority), (crawl.pk, jobs.PRIORITY_INTERACTIVE))
+
+    def test_enqueue_many(self):
+        queued = self.queue.enqueue("refresh", {"n": 0}, dedupe_key="refresh:0")
+        self.queue.enqueue_many(
+            "refresh",
+            [{"n": n} for n in range(3)],
+            dedupe_keys=[f"refresh:{n}" for n in range(3)],
+        )
+        claimed = self.queue.claim("w", limit=5)
+        self.assertEqual(sorted(job.payload["n"] for job in claimed), [0, 1, 2])
+        self.assertIn(queued.pk, [job.pk for job in claimed])
+
+
+class LocalJobQueueTestCase(JobQueueTests, SimpleTestCase):
+    def setUp(self):
+        self.queue = jobs.LocalJobQueue()
+
+    def expire(self, job):
+        self.queue.jobs[job.pk].available_at = timezone.now()
+
+    def test_drain(self):
+        ran = []
+
+        async def handler(payload, session):
+            ran.append(payload["n"])
+            if payload["n"] == 2:
+                raise jobs.JobError("Two")
+
+        for n in range(3):
+            self.queue.enqueue("test", {"n": n}, priority=n)
+        self.queue.enqueue("unknown", {})
+
+        with mock.patch.dict(jobs.HANDLERS, test=handler):
+            ran_count = async_to_sync(jobs.drain)("w", self.queue, batch=2)
+        self.assertEqual(ran_count, 4)
+        self.assertEqual(ran, [2, 1, 0])
+        statuses = [job.status for job in self.queue.jobs.values()]
+        self.assertEqual(statuses, [Job.DONE, Job.DONE, Job.QUEUED, Job.DEAD])
+
+    def test_long_job_keeps_its_lease(self):
+        claimed_meanwhile = []
+
+        async def handler(payload, session):
+            await asyncio.sleep(0.5)
+            claimed_meanwhile.extend(self.queue.claim("w2"))
+
+        self.queue.enqueue("test", {})
+        with mock.patch.dict(jobs.HANDLERS, test=handler):
+            async_to_sync(jobs.drain)("w1", self.queue, timeout=0.3)
+        self.assertEqual(claimed_meanwhile, [])
+        self.assertEqual(self.queue.jobs[1].status, Job.DONE)
+
+
+class DatabaseJobQueueTestCase(JobQueueTests, TestCase):
+    def setUp(self):
+        self.queue = jobs.DatabaseJobQueue()
+
+    def expire(self, job):
+        Job.objects.filter(pk=job.pk).update(
+            available_at=timezone.now() - datetime.timedelta(seconds=1)
+        )
+
+    def test_enqueue(self):
+        job = jobs.enqueue("parse", {"url": "http://example.com/a.xml"})
+        self.assertEqual(Job.objects.get().pk, job.pk)
+        with self.assertRaises(AssertionError):
+            jobs.enqueue("unknown", {})
@@ -0,0 +1,439 @@
+import datetime
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.db import DatabaseError, connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from iati_fetch.models import (
+    Activity,
+    ActivityNarrative,
+    Organisation,
+    OrganisationAbbreviation,
+    Provenance,
+    PublisherChanges,
+    SourceIngest,
+    Summary,
+    Transaction,
+)
+from iati_fetch.records import ActivityRecord
+from iati_fetch.search import search_vector
+
+
+def organisation_element(identifier="XM-DAC-1", name="An organisation"):
+    return {
+        "organisation-identifier": identifier,
+        "name": {"narrative": [name]},
+        "reporting-org": {"@ref": identifier},
+    }
+
+
+def activity_element(identifier="XM-DAC-1-PROJ", country="TL"):
+    return {
+        "@default-currency": "USD",
+        "iati-identifier": identifier,
+        "reporting-org": {"@ref": "XM-DAC-1", "narrative": ["An organisation"]},
+        "title": {"narrative": [{"@xml:lang": "en", "#text": "Clean water"}]},
+        "description": {
+            "narrative": [
+                {"@xml:lang": "EN", "#text": "Drilling wells in rural villages"},
+                {"@xml:lang": "fr", "#text": "Forage de puits dans les villages"},
+            ]
+        },
+        "activity-status": {"@code": "2"},
+        "activity-date": [
+            {"@type": "1", "@iso-date": "2019-01-01"},
+            {"@type": "2", "@iso-date": "2019-02-01T00:00:00"},
+            {"@type": "3", "@iso-date": "not a date"},
+        ],
+        "recipient-country": {"@code": country, "@percentage": "100"},
+        "sector": [
+            {"@code": "14030", "@vocabulary": "1"},
+            {"@code": "140", "@vocabulary": "2"},
+            {"@code": "15110"},
+        ],
+        "transaction": [
+            {
+                "transaction-type": {"@code": "3"},
+                "transaction-date": {"@iso-date": "2019-03-01"},
+                "value": {"@value-date": "2019-03-01", "#text": "1000.50"},
+                "provider-org": {"@ref": "XM-DAC-1"},
+            },
+            {
+                "transaction-type": {"@code": "2"},
+                "value": {
+                    "@value-date": "2018-12-01",
+                    "@currency": "EUR",
+                    "#text": "5000",
+                },
+                "receiver-org": {"@ref": "XM-DAC-2"},
+            },
+        ],
+    }
+
+
+class OrganisationFromXmlTestCase(TestCase):
+    def test_create(self):
+        with self.assertNumQueries(4):
+            written = Organisation.from_xml([organisation_element()], abbr="xm")
+        self.assertEqual(written, ["XM-DAC-1"])
+        organisation = Organisation.objects.get(pk="XM-DAC-1")
+        self.assertEqual(organisation.abbreviation_id, "xm")
+        self.assertEqual(organisation.element["reporting-org"]["@ref"], "XM-DAC-1")
+
+    def test_skip_existing_without_update(self):
+        Organisation.from_xml(organisation_element(name="Old"), abbr="xm")
+        written = Organisation.from_xml(organisation_element(name="New"), abbr="xm")
+        self.assertEqual(written, [])
+        organisation = Organisation.objects.get(pk="XM-DAC-1")
+        self.assertEqual(organisation.element["name"]["narrative"], ["Old"])
+
+    def test_update_lands(self):
+        Organisation.from_xml(organisation_element(name="Old"), abbr="xm")
+        Organisation.from_xml(organisation_element(name="New"), abbr="xm", update=True)
+        organisation = Organisation.objects.get(pk="XM-DAC-1")
+        self.assertEqual(organisation.element["name"]["narrative"], ["New"])
+
+    def test_changed_identifier_replaces_organisation(self):
+        Organisation.from_xml(organisation_element("XM-DAC-1"), abbr="xm")
+        Organisation.from_xml(organisation_element("XM-DAC-2"), abbr="xm", update=True)
+        self.assertEqual(
+            list(Organisation.objects.values_list("pk", flat=True)), ["XM-DAC-2"]
+        )
+
+    def test_invalid_elements_are_skipped(self):
+        written = Organisation.from_xml([{"name": "no identifier"}], abbr="xm")
+        self.assertEqual(written, [])
+        self.assertFalse(OrganisationAbbreviation.objects.exists())
+
+
+class PublisherSyncTestCase(TestCase):
+    def test_sync(self):
+        OrganisationAbbreviation.objects.create(abbreviation="kept")
+        OrganisationAbbreviation.objects.create(abbreviation="gone")
+        OrganisationAbbreviation.objects.create(
+            abbreviation="back", withdrawn=True, last_ingested=timezone.now()
+        )
+        OrganisationAbbreviation.objects.create(abbreviation="away", withdrawn=True)
+
+        changes = OrganisationAbbreviation.sync(["kept", "back", "new", "new"])
+        self.assertEqual(
+            changes,
+            PublisherChanges(added=["new"], withdrawn=["gone"], restored=["back"]),
+        )
+        self.assertEqual(
+            dict(OrganisationAbbreviation.objects.values_list("pk", "withdrawn")),
+            {"kept": False, "back": False, "new": False, "gone": True, "away": True},
+        )
+        self.assertEqual(
+            OrganisationAbbreviation.sync(["kept", "back", "new"]),
+            PublisherChanges(added=[], withdrawn=[], restored=[]),
+        )
+        # Restored publishers are ingested again
+        self.assertEqual(OrganisationAbbreviation.pending(), ["back", "kept", "new"])
+
+
+class ActivityFromXmlTestCase(TestCase):
+    def test_hot_fields(self):
+        Activity.from_xml([activity_element()])
+        activity = Activity.objects.get(pk="XM-DAC-1-PROJ")
+        self.assertEqual(activity.reporting_org_ref, "XM-DAC-1")
+        self.assertEqual(activity.activity_status, "2")
+        self.assertEqual(activity.default_currency, "USD")
+        self.assertEqual(activity.sector_codes, ["14030", "15110"])
+        self.assertEqual(activity.recipient_countries, ["TL"])
+        self.assertEqual(activity.start_planned, datetime.date(2019, 1, 1))
+        self.assertEqual(activity.start_actual, datetime.date(2019, 2, 1))
+        self.assertIsNone(activity.end_planned)
+
+    def test_filter_on_hot_fields(self):
+        Activity.from_xml(
+            [activity_element("A-1", "TL"), activity_element("A-2", "ID")]
+        )
+        self.assertEqual(
+            list(Activity.objects.in_country("tl").values_list("pk", flat=True)),
+            ["A-1"],
+        )
+        self.assertEqual(Activity.objects.reported_by("XM-DAC-1").count(), 2)
+        self.assertEqual(Activity.objects.in_sector("14030").count(), 2)
+
+    def test_transaction_columns(self):
+        Activity.from_xml([activity_element()])
+        disbursement = Transaction.objects.disbursements().get()
+        self.assertEqual(disbursement.value, Decimal("1000.50"))
+        self.assertEqual(disbursement.currency, "USD")
+        self.assertEqual(disbursement.value_date, datetime.date(2019, 3, 1))
+        self.assertEqual(disbursement.provider_org_ref, "XM-DAC-1")
+        commitment = Transaction.objects.commitments().get()
+        self.assertEqual(commitment.currency, "EUR")
+        self.assertEqual(commitment.receiver_org_ref, "XM-DAC-2")
+
+    def test_fixed_statements_per_batch(self):
+        queries = []
+        for count in (2, 20):
+            elements = [activity_element(f"A-{count}-{i}") for i in range(count)]
+            with CaptureQueriesContext(connection) as captured:
+                written = Activity.from_xml(elements)
+            self.assertEqual(len(written), count)
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+
+        Activity.objects.exclude(pk__startswith="A-20-").delete()
+        self.assertEqual(Transaction.objects.count(), 40)
+        self.assertEqual(ActivityNarrative.objects.count(), 20 * 4)
+
+    def test_invalid_elements_are_skipped(self):
+        written = Activity.from_xml(
+            [{"title": "no identifier"}, [activity_element()], "text"]
+        )
+        self.assertEqual(written, ["XM-DAC-1-PROJ"])
+
+    def test_no_update(self):
+        Activity.from_xml([activity_element("A-1", "TL")])
+        written = Activity.from_xml([activity_element("A-1", "ID")], update=False)
+        self.assertEqual(written, [])
+        self.assertEqual(Activity.objects.get().recipient_countries, ["TL"])
+
+    def test_records(self):
+        record = ActivityRecord.from_element(activity_element())
+        self.assertEqual(record.identifier, "XM-DAC-1-PROJ")
+        self.assertEqual(record.fields["recipient_countries"], ["TL"])
+        self.assertEqual(
+            [(t.transaction_type, t.value) for t in record.transactions],
+            [("3", Decimal("1000.50")), ("2", Decimal("5000"))],
+        )
+        self.assertEqual(
+            [(n.path, n.lang) for n in record.narratives][:2],
+            [("[reporting-org][narrative]", "en"), ("[title][narrative]", "en")],
+        )
+        self.assertNotIn("narrative", json.loads(record.element)["title"])
+        self.assertFalse(hasattr(record, "__dict__"))
+
+        Activity.write_records([record])
+        activity = Activity.objects.get()
+        self.assertEqual(activity.element["iati-identifier"], "XM-DAC-1-PROJ")
+        self.assertNotIn("transaction", activity.element)
+
+    def test_transaction_totals(self):
+        Activity.from_xml([activity_element("A-1"), activity_element("A-2")])
+        totals = Transaction.objects.disbursements().totals("year", "currency")
+        self.assertEqual(
+            list(totals),
+            [
+                {
+                    "year": 2019,
+                    "currency": "USD",
+                    "total": Decimal("2001.00"),
+                    "count": 2,
+                }
+            ],
+        )
+
+
+class SummaryTestCase(TestCase):
+    def test_refreshed_on_ingest(self):
+        Activity.from_xml([activity_element("A-1", "TL"), activity_element("A-2")])
+        summary = Summary.objects.lookup("reporting-org", "XM-DAC-1")
+        self.assertEqual(summary.activity_count, 2)
+        self.assertEqual(
+            [
+                (t.year, t.currency, t.commitments, t.disbursements)
+                for t in summary.totals.all()
+            ],
+            [
+                (2018, "EUR", Decimal("10000.00"), Decimal("0.00")),
+                (2019, "USD", Decimal("0.00"), Decimal("2001.00")),
+            ],
+        )
+        country = Summary.objects.lookup("recipient-country", "TL")
+        self.assertEqual(country.activity_count, 2)
+
+    def test_moved_activity_leaves_old_key(self):
+        Activity.from_xml([activity_element("A-1", "TL")])
+        Activity.from_xml([activity_element("A-1", "ID")])
+        self.assertIsNone(Summary.objects.lookup("recipient-country", "TL"))
+        self.assertEqual(
+            Summary.objects.lookup("recipient-country", "ID").activity_count, 1
+        )
+
+    def test_refresh_error_does_not_hide_write_error(self):
+        with mock.patch.object(
+            Activity, "_write_batch", side_effect=ValueError("write")
+        ), mock.patch.object(
+            type(Summary.objects), "refresh", side_effect=DatabaseError("refresh")
+        ):
+            with self.assertRaisesMessage(ValueError, "write"):
+                Activity.from_xml([activity_element("A-1", "TL")])
+
+    def test_rebuild(self):
+        Activity.from_xml([activity_element("A-1", "TL")])
+        Summary.objects.all().delete()
+        Summary.objects.rebuild()
+        self.assertEqual(
+            set(Summary.objects.values_list("dimension", "key")),
+            {("reporting-org", "XM-DAC-1"), ("recipient-country", "TL")},
+        )
+
+
+class BulkDeleteTestCase(TestCase):
+    def test_delete_published(self):
+        Organisation.from_xml([organisation_element()], abbr="xm")
+        Organisation.from_xml([organisation_element("XM-DAC-2")], abbr="other")
+        Activity.from_xml([activity_element(f"A-{i}") for i in range(5)])
+        other = activity_element("B-1", country="ID")
+        other["reporting-org"]["@ref"] = "XM-DAC-2"
+        Activity.from_xml([other])
+        for source_hash, publisher in (("file-1", "xm"), ("file-2", "other")):
+            SourceIngest.objects.create(
+                source_hash=source_hash,
+                publisher=publisher,
+                file_digest="a",
+                completed_at=datetime.datetime(
+                    2020, 1, 1, tzinfo=datetime.timezone.utc
+                ),
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            deleted = Organisation.delete_published(["xm"])
+        self.assertEqual(
+            deleted,
+            {
+                "iati_fetch.Transaction": 10,
+                "iati_fetch.Budget": 0,
+                "iati_fetch.Result": 0,
+                "iati_fetch.DocumentLink": 0,
+                "iati_fetch.ActivityNarrative": 20,
+                "iati_fetch.Activity": 5,
+                "iati_fetch.Organisation": 1,
+            },
+        )
+        # No transactions or narratives are read to delete them
+        reads = [q["sql"] for q in queries if q["sql"].startswith("SELECT")]
+        self.assertFalse([sql for sql in reads if "narrative" in sql])
+        self.assertEqual(list(Activity.objects.values_list("pk", flat=True)), ["B-1"])
+        # Files of the publisher are written again in full
+        self.assertEqual(
+            list(SourceIngest.objects.values_list("pk", flat=True)), ["file-2"]
+        )
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertIsNone(Summary.objects.lookup("reporting-org", "XM-DAC-1"))
+        self.assertIsNone(Summary.objects.lookup("recipient-country", "TL"))
+        self.assertEqual(
+            Summary.objects.lookup("reporting-org", "XM-DAC-2").activity_count, 1
+        )
+
+    def test_batches(self):
+        Activity.from_xml([activity_element(f"A-{i}") for i in range(5)])
+        deleted = Activity.objects.exclude(pk="A-2").bulk_delete(batch_size=2)
+        self.assertEqual(deleted["iati_fetch.Activity"], 4)
+        self.assertEqual(list(Activity.objects.values_list("pk", flat=True)), ["A-2"])
+        self.assertEqual(
+            Summary.objects.lookup("reporting-org", "XM-DAC-1").activity_count, 1
+        )
+
+
+class ProvenanceTestCase(TestCase):
+    def test_replace_source(self):
+        first = Provenance(publisher="xm", source_hash="file-1", file_digest="a")
+        changes = Activity.replace_source(
+            [activity_element("A-1"), activity_element("A-2")], first
+        )
+        self.assertEqual((changes.added, changes.updated), (["A-1", "A-2"], []))
+        self.assertEqual(
+            list(
+                Activity.objects.from_publisher("xm")
+                .order_by("identifier")
+                .values_list("identifier", "source_hash", "file_digest", "ingested_at")
+            ),
+            [
+                ("A-1", "file-1", "a", first.ingested_at),
+                ("A-2", "file-1", "a", first.ingested_at),
+            ],
+        )
+        Activity.from_xml([activity_element("B-1")])
+
+        second = Provenance(publisher="xm", source_hash="file-1", file_digest="b")
+        changes = Activity.replace_source(
+            [activity_element("A-2"), activity_element("A-3")], second
+        )
+        self.assertEqual(
+            (changes.added, changes.updated, changes.removed),
+            (["A-3"], ["A-2"], ["A-1"]),
+        )
+        self.assertEqual(
+            set(Activity.objects.values_list("pk", flat=True)), {"A-2", "A-3", "B-1"}
+        )
+        self.assertFalse(Transaction.objects.filter(activity_id="A-1").exists())
+        self.assertEqual(
+            set(Activity.objects.from_source("file-1").values_list("pk", flat=True)),
+            {"A-2", "A-3"},
+        )
+
+        # Written without provenance: kept as it was
+        Activity.from_xml([activity_element("A-2")])
+        self.assertEqual(Activity.objects.get(pk="A-2").file_digest, "b")
+
+    def test_concurrent_writes_are_recorded(self):
+        provenance = Provenance(publisher="xm", source_hash="file-1", file_digest="b")
+        from_xml = Activity.from_xml
+
+        def write_alongside(*args, **kwargs):
+            # Another worker finishes the same file meanwhile
+            other = Provenance(publisher="xm", source_hash="file-1", file_digest="a")
+            SourceIngest.record(other)
+            return from_xml(*args, **kwargs)
+
+        with mock.patch.object(Activity, "from_xml", side_effect=write_alongside):
+            Activity.replace_source([activity_element("A-1")], provenance)
+        self.assertEqual(SourceIngest.objects.get().file_digest, "b")
+
+
+class ActivityNarrativeSearchTestCase(TestCase):
+    def test_search(self):
+        Activity.from_xml([activity_element("A-1"), activity_element("A-2")])
+        other = activity_element("A-3")
+        other["title"]["narrative"] = ["Roads"]
+        other["description"]["narrative"] = ["Building roads"]
+        Activity.from_xml([other])
+
+        # Stemmed: "drilled" matches "Drilling", "well" matches "wells"
+        results = ActivityNarrative.objects.search("drilled well", langs=["en"])
+        self.assertEqual([iid for iid, _ in results], ["A-1", "A-2"])
+        self.assertEqual(
+            [iid for iid, _ in ActivityNarrative.objects.search("road")], ["A-3"]
+        )
+        self.assertEqual(
+            [iid for iid, _ in ActivityNarrative.objects.search("puits", ["fr"])],
+            ["A-1", "A-2"],
+        )
+        self.assertEqual(ActivityNarrative.objects.search("puits", ["en"]), [])
+
+    def test_reingest_replaces_narratives(self):
+        Activity.from_xml([activity_element("A-1")])
+        Activity.from_xml([activity_element("A-1")])
+        self.assertEqual(
+            ActivityNarrative.objects.filter(
+                activity_id="A-1", path="[title][narrative]"
+            ).count(),
+            1,
+        )
+        self.assertEqual(
+            set(ActivityNarrative.objects.values_list("lang", flat=True)), {"en", "fr"}
+        )
+
+    def test_indexed_as_inserted(self):
+        with CaptureQueriesContext(connection) as queries:
+            Activity.from_xml([activity_element("A-1")])
+        # Not updated afterwards
+        narrative_sql = [
+            q["sql"] for q in queries if "iati_fetch_activitynarrative" in q["sql"]
+        ]
+        self.assertFalse([sql for sql in narrative_sql if sql.startswith("UPDATE")])
+        # As the expression used to index narratives written before
+        narratives = ActivityNarrative.objects.annotate(expected=search_vector())
+        self.assertTrue(narratives.exists())
+        for search, expected in narratives.values_list("search", "expected"):
+            self.assertEqual(search, expected)
@@ -0,0 +1,113 @@
+import os
+import random
+
+from django.test import SimpleTestCase
+
+from iati_fetch.elements import iati_root
+from iati_fetch.management.synthetic import synthetic_activities_xml
+from iati_fetch.parsers import PARSE_ERRORS, parse_lxml, parse_xmltodict
+from iati_fetch.requesters import XMLRequest
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+# Sample files which declare an encoding other than UTF-8
+ENCODINGS = {"activities-105.xml": "latin-1"}
+
+
+def sample_files():
+    return sorted(f for f in os.listdir(DATA_DIR) if f.endswith(".xml"))
+
+
+def read_sample(filename, mode="rb"):
+    with open(os.path.join(DATA_DIR, filename), mode) as f:
+        return f.read()
+
+
+class ParserConformanceTestCase(SimpleTestCase):
+    """
+    The lxml backend returns exactly what xmltodict does
+    """
+
+    def assertConforms(self, document):
+        self.assertEqual(parse_lxml(document), parse_xmltodict(document))
+
+    def test_sample_files(self):
+        self.assertTrue(sample_files())
+        for filename in sample_files():
+            with self.subTest(filename=filename):
+                self.assertConforms(read_sample(filename))
+
+    def test_sample_files_as_text(self):
+        for filename in sample_files():
+            with self.subTest(filename=filename):
+                text = read_sample(filename).decode(ENCODINGS.get(filename, "utf-8"))
+                self.assertConforms(text)
+
+    def test_synthetic_files(self):
+        self.assertConforms(synthetic_activities_xml(100, random.Random(0)))
+
+    def test_shapes(self):
+        documents = [
+            "<a/>",
+            "<a>  </a>",
+            '<a b="1"/>',
+            '<a b="1"> text </a>',
+            "<a><b/><b>1</b><c>2</c></a>",
+            "<a>x<!-- comment -->y<b/>z<c/> </a>",
+            '<a xmlns="http://d" xmlns:q="http://q" q:b="1"><q:c>1</q:c></a>',
+            "<a><narrative>one</narrative><transaction/></a>",
+            "<iati-activity><x>1</x></iati-activity>",
+            "<a>&lt;&amp;<![CDATA[<b>]]></a>",
+        ]
+        for document in documents:
+            with self.subTest(document=document):
+                self.assertConforms(document)
+
+    def test_force_list(self):
+        document = read_sample("activities-203.xml")
+        self.assertEqual(
+            parse_lxml(document, force_list={"sector"}),
+            parse_xmltodict(document, force_list={"sector"}),
+        )
+        parsed = parse_lxml(document)
+        second = parsed["iati-activities"]["iati-activity"][1]
+        self.assertEqual(second["title"]["narrative"][0]["@xml:lang"], "es")
+
+    def test_children(self):
+        def children(name, value):
+            seen.append(name)
+            return (name, value)
+
+        documents = [read_sample(filename) for filename in sample_files()] + [
+            '<a b="1">x<c d="2">1</c><c/><e>3</e></a>'
+        ]
+        for document in documents:
+            with self.subTest(document=document[:40]):
+                seen = []
+                by_lxml = parse_lxml(document, children=children)
+                from_lxml, seen = seen, []
+                self.assertEqual(parse_xmltodict(document, children=children), by_lxml)
+                # Once for each child of the root, and nothing else
+                self.assertEqual(seen, from_lxml)
+        self.assertEqual(seen, ["c", "c", "e"])
+        self.assertEqual(by_lxml["a"]["c"][0], ("c", {"@d": "2", "#text": "1"}))
+
+    def test_invalid(self):
+        for document in ["", "<a>", "not xml", None]:
+            for parse in (parse_lxml, parse_xmltodict):
+                with self.subTest(document=document, parse=parse):
+                    with self.assertRaises(PARSE_ERRORS):
+                        parse(document)
+
+
+class XMLRequestParserTestCase(SimpleTestCase):
+    def test_selectable(self):
+        document = read_sample("organisations.xml")
+        by_lxml = XMLRequest(url="http://example.com/o.xml", parser="lxml")
+        by_xmltodict = XMLRequest(url="http://example.com/o.xml")
+        self.assertEqual(by_lxml.rhash, by_xmltodict.rhash)
+        self.assertEqual(by_lxml.parse(document), by_xmltodict.parse(document))
+        root, elements = iati_root(by_lxml.parse(document))
+        self.assertEqual(root, "iati-organisations")
+        self.assertEqual(elements[0]["organisation-identifier"], "XM-DAC-1")
+        self.assertEqual(by_lxml.parse("<a>"), {})
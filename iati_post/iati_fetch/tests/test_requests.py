@@ -2,9 +2,10 @@ import asyncio
 
 from aiohttp import ClientSession, TCPConnector
 from asgiref.sync import async_to_sync
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
 from iati_fetch import requesters, tasks
+from iati_fetch.models import Activity, Organisation
 
 # Create your tests here.
 
@@ -97,3 +98,97 @@ class RequestsTestCase(TestCase):
         and items
         """
         await requesters.IatiCodelistListRequest().to_instances()
+
+
+class BoundedFetchTestCase(TestCase):
+    @async_to_sync
+    async def test_fetch_all_is_bounded(self):
+        """
+        fetch_all never has more than `limit` requests in flight
+        """
+        in_flight = []
+        most = []
+
+        class SlowRequest(requesters.BaseRequest):
+            async def get(self, session=None, **kwargs):
+                in_flight.append(self)
+                most.append(len(in_flight))
+                await asyncio.sleep(0.01)
+                in_flight.remove(self)
+
+        requests = [SlowRequest(url=f"http://example.com/{i}") for i in range(20)]
+        async with requesters.new_session() as session:
+            await requesters.fetch_all(requests, session=session, limit=3)
+        self.assertEqual(len(most), 20)
+        self.assertEqual(max(most), 3)
+
+
+class XMLParseCacheTestCase(TransactionTestCase):
+    """
+    Transactional, since files are written from database threads
+    """
+
+    xml = (
+        "<iati-activities><iati-activity><iati-identifier>XM-1</iati-identifier>"
+        "</iati-activity><iati-activity><iati-identifier>XM-2</iati-identifier>"
+        "</iati-activity></iati-activities>"
+    )
+
+    def setUp(self):
+        self.request = requesters.IatiXMLRequest(url="http://example.com/a.xml")
+        self.request.drop_sync()
+        async_to_sync(requesters.AsyncCache.set)(self.request.rhash, self.xml)
+
+    def tearDown(self):
+        self.request.drop_sync()
+
+    def test_parsed_once(self):
+        activities = async_to_sync(self.request.activities)()
+        organisations = async_to_sync(self.request.organisations)()
+        self.assertEqual([a["iati-identifier"] for a in activities], ["XM-1", "XM-2"])
+        self.assertEqual(organisations, [])
+        self.assertEqual(self.request.parse_count, 1)
+
+    def test_forget(self):
+        async_to_sync(self.request.activities)()
+        self.request.forget()
+        async_to_sync(self.request.activities)()
+        self.assertEqual(self.request.parse_count, 2)
+
+    def test_matches_precompiled(self):
+        matched = async_to_sync(self.request.matches)(
+            "[iati-activities][iati-activity]"
+        )
+        self.assertEqual(len(matched[0]), 2)
+        self.assertIs(
+            requesters.compile_path("[iati-activities]"),
+            requesters.compile_path("[iati-activities]"),
+        )
+
+    def test_single_pass_routing(self):
+        request = requesters.IatiXMLRequest(
+            url="http://example.com/org.xml", organisation_handle="xm"
+        )
+        async_to_sync(requesters.AsyncCache.set)(
+            request.rhash,
+            "<iati-organisations><iati-organisation>"
+            "<organisation-identifier>XM-DAC-1</organisation-identifier>"
+            "</iati-organisation></iati-organisations>",
+        )
+        try:
+            root, elements = async_to_sync(request.elements)()
+            self.assertEqual(root, "iati-organisations")
+            self.assertEqual(len(elements), 1)
+            async_to_sync(request.to_instances)()
+        finally:
+            request.drop_sync()
+        self.assertEqual(request.parse_count, 1)
+        self.assertTrue(Organisation.objects.filter(pk="XM-DAC-1").exists())
+
+        async_to_sync(self.request.to_instances)(activities=False)
+        self.assertEqual(self.request.parse_count, 1)
+        self.assertFalse(Activity.objects.exists())
+        async_to_sync(self.request.to_instances)()
+        self.assertEqual(
+            set(Activity.objects.values_list("pk", flat=True)), {"XM-1", "XM-2"}
+        )
@@ -0,0 +1,315 @@
+import json
+import os
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from iati_fetch import jobs, requesters
+from iati_fetch.codelists import registry
+from iati_fetch.models import (
+    Activity,
+    Job,
+    Organisation,
+    OrganisationAbbreviation,
+    Transaction,
+)
+from iati_fetch.pagination import MAX_PAGE_SIZE, keyset_page, page_size
+from iati_fetch.parsers import parse_lxml
+
+
+class KeysetListTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(5):
+            abbreviation = OrganisationAbbreviation.objects.create(
+                abbreviation=f"pub-{i}"
+            )
+            Organisation.objects.create(
+                id=f"XM-{i}", abbreviation=abbreviation, element={"big": "x" * 100}
+            )
+        for i in range(7):
+            Activity.objects.create(
+                identifier=f"XM-{i % 2}-{i}",
+                element={"big": "x" * 100},
+                reporting_org_ref=f"XM-{i % 2}",
+                activity_status="2" if i < 3 else "3",
+                recipient_countries=["TL"] if i % 3 == 0 else ["ID"],
+            )
+
+    def test_keyset_page(self):
+        page = keyset_page(Activity.objects.values("identifier"), "identifier", limit=3)
+        self.assertEqual(
+            [a["identifier"] for a in page.items], ["XM-0-0", "XM-0-2", "XM-0-4"]
+        )
+        self.assertEqual(page.next, "XM-0-4")
+        page = keyset_page(Activity.objects.all(), "identifier", after="XM-1-3")
+        self.assertEqual([a.identifier for a in page.items], ["XM-1-5"])
+        self.assertIsNone(page.next)
+        self.assertEqual(page_size("100000"), MAX_PAGE_SIZE)
+        self.assertEqual(page_size("nonsense", default=7), 7)
+
+    def test_organisations_json(self):
+        url = reverse("iati-fetch:orgs-json")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"limit": 2})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("element", queries[0]["sql"])
+        self.assertEqual(
+            response.json(),
+            {
+                "results": [
+                    {"id": "XM-0", "abbreviation_id": "pub-0"},
+                    {"id": "XM-1", "abbreviation_id": "pub-1"},
+                ],
+                "next": "XM-1",
+            },
+        )
+        response = self.client.get(url, {"limit": 2, "after": "XM-3"})
+        self.assertEqual(
+            response.json()["results"], [{"id": "XM-4", "abbreviation_id": "pub-4"}]
+        )
+        response = self.client.get(url, {"publisher": "pub-2"})
+        self.assertEqual([o["id"] for o in response.json()["results"]], ["XM-2"])
+
+    def test_activities_json_filters(self):
+        url = reverse("iati-fetch:activities-json")
+
+        def identifiers(**params):
+            response = self.client.get(url, params)
+            return [a["identifier"] for a in response.json()["results"]]
+
+        self.assertEqual(
+            identifiers(reporting_org="XM-1"), ["XM-1-1", "XM-1-3", "XM-1-5"]
+        )
+        self.assertEqual(identifiers(status="2"), ["XM-0-0", "XM-0-2", "XM-1-1"])
+        self.assertEqual(identifiers(country="tl"), ["XM-0-0", "XM-0-6", "XM-1-3"])
+        self.assertEqual(identifiers(publisher="pub-1"), ["XM-1-1", "XM-1-3", "XM-1-5"])
+        self.assertEqual(identifiers(status="3", limit="1", after="XM-0-4"), ["XM-0-6"])
+
+    def test_list_pages(self):
+        # Status names are read through the process-wide codelists
+        self.addCleanup(registry.invalidate)
+        response = self.client.get(
+            reverse("iati-fetch:activities"), {"limit": 3, "status": "3"}
+        )
+        self.assertContains(response, "XM-0-4")
+        self.assertContains(response, 'href="?limit=3&amp;status=3&amp;after=XM-1-3"')
+        response = self.client.get(reverse("iati-fetch:orgs"))
+        self.assertContains(response, "XM-4")
+        self.assertNotContains(response, "Next")
+
+
+class ExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        abbreviation = OrganisationAbbreviation.objects.create(abbreviation="xm")
+        Organisation.objects.create(id="XM-1", abbreviation=abbreviation)
+        for i in range(3):
+            Activity.objects.create(
+                identifier=f"XM-1-{i}",
+                element={"title": f"Activity {i}"},
+                reporting_org_ref="XM-1",
+            )
+        Activity.objects.create(identifier="XM-2-0", reporting_org_ref="XM-2")
+        Transaction.objects.create(
+            activity_id="XM-1-1", element={"value": "10"}, ref="T-1"
+        )
+
+    def setUp(self):
+        self.files = {
+            "http://example.com/xm-1.xml": '<?xml version="1.0"?>\n<iati-activities/>',
+            "http://example.com/xm-2.xml": "<iati-organisations/>",
+        }
+        detail = requesters.OrganisationRequestDetail(organisation_handle="xm")
+        self.rhashes = [detail.rhash]
+        cache.set(
+            detail.rhash,
+            {
+                "result": {
+                    "results": [
+                        {
+                            "resources": [
+                                {"format": "IATI-XML", "url": url} for url in self.files
+                            ]
+                        }
+                    ]
+                }
+            },
+        )
+        for url, text in self.files.items():
+            request = requesters.IatiXMLRequest(url=url)
+            self.rhashes.append(request.rhash)
+            cache.set(request.rhash, text)
+
+    def tearDown(self):
+        for rhash in self.rhashes:
+            cache.delete(rhash)
+            cache.delete(("digest",) + rhash)
+
+    def test_json(self):
+        url = reverse("iati-fetch:org-fetch-json", args=["XM-1"])
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        documents = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [d["identifier"] for d in documents], ["XM-1-0", "XM-1-1", "XM-1-2"]
+        )
+        self.assertEqual(documents[0]["element"], {"title": "Activity 0"})
+        self.assertEqual(documents[1]["transactions"], [{"value": "10", "@ref": "T-1"}])
+
+        etag = response["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Written again: without its transaction
+        Activity.from_xml(
+            [{"iati-identifier": "XM-1-1", "reporting-org": {"@ref": "XM-1"}}]
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        url = reverse("iati-fetch:org-fetch-json", args=["XM-3"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_xml(self):
+        url = reverse("iati-fetch:org-fetch-xml", args=["XM-1"])
+        response = self.client.get(url)
+        self.assertEqual(
+            b"".join(response.streaming_content).decode(),
+            '<?xml version="1.0" encoding="UTF-8"?>\n<iati-files>\n'
+            "\n<iati-activities/>\n<iati-organisations/>\n</iati-files>\n",
+        )
+        etag = response["ETag"]
+        # Each file's digest is kept, not read again for the next ETag
+        request = requesters.IatiXMLRequest(url="http://example.com/xm-2.xml")
+        self.assertEqual(
+            cache.get(request.digest_key),
+            requesters.text_digest(self.files[request.url]),
+        )
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        response = self.client.get(url, {"url": "http://example.com/xm-1.xml"})
+        self.assertEqual(
+            b"".join(response.streaming_content).decode(),
+            self.files["http://example.com/xm-1.xml"],
+        )
+        self.assertNotEqual(response["ETag"], etag)
+        response = self.client.get(url, {"url": "http://example.com/other.xml"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_xml_encoding(self):
+        # Declared as latin-1; cached, and sent, as text
+        path = os.path.join(os.path.dirname(__file__), "data", "activities-105.xml")
+        with open(path, encoding="latin-1") as f:
+            text = f.read()
+        request = requesters.IatiXMLRequest(url="http://example.com/xm-1.xml")
+        cache.set(request.rhash, text)
+        url = reverse("iati-fetch:org-fetch-xml", args=["XM-1"])
+
+        for params in ({"url": request.url}, {}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                content = b"".join(response.streaming_content)
+                self.assertNotIn(b"ISO-8859-1", content)
+                self.assertIn("é".encode("utf-8"), content)
+                # Read as the UTF-8 which it now declares
+                document = parse_lxml(content)
+                if params:
+                    self.assertEqual(document, parse_lxml(text.encode("latin-1")))
+                else:
+                    self.assertIn("iati-activities", document["iati-files"])
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+)
+class RefreshTestCase(TestCase):
+    def test_refresh(self):
+        for handle in ("ask", "dfid"):
+            OrganisationAbbreviation.objects.create(abbreviation=handle)
+        OrganisationAbbreviation.objects.create(abbreviation="gone", withdrawn=True)
+        url = reverse("iati-fetch:org-fetch")
+
+        response = self.client.post(url, {"publisher": ["ask"]})
+        self.assertEqual(response.status_code, 202)
+        (job,) = response.json()["jobs"]
+        self.assertEqual(
+            (job["kind"], job["payload"], job["status"]),
+            ("refresh", {"organisation_handle": "ask"}, "queued"),
+        )
+
+        # All publishers: for staff only, as one job
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.client.force_login(User.objects.create(username="staff", is_staff=True))
+        response = self.client.post(url)
+        (fan_out,) = response.json()["jobs"]
+        self.assertEqual(fan_out["kind"], "refresh_all")
+        self.assertEqual(Job.objects.count(), 2)
+
+        # Which queues the others; the refresh of "ask" is the one already queued
+        jobs.queue_publisher_refreshes()
+        refreshes = Job.objects.filter(kind="refresh")
+        self.assertEqual(
+            sorted(refreshes.values_list("payload__organisation_handle", flat=True)),
+            ["ask", "dfid"],
+        )
+        self.assertEqual(
+            refreshes.get(payload__organisation_handle="ask").pk, job["id"]
+        )
+
+        Job.objects.filter(pk=job["id"]).update(status=Job.DEAD, error="Oops")
+        status = self.client.get(job["url"]).json()
+        self.assertEqual((status["status"], status["error"]), ("dead", "Oops"))
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+
+class DeleteTestCase(TransactionTestCase):
+    def test_delete(self):
+        for i in range(2):
+            abbreviation = OrganisationAbbreviation.objects.create(
+                abbreviation=f"pub-{i}"
+            )
+            Organisation.objects.create(id=f"XM-{i}", abbreviation=abbreviation)
+            Activity.objects.create(identifier=f"XM-{i}-0", reporting_org_ref=f"XM-{i}")
+        url = reverse("iati-fetch:org-delete")
+
+        # For staff only
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.post(url, {"publisher": "pub-0"}).status_code, 403)
+        self.assertNotContains(
+            self.client.get(reverse("iati-fetch:orgs")), "Delete all"
+        )
+        self.assertEqual(Activity.objects.count(), 2)
+
+        self.client.force_login(User.objects.create(username="staff", is_staff=True))
+        self.assertContains(self.client.get(reverse("iati-fetch:orgs")), "Delete all")
+        response = self.client.get(url, {"publisher": "pub-0"})
+        self.assertContains(response, "1 organisations and 1 activities")
+        self.assertEqual(Activity.objects.count(), 2)
+
+        response = self.client.post(url, {"publisher": "pub-0"})
+        self.assertContains(response, "<td>iati_fetch.Activity</td><td>1</td>")
+        self.assertEqual(
+            list(Organisation.objects.values_list("pk", flat=True)), ["XM-1"]
+        )
+        # The publisher is still listed
+        self.assertTrue(OrganisationAbbreviation.objects.filter(pk="pub-0").exists())
+
+        # Every publisher: queued as one job
+        self.assertContains(self.client.get(url), "Delete all publishers")
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(Activity.objects.exists())
+        job = Job.objects.get(kind="delete_all")
+        self.assertContains(response, f"job {job.pk}", status_code=202)
+        self.assertEqual(self.client.post(url).status_code, 202)
+        self.assertEqual(Job.objects.filter(kind="delete_all").count(), 1)
+
+        async_to_sync(jobs.delete_all)(job.payload, None)
+        self.assertFalse(Activity.objects.exists())
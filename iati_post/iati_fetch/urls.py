@@ -7,8 +7,11 @@ app_name = "iati-fetch"
 urlpatterns = [
     path("", views.FrontPage.as_view(), name="index"),
     path("orgs", views.Organisations.as_view(), name="orgs"),
-    # This will be a websocket one day
+    path("orgs.json", views.OrganisationsJson.as_view(), name="orgs-json"),
+    path("activities", views.Activities.as_view(), name="activities"),
+    path("activities.json", views.ActivitiesJson.as_view(), name="activities-json"),
     path("org_fetch", views.OrganisationRefresh.as_view(), name="org-fetch"),
+    path("jobs/<int:job_id>", views.JobStatus.as_view(), name="job-status"),
     path("org_delete", views.OrganisationDelete.as_view(), name="org-delete"),
     path(
         "org_fetch_xml/<str:organisation_id>",
@@ -1,20 +1,125 @@
+import hashlib
+import logging
+import re
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+from asgiref.sync import async_to_sync
 from django.apps import apps
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core.cache import cache
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views.generic import TemplateView, View
 
-# Create your views here.
+from iati_fetch import jobs, requesters
+from iati_fetch.pagination import Page, keyset_page, page_size
+
+logger = logging.getLogger(__name__)
 
 
 class FrontPage(TemplateView):
     template_name = "iati_fetch/home.html"
 
 
-class Organisations(TemplateView):
+class KeysetListMixin:
+    """
+    A list of some `fields` of a model, in pages ordered by `key`: the query
+    parameters "after" (a key) and "limit" choose a page, and those named in
+    `filters` narrow the list. Filter only on indexed columns.
+    """
+
+    model_name: str
+    key: str
+    fields: Tuple[str, ...]
+    # Each query parameter's filter, a function of a queryset and the value
+    filters: Dict[str, Callable] = {}
+
+    def get_queryset(self):
+        queryset = apps.get_model("iati_fetch", self.model_name).objects.all()
+        for param, narrow in self.filters.items():
+            value = self.request.GET.get(param)
+            if value:
+                queryset = narrow(queryset, value)
+        # Only the displayed columns: never "element"
+        return queryset.values(*self.fields)
+
+    def get_page(self) -> Page:
+        return keyset_page(
+            self.get_queryset(),
+            self.key,
+            after=self.request.GET.get("after") or None,
+            limit=page_size(self.request.GET.get("limit")),
+        )
+
+    def next_query(self, page: Page) -> Union[str, None]:
+        """
+        The query string for the page after `page`, with the same filters
+        """
+        if page.next is None:
+            return None
+        query = self.request.GET.copy()
+        query["after"] = page.next
+        return query.urlencode()
+
+
+class KeysetJsonMixin(KeysetListMixin):
+    def get(self, request):
+        page = self.get_page()
+        return JsonResponse({"results": page.items, "next": page.next})
+
+
+class OrganisationList(KeysetListMixin):
+    model_name = "Organisation"
+    key = "id"
+    fields = ("id", "abbreviation_id")
+    filters = {"publisher": lambda qs, value: qs.filter(abbreviation_id=value)}
+
+
+class ActivityList(KeysetListMixin):
+    model_name = "Activity"
+    key = "identifier"
+    fields = (
+        "identifier",
+        "reporting_org_ref",
+        "activity_status",
+        "start_actual",
+        "end_actual",
+    )
+    filters = {
+        "publisher": lambda qs, value: qs.published_by(value),
+        "reporting_org": lambda qs, value: qs.reported_by(value),
+        "status": lambda qs, value: qs.filter(activity_status=value),
+        "country": lambda qs, value: qs.in_country(value),
+        "sector": lambda qs, value: qs.in_sector(value),
+    }
+
+
+class Organisations(OrganisationList, TemplateView):
     template_name = "iati_fetch/organisation_list.html"
 
-    def get_context_data(self):
-        return {
-            "organisations": apps.get_model("iati_fetch", "Organisation").objects.all()
-        }
+    def get_context_data(self, **kwargs):
+        page = self.get_page()
+        return {"organisations": page.items, "next_query": self.next_query(page)}
+
+
+class OrganisationsJson(KeysetJsonMixin, OrganisationList, View):
+    pass
+
+
+class Activities(ActivityList, TemplateView):
+    template_name = "iati_fetch/activity_list.html"
+
+    def get_context_data(self, **kwargs):
+        page = self.get_page()
+        return {"activities": page.items, "next_query": self.next_query(page)}
+
+
+class ActivitiesJson(KeysetJsonMixin, ActivityList, View):
+    pass
 
 
 class OrganisationDetail(TemplateView):
@@ -24,24 +129,212 @@ class OrganisationDetail(TemplateView):
         org = apps.get_model("iati_fetch", "Organisation").objects.get(
             pk=organisation_id
         )
-        return {"org": org}
+        summary = apps.get_model("iati_fetch", "Summary").objects.lookup(
+            "reporting-org", org.pk
+        )
+        return {"org": org, "summary": summary}
+
+
+def streaming_export(
+    request, etag: str, chunks: Iterable[str], content_type: str
+) -> HttpResponseBase:
+    """
+    Stream `chunks`, or "304 Not Modified" if the client has the export with
+    this `etag` (a digest of its content) already
+    """
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+    response["ETag"] = etag
+    return response
 
 
 class OrganisationFetchXml(View):
+    """
+    The organisation's source XML files, as they were cached when fetched:
+    the one with the "url" query parameter, or else all of them within one
+    <iati-files> element. Each file is read from the cache as its turn comes.
+    """
+
+    chunk_size = 64 * 1024
+    declaration = re.compile(r"^\s*<\?xml[^>]*\?>")
+    encoding = re.compile(r"""encoding\s*=\s*(["'])[^"']*\1""")
+
     def get(self, request, organisation_id):
-        raise NotImplementedError
+        org = get_object_or_404(
+            apps.get_model("iati_fetch", "Organisation"), pk=organisation_id
+        )
+        detail = requesters.OrganisationRequestDetail(
+            organisation_handle=org.abbreviation_id
+        )
+        files = async_to_sync(detail.cached_xml_requests)()
+        url = request.GET.get("url")
+        if url:
+            files = [f for f in files if f.url == url]
+        if not files:
+            raise Http404("No source files of this organisation are cached")
+
+        # The digest of each file is kept in the cache beside it
+        digest = hashlib.md5()
+        for f, file_digest in zip(files, async_to_sync(self.digests)(files)):
+            digest.update(f"{f.url}\n{file_digest}\n".encode())
+        return streaming_export(
+            request,
+            digest.hexdigest(),
+            self.stream(files, wrap=not url),
+            "application/xml; charset=utf-8",
+        )
+
+    @staticmethod
+    async def digests(files: List[requesters.IatiXMLRequest]) -> List[str]:
+        return [await f.digest() for f in files]
+
+    def stream(self, files: List[requesters.IatiXMLRequest], wrap: bool):
+        if wrap:
+            yield '<?xml version="1.0" encoding="UTF-8"?>\n<iati-files>\n'
+        for f in files:
+            text = cache.get(f.rhash) or ""
+            # Files are cached as text, and sent as UTF-8 whatever they
+            # declared: the declaration goes, or says so
+            start = 0
+            declaration = self.declaration.match(text)
+            if declaration:
+                start = declaration.end()
+                if not wrap:
+                    yield self.encoding.sub(
+                        'encoding="UTF-8"', declaration.group(), count=1
+                    )
+            for start in range(start, len(text), self.chunk_size):
+                end = start + self.chunk_size
+                yield text[start:end]
+            del text
+            if wrap:
+                yield "\n"
+        if wrap:
+            yield "</iati-files>\n"
 
 
 class OrganisationFetchJson(View):
+    """
+    The activities reported by the organisation as newline-delimited JSON,
+    one document (see `ActivityQuerySet.documents`) per line, in identifier
+    order; read through a server-side cursor, `chunk_size` rows at a time.
+    The ETag is from `ActivityQuerySet.version`, not the documents.
+    """
+
+    chunk_size = 500
+
     def get(self, request, organisation_id):
-        raise NotImplementedError
+        get_object_or_404(
+            apps.get_model("iati_fetch", "Organisation"), pk=organisation_id
+        )
+        activities = apps.get_model("iati_fetch", "Activity").objects.reported_by(
+            organisation_id
+        )
+        documents = activities.documents().iterator(chunk_size=self.chunk_size)
+        return streaming_export(
+            request,
+            hashlib.md5(activities.version().encode()).hexdigest(),
+            (f"{document}\n" for document in documents),
+            "application/x-ndjson",
+        )
+
+
+def job_status(job) -> dict:
+    return {
+        "id": job.pk,
+        "kind": job.kind,
+        "payload": job.payload,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error,
+        "created": job.created,
+        "finished": job.finished,
+        "url": reverse("iati-fetch:job-status", args=[job.pk]),
+    }
+
+
+def notify_workers() -> None:
+    try:
+        async_to_sync(jobs.notify)()
+    except Exception:
+        # Workers which are not listening find the jobs when they poll
+        logger.warning("Could not notify job workers", exc_info=True)
 
 
 class OrganisationRefresh(View):
-    def get(self, request):
-        raise NotImplementedError
+    """
+    Queue a refresh of each publisher named by a "publisher" parameter, and
+    answer at once with the jobs; see `JobStatus` to follow them. A publisher
+    whose refresh is queued or running already is not queued again.
 
+    With no publishers, staff may queue a refresh of every publisher: one job,
+    which queues the others when a worker runs it.
+    """
 
-class OrganisationDelete(TemplateView):
-    def get(self, request):
-        raise NotImplementedError
+    def post(self, request):
+        handles = request.POST.getlist("publisher")
+        if handles:
+            # Asked for by name: ahead of the crawl of everything
+            queued = [
+                jobs.enqueue_refresh(handle, jobs.PRIORITY_INTERACTIVE)
+                for handle in handles
+            ]
+        elif request.user.is_staff:
+            queued = [jobs.enqueue_refresh_all()]
+        else:
+            return JsonResponse(
+                {"error": "Only staff may refresh every publisher"}, status=403
+            )
+        notify_workers()
+        return JsonResponse({"jobs": [job_status(job) for job in queued]}, status=202)
+
+
+class JobStatus(View):
+    def get(self, request, job_id):
+        job = get_object_or_404(apps.get_model("iati_fetch", "Job"), pk=job_id)
+        return JsonResponse(job_status(job))
+
+
+class OrganisationDelete(UserPassesTestMixin, TemplateView):
+    """
+    Delete the organisations and activities of each publisher named by a
+    "publisher" parameter, or of every publisher if there are none: asks first
+    (on GET), then deletes (on POST) and reports how many rows went. Deleting
+    every publisher is queued as a job instead. For staff only.
+    """
+
+    template_name = "iati_fetch/organisation_delete.html"
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_publishers(self) -> List[str]:
+        params = (
+            self.request.POST if self.request.method == "POST" else self.request.GET
+        )
+        return params.getlist("publisher")
+
+    def get_context_data(self, **kwargs):
+        publishers = self.get_publishers()
+        organisations, activities = apps.get_model(
+            "iati_fetch", "Organisation"
+        ).published(publishers)
+        return {
+            "publishers": publishers,
+            "organisation_count": organisations.count(),
+            "activity_count": activities.count(),
+        }
+
+    def post(self, request):
+        publishers = self.get_publishers()
+        if not publishers:
+            job = jobs.enqueue_delete_all()
+            notify_workers()
+            return self.render_to_response({"job": job_status(job)}, status=202)
+        deleted = apps.get_model("iati_fetch", "Organisation").delete_published(
+            publishers
+        )
+        return self.render_to_response({"publishers": publishers, "deleted": deleted})
@@ -19,6 +19,8 @@ application = ProtocolTypeRouter(
                     url(r"^iati/$", consumers.IatiConsumer),
                     url(r"^echo/$", consumers.EchoConsumer),
                     url(r"^fetchurl/$", consumers.FetchUrl),
+                    url(r"^ingest/$", consumers.IngestConsumer),
+                    url(r"^activities/$", consumers.IatiActivitiesConsumer),
                 ]
             )
         ),